@@ -7,7 +7,6 @@
 # - allow user to change colors of charges
 # - allow user to save charge arangment
 # - give focus back to window when charge is deselected
-# - figure out what to do when charges overlap (stop simulation?)
 # - allow user to copy and paste charges
 # - mark selected charge
 # - allow user to select charges with keyboard arrows
@@ -17,234 +16,4108 @@
 # - possible error with automatic stop
 
 from Tkinter import *
-import cPickle, FileDialog, math, os.path, time, tkFont, tkMessageBox
+import argparse, array, bisect, collections, cPickle, csv, FileDialog, hashlib, json, math, mmap, multiprocessing, os, os.path, Queue, random, struct, sys, tempfile, threading, time, tkFont, tkMessageBox
+
+# numpy is optional - without it only the pure Python engine is available
+try:
+    import numpy
+except(ImportError):
+    numpy = None
+
+SETTINGS_FILE = "settings.dat" # file settings are saved in
+TRAJECTORY_DIR = "trajectories" # directory finished runs are cached in
+AUTOSAVE_FILE = "autosave.efc" # file runs are checkpointed to
 
 # default settings
 DEFAULT = {
-    "grid"    : False,
-    "spacing" : 40,
-    "minutes" : False}
+    "grid"       : False,
+    "spacing"    : 40,
+    "minutes"    : False,
+    "engine"     : "numpy",
+    "rounding"   : True,
+    "theta"      : 0.5,
+    "dt"         : 0.025,
+    "turbo"      : False,
+    "integrator" : "euler",
+    "tolerance"  : 1e-5,
+    "cache"      : False,
+    "overlay"    : "off",
+    "binary"     : False,
+    "record"     : True,
+    "profiler"   : False,
+    "autosave"   : 0,
+    "mesh"       : "cic",
+    "p3m"        : True,
+    "encounters" : "count",
+    "radius"     : 20,
+    "escape"     : 3,
+    "autostop"   : False}
+
+def load_settings(filename=SETTINGS_FILE):
+    """ Return settings from file. Creates file with default settings if it
+        does not exist. """
+    try:
+        file = open(filename, "r")
+    except(IOError):
+        save_settings(DEFAULT, filename)
+        return dict(DEFAULT)
+    # start from defaults so settings files from older versions still work
+    settings = dict(DEFAULT)
+    settings.update(cPickle.load(file))
+    file.close()
+    return settings
+
+def save_settings(settings, filename=SETTINGS_FILE):
+    """ Save settings to file. """
+    file = open(filename, "w")
+    cPickle.dump(settings, file)
+    file.close()
+
+def number(string):
+    """ Converts string to int if it holds a whole number, otherwise float. """
+    try:
+        return int(string)
+    except(ValueError):
+        return float(string)
+
+def read_array(file, typecode, n):
+    """ Read 'n' little-endian values of type 'typecode' from file into an
+        array. """
+    values = array.array(typecode)
+    values.fromfile(file, n)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def write_array(file, values):
+    """ Write array to file with little-endian values. """
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    values.tofile(file)
+
+def to_numpy(values):
+    """ Return numpy array of float sequence 'values'. Arrays from the array
+        module are shared rather than copied. """
+    if type(values) == array.array and len(values) > 0:
+        return numpy.frombuffer(values, values.typecode)
+    return numpy.array(values, float)
+
+def gather(values, source, idx):
+    """ Append items of array 'source' at indexes 'idx' to array 'values'. """
+    if numpy != None and len(source) > 0:
+        values.fromstring(to_numpy(source)[idx].tostring())
+    else:
+        values.extend([source[i] for i in idx])
+
+def config(num):
+    """ Converts float to string with ".0" stripped off the end. """
+    string = str(num).rstrip("0").rstrip(".")
+    if string == "-0":
+        string = "0"
+    return string
+
+class ChargeStore(object):
+    """ Data of a set of charges kept in arrays with one entry per charge.
+        Charge, Moveable and Tracer objects are views of an entry. Positions are
+        double buffered: engines read x and y, write new positions to next_x
+        and next_y and then call flip. """
+    # names and type codes of arrays
+    FIELDS = (("q", "d"), ("x", "d"), ("y", "d"), ("next_x", "d"),
+              ("next_y", "d"), ("x0", "d"), ("y0", "d"), ("dx", "d"),
+              ("dy", "d"), ("dx0", "d"), ("dy0", "d"), ("moveable", "B"),
+              ("active", "B"))
+
+    def __init__(self):
+        """ Initialize store and set variables. """
+        self.views = []                  # Charge, Moveable or Tracer viewing each entry
+        self.q = array.array("d")        # charges
+        self.x = array.array("d")        # x coordinates
+        self.y = array.array("d")        # y coordinates
+        self.next_x = array.array("d")   # x coordinates being calculated
+        self.next_y = array.array("d")   # y coordinates being calculated
+        self.x0 = array.array("d")       # initial x coordinates
+        self.y0 = array.array("d")       # initial y coordinates
+        self.dx = array.array("d")       # x-components of velocity
+        self.dy = array.array("d")       # y-components of velocity
+        self.dx0 = array.array("d")      # initial x-components of velocity
+        self.dy0 = array.array("d")      # initial y-components of velocity
+        self.moveable = array.array("B") # MOVEABLE of the kind of each charge
+        self.active = array.array("B")   # 0 for charges left out of the run
+                                         # (see deactivate), otherwise 1
+        self._moveables = None           # indexes of active moveable charges
+                                         # (None if out of date)
+        self._sources = None             # indexes of active charges that are
+                                         # not tracers (None if out of date)
+        self.edits = 0                   # changes made to charges
+
+    def __len__(self):
+        return len(self.views)
+
+    def add(self, view, charge, x, y):
+        """ Add an entry for 'view' at rest at 'x', 'y' and return its
+            index. """
+        self.views.append(view)
+        self.q.append(charge)
+        for name in ("x", "next_x", "x0"):
+            getattr(self, name).append(x)
+        for name in ("y", "next_y", "y0"):
+            getattr(self, name).append(y)
+        for name in ("dx", "dy", "dx0", "dy0"):
+            getattr(self, name).append(0.0)
+        self.moveable.append(view.MOVEABLE)
+        self.active.append(1)
+        self._moveables = None
+        self._sources = None
+        self.edits += 1
+        return len(self.views) - 1
+
+    def extend(self, kinds, charges, xs, ys, dx0s, dy0s):
+        """ Add entries for many charges at once and return index of the
+            first. Each array grows once. Views of the new entries are None
+            until they are set (see Charge.view). """
+        first = len(self.views)
+        self.q.extend(charges)
+        for name in ("x", "next_x", "x0"):
+            getattr(self, name).extend(xs)
+        for name in ("y", "next_y", "y0"):
+            getattr(self, name).extend(ys)
+        self.dx.extend(dx0s)
+        self.dx0.extend(dx0s)
+        self.dy.extend(dy0s)
+        self.dy0.extend(dy0s)
+        self.moveable.extend(kinds)
+        self.active.extend(array.array("B", [1]) * len(kinds))
+        self.views.extend([None] * len(kinds))
+        self._moveables = None
+        self._sources = None
+        self.edits += 1
+        return first
+
+    def remove(self, slot):
+        """ Remove entry 'slot'. The last entry takes its place and the view
+            of the removed entry is given a store of its own. """
+        self.detach(slot)
+        last = len(self.views) - 1
+        for name, typecode in ChargeStore.FIELDS:
+            values = getattr(self, name)
+            values[slot] = values[last]
+            values.pop()
+        view = self.views.pop()
+        if slot != last:
+            self.views[slot] = view
+            view.slot = slot
+        self._moveables = None
+        self._sources = None
+        self.edits += 1
+
+    def remove_many(self, views):
+        """ Remove entries of all charges in 'views'. Order of remaining
+            entries is kept. """
+        doomed = set(views)
+        keep = []
+        for i in xrange(len(self.views)):
+            if self.views[i] in doomed:
+                self.detach(i)
+            else:
+                keep.append(i)
+        for name, typecode in ChargeStore.FIELDS:
+            values = getattr(self, name)
+            setattr(self, name, array.array(typecode, [values[i] for i in keep]))
+        self.views = [self.views[i] for i in keep]
+        for i in xrange(len(self.views)):
+            self.views[i].slot = i
+        self._moveables = None
+        self._sources = None
+        self.edits += 1
+
+    def detach(self, slot):
+        """ Copy entry 'slot' to a new store and point its view there. """
+        view = self.views[slot]
+        store = ChargeStore()
+        store.views.append(view)
+        for name, typecode in ChargeStore.FIELDS:
+            getattr(store, name).append(getattr(self, name)[slot])
+        view.store = store
+        view.slot = 0
+
+    def moveables(self):
+        """ Return list of indexes of active moveable charges (tracers
+            included). """
+        if self._moveables == None:
+            self._moveables = [i for i in xrange(len(self.moveable))
+                               if self.moveable[i] and self.active[i]]
+        return self._moveables
+
+    def sources(self):
+        """ Return list of indexes of active charges that exert forces (all
+            but tracers). """
+        if self._sources == None:
+            self._sources = [i for i in xrange(len(self.moveable))
+                             if self.moveable[i] != Tracer.MOVEABLE and
+                             self.active[i]]
+        return self._sources
+
+    def has_tracers(self):
+        """ Return whether or not some charges in the store exert no forces
+            (tracers or deactivated charges), so engines must only use
+            sources. """
+        return len(self.sources()) != len(self.moveable)
+
+    def deactivate(self, slot):
+        """ Leave entry 'slot' out of moveables and sources until activate
+            or reset is called. Its position is the same in both buffers so
+            flip leaves it where it is. """
+        self.active[slot] = 0
+        self.next_x[slot] = self.x[slot]
+        self.next_y[slot] = self.y[slot]
+        self._moveables = None
+        self._sources = None
+
+    def activate(self):
+        """ Bring back all deactivated entries. """
+        if 0 in self.active:
+            self.active[:] = array.array("B", [1]) * len(self.active)
+            self._moveables = None
+            self._sources = None
+
+    def flip(self):
+        """ Make positions calculated in next_x and next_y current. Fixed
+            charges are the same in both buffers. """
+        self.x, self.next_x = self.next_x, self.x
+        self.y, self.next_y = self.next_y, self.y
+
+    def place(self, slot, x, y):
+        """ Put entry 'slot' at 'x', 'y' and make that its initial position. """
+        self.x[slot] = self.next_x[slot] = self.x0[slot] = x
+        self.y[slot] = self.next_y[slot] = self.y0[slot] = y
+        self.edits += 1
+
+    def reset(self):
+        """ Set all positions and velocities to initial ones and bring back
+            deactivated entries. """
+        self.activate()
+        self.x[:] = self.x0
+        self.y[:] = self.y0
+        self.next_x[:] = self.x0
+        self.next_y[:] = self.y0
+        self.reset_vel()
+
+    def reset_vel(self):
+        """ Set all velocities to initial velocities. """
+        self.dx[:] = self.dx0
+        self.dy[:] = self.dy0
+
+    def array(self, name):
+        """ Return numpy array sharing memory with array 'name'. The result
+            must not be kept after the store grows or shrinks. """
+        values = getattr(self, name)
+        if len(values) == 0:
+            return numpy.zeros(0, values.typecode)
+        return numpy.frombuffer(values, values.typecode)
+
+class Charge(object):
+    """ A basic charge. The data of the charge is kept in a ChargeStore. """
+    __slots__ = ("store", "slot", "canvas", "id", "index", "_px", "_py",
+                 "_drawn", "on_change")
+    RADIUS = 10          # radius of charge
+    MOVEABLE = 0         # value of moveable array in store
+    posColor = "#ff0000" # color of positive charge
+    negColor = "#0000ff" # color of negative charge
+    neuColor = "#00e000" # color of neutral charge
+
+    def __init__(self, charge=0.0, x=0, y=0, store=None):
+        """ Initialize charge and set variables. The charge gets a store of
+            its own if 'store' is None. """
+        if store == None:
+            store = ChargeStore()
+        self.store = store     # arrays holding data of charge
+        self.slot = store.add(self, charge, x, y) # index of charge in store
+        self.canvas = None     # canvas charge is drawn on (None if headless)
+        self.id = None         # id of image on canvas
+        self.index = None      # dictionary of charges by image id
+        self._px = None        # pixel x coordinate image is drawn at
+        self._py = None        # pixel y coordinate image is drawn at
+        self._drawn = None     # color image is drawn with
+        self.on_change = None  # called with charge when position or charge
+                               # is changed by user
+
+    def draw(self, canvas=None, index=None):
+        """ Draw image on screen and add it to 'index'. Uses last canvas and
+            index if they are None. """
+        if canvas != None:
+            self.canvas = canvas
+        if index != None:
+            self.index = index
+        self._px = int(round(self.x))
+        self._py = int(round(self.y))
+        self._drawn = self.color
+        self.id = self.canvas.create_oval(self._px-self.RADIUS,
+                                          self._py-self.RADIUS,
+                                          self._px+self.RADIUS,
+                                          self._py+self.RADIUS,
+                                          outline=self._drawn,
+                                          fill=self._drawn, tag="charge")
+        if self.index != None:
+            self.index[self.id] = self
+
+    def view(cls, store, slot):
+        """ Return new charge viewing entry 'slot' already in 'store' (used
+            to add many charges at once). """
+        chg = cls.__new__(cls)
+        chg.store = store
+        chg.slot = slot
+        chg.canvas = chg.id = chg.index = None
+        chg._px = chg._py = chg._drawn = chg.on_change = None
+        store.views[slot] = chg
+        return chg
+    view = classmethod(view)
+
+    def erase(self):
+        """ Remove image from screen. """
+        if self.id != None:
+            self.canvas.delete(self.id)
+            if self.index != None:
+                self.index.pop(self.id, None)
+            self.id = None
+
+    def update(self, x=None, y=None):
+        """ Syncs up image with x and y values (or with 'x' and 'y' if they
+            are given). The image is moved rather than recreated and is left
+            alone if its pixel position has not changed. """
+        if self.canvas == None:
+            return
+        if self.id == None:
+            self.draw()
+            return
+        px = int(round(self.x if x == None else x))
+        py = int(round(self.y if y == None else y))
+        if px != self._px or py != self._py:
+            self._px = px
+            self._py = py
+            self.canvas.coords(self.id, px-self.RADIUS, py-self.RADIUS,
+                               px+self.RADIUS, py+self.RADIUS)
+        # only recolor when sign of charge changes
+        color = self.color
+        if color != self._drawn:
+            self._drawn = color
+            self.canvas.itemconfig(self.id, outline=color, fill=color)
+
+    def place(self, x, y):
+        """ Move charge to 'x', 'y' and update. """
+        self.store.place(self.slot, x, y)
+        self.update()
+        self.changed()
+
+    def changed(self):
+        """ Call on_change after position or charge is changed. """
+        if self.on_change != None:
+            self.on_change(self)
+
+    ### Properties ###
+    ## x
+    def get_x(self):
+        return self.store.x[self.slot]
+    x = property(get_x)
+    ## y
+    def get_y(self):
+        return self.store.y[self.slot]
+    y = property(get_y)
+    ## active
+    def get_active(self):
+        return self.store.active[self.slot] != 0
+    active = property(get_active)
+    ## color
+    def get_color(self):
+        if self.charge > 0:
+            return Charge.posColor
+        elif self.charge < 0:
+            return Charge.negColor
+        else:
+            return Charge.neuColor
+    color = property(get_color)
+    ## charge
+    def get_charge(self):
+        return self.store.q[self.slot]
+    def set_charge(self, new_charge):
+        self.store.q[self.slot] = new_charge
+        self.store.edits += 1
+        self.changed()
+    charge = property(get_charge, set_charge)
+
+class Moveable(Charge):
+    """ A charge that will move in an E-field. """
+    __slots__ = ()
+    FIELD_CONSTANT = 800 # used to adjust force between charges
+    PRECISION = 5        # number of decimal places to round acceleration to
+    MOVEABLE = 1         # value of moveable array in store
+    def __init__(self, charge=0.0, x=0, y=0, dx0=0.0, dy0=0.0, store=None):
+        """ Initialize charge and set variables. """
+        Charge.__init__(self, charge, x, y, store)
+        self.dx0 = dx0
+        self.dy0 = dy0
+
+    def update_pos(self, rounded=True, h=1.0):
+        """ Change velocity based on forces from E-field of the other charges
+            in the store and write new position to the next buffer of the
+            store. If 'rounded' is True each force component is rounded to
+            PRECISION places. 'h' is the length of the step in nominal
+            steps. """
+        store = self.store
+        i = self.slot
+        x = store.x
+        y = store.y
+        q = store.q
+        dx = store.dx[i]
+        dy = store.dy[i]
+        for j in xrange(len(q)):
+            if j != i:
+                r2 = math.pow(x[i] - x[j], 2) + math.pow(y[i] - y[j], 2)
+                if r2 == 0:
+                    continue # no direction between charges at same point
+                force = Moveable.FIELD_CONSTANT * q[i] * q[j] / r2
+                angle = math.atan2(y[i] - y[j], x[i] - x[j])
+                if rounded:
+                    dx += round(force * math.cos(angle), Moveable.PRECISION) * h
+                    dy += round(force * math.sin(angle), Moveable.PRECISION) * h
+                else:
+                    dx += force * math.cos(angle) * h
+                    dy += force * math.sin(angle) * h
+        store.dx[i] = dx
+        store.dy[i] = dy
+        # update coordinates (other charges still see the old ones until
+        # the store is flipped)
+        store.next_x[i] = x[i] + dx * h
+        store.next_y[i] = y[i] + dy * h
+
+    def reset(self):
+        """ Reset position and velocity and update. """
+        self.reset_pos()
+        self.reset_vel()
+        self.update()
+
+    def reset_pos(self):
+        """ Set x and y to initial x and y. """
+        store = self.store
+        store.x[self.slot] = store.next_x[self.slot] = store.x0[self.slot]
+        store.y[self.slot] = store.next_y[self.slot] = store.y0[self.slot]
+
+    def reset_vel(self):
+        """ Set velocity to initial velocity. """
+        store = self.store
+        store.dx[self.slot] = store.dx0[self.slot]
+        store.dy[self.slot] = store.dy0[self.slot]
+
+    ### Properties ###
+    ## dx
+    def get_dx(self):
+        return self.store.dx[self.slot]
+    dx = property(get_dx)
+    ## dy
+    def get_dy(self):
+        return self.store.dy[self.slot]
+    dy = property(get_dy)
+
+    ## x0
+    def get_x0(self):
+        return self.store.x0[self.slot]
+    x0 = property(get_x0)
+    ## y0
+    def get_y0(self):
+        return self.store.y0[self.slot]
+    y0 = property(get_y0)
+
+    ## dx0
+    def get_dx0(self):
+        return self.store.dx0[self.slot]
+    def set_dx0(self, new_dx0):
+        self.store.dx0[self.slot] = self.store.dx[self.slot] = new_dx0
+        self.store.edits += 1
+    dx0 = property(get_dx0, set_dx0)
+    ## dy0
+    def get_dy0(self):
+        return self.store.dy0[self.slot]
+    def set_dy0(self, new_dy0):
+        self.store.dy0[self.slot] = self.store.dy[self.slot] = new_dy0
+        self.store.edits += 1
+    dy0 = property(get_dy0, set_dy0)
+
+class Tracer(Moveable):
+    """ A test charge that is moved by the field of the other charges but
+        does not act on anything, so many tracers cost little. """
+    __slots__ = ()
+    RADIUS = 3           # radius of tracer
+    MOVEABLE = 2         # value of moveable array in store
+    posColor = "#ff9090" # color of positive tracer
+    negColor = "#9090ff" # color of negative tracer
+    neuColor = "#90e090" # color of neutral tracer
+
+    ### Properties ###
+    ## color
+    def get_color(self):
+        if self.charge > 0:
+            return Tracer.posColor
+        elif self.charge < 0:
+            return Tracer.negColor
+        else:
+            return Tracer.neuColor
+    color = property(get_color)
+
+class Engine(object):
+    """ Base class for force engines. An engine advances every moveable
+        charge by one simulation step. """
+    NAME = ""      # name shown in the Settings menu
+    NUMPY = False  # whether or not engine needs numpy
+
+    def __init__(self, rounded=True, **options):
+        """ Initialize engine and set variables. 'options' holds engine
+            specific settings and is ignored by engines that have none. """
+        self.rounded = rounded  # whether or not to round forces to PRECISION
+        self.background = None  # cached field of fixed charges (None if not
+                                # cached)
+
+    def step(self, store, h=1.0):
+        """ Move all moveable charges in 'store' by one step of length 'h'
+            (in nominal steps). """
+        idx = store.moveables()
+        if len(idx) == 0:
+            return
+        ax, ay = self.accel(store, idx)
+        x = store.x
+        y = store.y
+        dx = store.dx
+        dy = store.dy
+        for k in xrange(len(idx)):
+            i = idx[k]
+            dx[i] += ax[k] * h
+            dy[i] += ay[k] * h
+            store.next_x[i] = x[i] + dx[i] * h
+            store.next_y[i] = y[i] + dy[i] * h
+        store.flip()
+
+    def accel(self, store, idx):
+        """ Return lists of the x and y changes in velocity of the charges at
+            indexes 'idx' of 'store' caused by all other charges. """
+        if store.has_tracers():
+            return self.accel_tracers(store, idx)
+        if self.background == None:
+            return self.direct(store.x, store.y, store.q, idx)
+        # forces between moveable charges plus cached field of fixed charges
+        x = [store.x[i] for i in idx]
+        y = [store.y[i] for i in idx]
+        q = [store.q[i] for i in idx]
+        ax, ay = self.direct(x, y, q, range(len(idx)))
+        ex, ey = self.background.fields(x, y)
+        for k in xrange(len(idx)):
+            ax[k] += q[k] * ex[k]
+            ay[k] += q[k] * ey[k]
+        return ax, ay
+
+    def accel_tracers(self, store, idx):
+        """ Return lists of the x and y changes in velocity of the charges at
+            indexes 'idx' of 'store' caused by all other charges except
+            tracers. """
+        kinds = store.moveable
+        if self.background == None:
+            sources = store.sources()
+        else:
+            # cached field stands in for fixed charges
+            sources = [i for i in store.sources() if kinds[i]]
+        x = [store.x[i] for i in sources]
+        y = [store.y[i] for i in sources]
+        q = [store.q[i] for i in sources]
+        position = dict([(sources[k], k) for k in xrange(len(sources))])
+        real = [k for k in xrange(len(idx)) if kinds[idx[k]] != Tracer.MOVEABLE]
+        tracers = [k for k in xrange(len(idx)) if kinds[idx[k]] == Tracer.MOVEABLE]
+        ax = [0.0] * len(idx)
+        ay = [0.0] * len(idx)
+        if len(real) > 0:
+            rx, ry = self.direct(x, y, q, [position[idx[k]] for k in real])
+            for k in xrange(len(real)):
+                ax[real[k]] = rx[k]
+                ay[real[k]] = ry[k]
+        if len(tracers) > 0:
+            tx, ty = self.probe(x, y, q, [store.x[idx[k]] for k in tracers],
+                                [store.y[idx[k]] for k in tracers],
+                                [store.q[idx[k]] for k in tracers])
+            for k in xrange(len(tracers)):
+                ax[tracers[k]] = tx[k]
+                ay[tracers[k]] = ty[k]
+        if self.background != None:
+            ex, ey = self.background.fields([store.x[i] for i in idx],
+                                            [store.y[i] for i in idx])
+            for k in xrange(len(idx)):
+                ax[k] += store.q[idx[k]] * ex[k]
+                ay[k] += store.q[idx[k]] * ey[k]
+        return ax, ay
+
+    def direct(self, x, y, q, idx):
+        """ Return lists of the x and y changes in velocity of the charges at
+            indexes 'idx' caused by all charges at 'x', 'y' with charges
+            'q'. """
+        raise NotImplementedError
+
+    def probe(self, x, y, q, px, py, pq):
+        """ Return lists of the x and y changes in velocity of test charges
+            'pq' at 'px', 'py' caused by charges at 'x', 'y' with charges
+            'q'. """
+        ax = []
+        ay = []
+        n = len(x)
+        for k in xrange(len(px)):
+            fx = fy = 0.0
+            for j in xrange(n):
+                rx = px[k] - x[j]
+                ry = py[k] - y[j]
+                r2 = rx * rx + ry * ry
+                if r2 == 0:
+                    continue
+                scale = Moveable.FIELD_CONSTANT * pq[k] * q[j] / (r2 * math.sqrt(r2))
+                if self.rounded:
+                    fx += round(scale * rx, Moveable.PRECISION)
+                    fy += round(scale * ry, Moveable.PRECISION)
+                else:
+                    fx += scale * rx
+                    fy += scale * ry
+            ax.append(fx)
+            ay.append(fy)
+        return ax, ay
+
+    def key(self):
+        """ Return settings (other than rounding and opening angle) that
+            change the results of the engine. """
+        return ()
+
+    def measure_error(self, store):
+        """ Return the maximum and root mean square relative error of this
+            engine's accelerations compared to an exact engine without
+            rounding, and the name of that engine (the NumPy engine, or the
+            Python engine if numpy is missing). """
+        exact = make_engine("numpy", False)
+        idx = store.moveables()
+        if len(idx) == 0:
+            return 0.0, 0.0, exact.NAME
+        ax, ay = self.accel(store, idx)
+        ex, ey = exact.accel(store, idx)
+        max_err = total = 0.0
+        for i in xrange(len(idx)):
+            mag = math.hypot(ex[i], ey[i])
+            if mag == 0:
+                continue
+            err = math.hypot(ax[i] - ex[i], ay[i] - ey[i]) / mag
+            max_err = max(max_err, err)
+            total += err * err
+        return max_err, math.sqrt(total / len(idx)), exact.NAME
+
+class PythonEngine(Engine):
+    """ Engine that loops over every pair of charges in pure Python. """
+    NAME = "Python"
+
+    def step(self, store, h=1.0):
+        """ Move all moveable charges in 'store' by one step of length 'h'
+            (in nominal steps). """
+        if self.background != None or store.has_tracers():
+            return Engine.step(self, store, h)
+        # update positions of all moveable charges
+        for i in store.moveables():
+            store.views[i].update_pos(self.rounded, h)
+        # make new positions current
+        store.flip()
+
+    def direct(self, x, y, q, idx):
+        """ Return lists of the x and y changes in velocity of the charges at
+            indexes 'idx' caused by all charges at 'x', 'y' with charges
+            'q'. """
+        ax = []
+        ay = []
+        n = len(x)
+        for i in idx:
+            fx = fy = 0.0
+            for j in xrange(n):
+                rx = x[i] - x[j]
+                ry = y[i] - y[j]
+                r2 = rx * rx + ry * ry
+                if r2 == 0:
+                    continue
+                scale = Moveable.FIELD_CONSTANT * q[i] * q[j] / (r2 * math.sqrt(r2))
+                if self.rounded:
+                    fx += round(scale * rx, Moveable.PRECISION)
+                    fy += round(scale * ry, Moveable.PRECISION)
+                else:
+                    fx += scale * rx
+                    fy += scale * ry
+            ax.append(fx)
+            ay.append(fy)
+        return ax, ay
+
+class NumpyEngine(Engine):
+    """ Engine that keeps charge data in arrays and computes all pairwise
+        forces for a step at once. """
+    NAME = "NumPy"
+    NUMPY = True
+    BLOCK = 512 # moveable charges per batch (limits memory use)
+
+    def step(self, store, h=1.0):
+        """ Move all moveable charges in 'store' by one step of length 'h'
+            (in nominal steps). """
+        if self.background != None:
+            return Engine.step(self, store, h)
+        idx = store.moveables()
+        if len(idx) == 0:
+            return
+        idx = numpy.array(idx)
+        x = store.array("x")
+        y = store.array("y")
+        dx = store.array("dx")
+        dy = store.array("dy")
+        if store.has_tracers():
+            ax, ay = self.accel_split(store, idx)
+        else:
+            ax, ay = self.accel_arrays(x, y, store.array("q"), idx)
+        dx[idx] += ax * h
+        dy[idx] += ay * h
+        store.array("next_x")[idx] = x[idx] + dx[idx] * h
+        store.array("next_y")[idx] = y[idx] + dy[idx] * h
+        store.flip()
+
+    def direct(self, x, y, q, idx):
+        """ Return lists of the x and y changes in velocity of the charges at
+            indexes 'idx' caused by all charges at 'x', 'y' with charges
+            'q'. """
+        ax, ay = self.accel_arrays(to_numpy(x), to_numpy(y), to_numpy(q),
+                                   numpy.array(idx, int))
+        return ax.tolist(), ay.tolist()
+
+    def probe(self, x, y, q, px, py, pq):
+        """ Return lists of the x and y changes in velocity of test charges
+            'pq' at 'px', 'py' caused by charges at 'x', 'y' with charges
+            'q'. """
+        ax, ay = self.probe_arrays(to_numpy(x), to_numpy(y), to_numpy(q),
+                                   to_numpy(px), to_numpy(py), to_numpy(pq))
+        return ax.tolist(), ay.tolist()
+
+    def accel_split(self, store, idx):
+        """ Return change in velocity of the charges at 'idx' of 'store'
+            caused by all active charges except tracers. Tracers only meet
+            the other charges, so they cost O(charges * tracers). """
+        kinds = store.array("moveable")
+        sources = numpy.array(store.sources(), int)
+        x = store.array("x")
+        y = store.array("y")
+        q = store.array("q")
+        tracers = kinds[idx] == Tracer.MOVEABLE
+        real = idx[~tracers]
+        probes = idx[tracers]
+        ax = numpy.empty(len(idx))
+        ay = numpy.empty(len(idx))
+        ax[~tracers], ay[~tracers] = self.accel_arrays(
+            x[sources], y[sources], q[sources],
+            numpy.searchsorted(sources, real))
+        ax[tracers], ay[tracers] = self.probe_arrays(
+            x[sources], y[sources], q[sources], x[probes], y[probes],
+            q[probes])
+        return ax, ay
+
+    def probe_arrays(self, x, y, q, px, py, pq):
+        """ Return change in velocity of test charges 'pq' at 'px', 'py'
+            caused by charges at 'x', 'y' with charges 'q'. """
+        ax = numpy.empty(len(px))
+        ay = numpy.empty(len(px))
+        for start in xrange(0, len(px), NumpyEngine.BLOCK):
+            end = start + NumpyEngine.BLOCK
+            rx = px[start:end, None] - x
+            ry = py[start:end, None] - y
+            r2 = rx * rx + ry * ry
+            r2[r2 == 0] = numpy.inf
+            scale = Moveable.FIELD_CONSTANT * pq[start:end, None] * q / (r2 * numpy.sqrt(r2))
+            fx = scale * rx
+            fy = scale * ry
+            if self.rounded:
+                fx = numpy.round(fx, Moveable.PRECISION)
+                fy = numpy.round(fy, Moveable.PRECISION)
+            ax[start:end] = fx.sum(1)
+            ay[start:end] = fy.sum(1)
+        return ax, ay
+
+    def accel_arrays(self, x, y, q, idx):
+        """ Return change in velocity of the charges at 'idx' caused by all
+            charges at 'x', 'y' with charges 'q'. """
+        ax = numpy.empty(len(idx))
+        ay = numpy.empty(len(idx))
+        for start in xrange(0, len(idx), NumpyEngine.BLOCK):
+            rows = idx[start:start+NumpyEngine.BLOCK]
+            rx = x[rows, None] - x
+            ry = y[rows, None] - y
+            r2 = rx * rx + ry * ry
+            # charges do not act on themselves or on charges on top of them
+            r2[r2 == 0] = numpy.inf
+            # F = k * q1 * q2 / r^2 in the direction of (rx, ry) / r
+            scale = Moveable.FIELD_CONSTANT * q[rows, None] * q / (r2 * numpy.sqrt(r2))
+            fx = scale * rx
+            fy = scale * ry
+            if self.rounded:
+                fx = numpy.round(fx, Moveable.PRECISION)
+                fy = numpy.round(fy, Moveable.PRECISION)
+            ax[start:start+NumpyEngine.BLOCK] = fx.sum(1)
+            ay[start:start+NumpyEngine.BLOCK] = fy.sum(1)
+        return ax, ay
+
+class _Node(object):
+    """ Square region of a Barnes-Hut quadtree. The charges in the region are
+        summed into a positive and a negative point charge, which keeps the
+        monopole and dipole moments of the region. """
+    __slots__ = ("x1", "y1", "x2", "y2", "size", "children", "members",
+                 "qp", "px", "py", "qn", "nx", "ny", "qa", "mx", "my")
+
+class BarnesHutEngine(Engine):
+    """ Engine that groups far away charges with a quadtree. Cost per step is
+        about O(N log N) instead of O(N^2). """
+    NAME = "Barnes-Hut"
+    LEAF_SIZE = 8  # maximum charges in a leaf node
+    MAX_DEPTH = 32 # maximum tree depth (stops splitting of stacked charges)
+
+    def __init__(self, rounded=True, theta=0.5, **options):
+        """ Initialize engine and set variables. """
+        Engine.__init__(self, rounded)
+        self.theta = theta # opening angle (0 gives the exact result)
+
+    def direct(self, x, y, q, idx):
+        """ Return lists of the x and y changes in velocity of the charges at
+            indexes 'idx' caused by all charges at 'x', 'y' with charges
+            'q'. """
+        root = self.build(x, y, q)
+        fx = {}
+        fy = {}
+        targets = set(idx)
+        # walk the tree once for each leaf holding targets
+        stack = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.members == None:
+                stack.extend(node.children)
+                continue
+            group = [i for i in node.members if i in targets]
+            if len(group) > 0:
+                self.accel_group(node, group, x, y, q, root, fx, fy)
+        return [fx[i] for i in idx], [fy[i] for i in idx]
+
+    def build(self, x, y, q):
+        """ Return root node of a quadtree over charges at 'x', 'y'. """
+        if len(x) == 0:
+            x1 = y1 = x2 = y2 = 0.0
+        else:
+            x1 = min(x)
+            y1 = min(y)
+            x2 = max(x)
+            y2 = max(y)
+        size = max(x2 - x1, y2 - y1, 1.0)
+        return self.build_node(range(len(x)), x, y, q, x1, y1, size, 0)
+
+    def build_node(self, members, x, y, q, x1, y1, size, depth):
+        """ Return node for square at 'x1', 'y1' holding charges 'members'. """
+        node = _Node()
+        node.x1 = x1
+        node.y1 = y1
+        node.x2 = x1 + size
+        node.y2 = y1 + size
+        node.size = size
+        node.children = []
+        if len(members) <= BarnesHutEngine.LEAF_SIZE or depth >= BarnesHutEngine.MAX_DEPTH:
+            node.members = members
+            qp = px = py = qn = nx = ny = 0.0
+            for i in members:
+                if q[i] > 0:
+                    qp += q[i]
+                    px += q[i] * x[i]
+                    py += q[i] * y[i]
+                elif q[i] < 0:
+                    qn += q[i]
+                    nx += q[i] * x[i]
+                    ny += q[i] * y[i]
+        else:
+            node.members = None
+            half = size / 2.0
+            cx = x1 + half
+            cy = y1 + half
+            quads = ([], [], [], [])
+            for i in members:
+                quads[(x[i] >= cx) + 2 * (y[i] >= cy)].append(i)
+            qp = px = py = qn = nx = ny = 0.0
+            for k in xrange(4):
+                if len(quads[k]) == 0:
+                    continue
+                child = self.build_node(quads[k], x, y, q, x1 + half * (k % 2),
+                                        y1 + half * (k // 2), half, depth + 1)
+                node.children.append(child)
+                qp += child.qp
+                px += child.qp * child.px
+                py += child.qp * child.py
+                qn += child.qn
+                nx += child.qn * child.nx
+                ny += child.qn * child.ny
+        # centers of positive and negative charge
+        node.qp = qp
+        node.qn = qn
+        node.px = px / qp if qp != 0 else 0.0
+        node.py = py / qp if qp != 0 else 0.0
+        node.nx = nx / qn if qn != 0 else 0.0
+        node.ny = ny / qn if qn != 0 else 0.0
+        # center of absolute charge (used for opening test)
+        node.qa = qp - qn
+        if node.qa != 0:
+            node.mx = (qp * node.px - qn * node.nx) / node.qa
+            node.my = (qp * node.py - qn * node.ny) / node.qa
+        else:
+            node.mx = node.x1 + size / 2.0
+            node.my = node.y1 + size / 2.0
+        return node
+
+    def accel_group(self, leaf, group, x, y, q, root, fx, fy):
+        """ Add forces on charges 'group' in node 'leaf' to 'fx' and 'fy'. """
+        k = Moveable.FIELD_CONSTANT
+        places = Moveable.PRECISION if self.rounded else None
+        # find nodes far enough away to use as a whole and charges close
+        # enough to need exact forces
+        near = []
+        far = []
+        stack = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.qa == 0:
+                continue
+            if node.members != None:
+                near.extend(node.members)
+                continue
+            # distance from node's center of charge to the leaf
+            dx = max(leaf.x1 - node.mx, 0.0, node.mx - leaf.x2)
+            dy = max(leaf.y1 - node.my, 0.0, node.my - leaf.y2)
+            dist = math.sqrt(dx * dx + dy * dy)
+            inside = (node.x1 <= leaf.x1 and leaf.x2 <= node.x2 and
+                      node.y1 <= leaf.y1 and leaf.y2 <= node.y2)
+            if not inside and dist > 0 and node.size < self.theta * dist:
+                if node.qp != 0:
+                    far.append((node.px, node.py, node.qp))
+                if node.qn != 0:
+                    far.append((node.nx, node.ny, node.qn))
+            else:
+                stack.extend(node.children)
+        sources = far + [(x[j], y[j], q[j]) for j in near if q[j] != 0]
+        if numpy != None and len(sources) > 0:
+            # sum forces for the whole group at once
+            src = numpy.array(sources, float)
+            rx = numpy.array([x[i] for i in group])[:, None] - src[:, 0]
+            ry = numpy.array([y[i] for i in group])[:, None] - src[:, 1]
+            r2 = rx * rx + ry * ry
+            r2[r2 == 0] = numpy.inf
+            scale = k * numpy.array([q[i] for i in group])[:, None] * src[:, 2] / (r2 * numpy.sqrt(r2))
+            gx = scale * rx
+            gy = scale * ry
+            if places != None:
+                gx = numpy.round(gx, places)
+                gy = numpy.round(gy, places)
+            gx = gx.sum(1).tolist()
+            gy = gy.sum(1).tolist()
+            for n in xrange(len(group)):
+                fx[group[n]] = gx[n]
+                fy[group[n]] = gy[n]
+            return
+        for i in group:
+            xi = x[i]
+            yi = y[i]
+            kq = k * q[i]
+            ax = ay = 0.0
+            for sx, sy, sq in sources:
+                rx = xi - sx
+                ry = yi - sy
+                r2 = rx * rx + ry * ry
+                if r2 == 0:
+                    continue
+                scale = kq * sq / (r2 * math.sqrt(r2))
+                if places == None:
+                    ax += scale * rx
+                    ay += scale * ry
+                else:
+                    ax += round(scale * rx, places)
+                    ay += round(scale * ry, places)
+            fx[i] = ax
+            fy[i] = ay
+
+class ParticleMeshEngine(NumpyEngine):
+    """ Engine that spreads the charges over a mesh and finds the field on
+        the mesh by convolving it with the field of a unit charge using FFTs,
+        so a step costs about O(N + M log M) for N charges and M mesh
+        points. Mesh points are at the centers of the cells of the window
+        grid, the same points the field overlay shows. Charges are spread and
+        the field is read back with cloud-in-cell or triangular-shaped-cloud
+        weights. With P3M the mesh only carries the smooth long range part of
+        the force and pairs closer than a few cells are summed directly. """
+    NAME = "Particle-Mesh"
+    NUMPY = True
+    ASSIGNMENTS = ("cic", "tsc")
+    MAX_CELLS = 512   # most mesh points along a side (cells grow to fit)
+    ROUND_CELLS = 32  # mesh sizes are rounded up to a multiple of this so the
+                      # kernel can be reused while charges move
+    SPLIT = 2.0       # cells over which force is split between mesh and pairs
+    CUTOFF = 3.5      # pair distance (in SPLITs) beyond which pairs are left
+                      # to the mesh
+    BLOCK = 4096      # charges per batch of pair sums
+
+    def __init__(self, rounded=True, spacing=40, assignment="cic", p3m=True,
+                 **options):
+        """ Initialize engine and set variables. Forces are not rounded. """
+        Engine.__init__(self, rounded)
+        self.spacing = spacing       # pixels between mesh points
+        self.assignment = assignment # how charges are spread over the mesh
+        self.p3m = p3m               # whether or not to sum close pairs
+        self.mesh = None             # (x, y of first point, spacing, field x,
+                                     # field y) of last solve
+        self._kernel = None          # size of mesh and transform of field
+                                     # of unit charge
+
+    def key(self):
+        """ Return settings that change the results of the engine. """
+        return (self.spacing, self.assignment, self.p3m)
+
+    def accel_arrays(self, x, y, q, idx):
+        """ Return change in velocity of the charges at 'idx' caused by all
+            charges at 'x', 'y' with charges 'q'. """
+        if len(idx) == 0:
+            return numpy.zeros(0), numpy.zeros(0)
+        h = float(self.spacing)
+        # grow cells by powers of 2 until the charges fit
+        while max(x.max() - x.min(), y.max() - y.min()) / h > ParticleMeshEngine.MAX_CELLS - 4:
+            h *= 2
+        # first mesh point lies at the center of a grid cell
+        x0 = (math.floor(x.min() / h) - 1.5) * h
+        y0 = (math.floor(y.min() / h) - 1.5) * h
+        size = ParticleMeshEngine.ROUND_CELLS
+        nx = int(math.ceil(((x.max() - x0) / h + 3) / size)) * size
+        ny = int(math.ceil(((y.max() - y0) / h + 3) / size)) * size
+        points, weights = self.weights((x - x0) / h, (y - y0) / h, ny)
+        rho = numpy.zeros(nx * ny)
+        for k in xrange(len(points)):
+            rho += numpy.bincount(points[k], weights[k] * q, nx * ny)
+        # field of charges spread over the mesh (zero padded so the mesh does
+        # not wrap around)
+        gx, gy = self.kernel(nx, ny, h)
+        transform = numpy.fft.rfft2(rho.reshape(nx, ny), (2 * nx, 2 * ny))
+        ex = numpy.fft.irfft2(transform * gx, (2 * nx, 2 * ny))[:nx, :ny]
+        ey = numpy.fft.irfft2(transform * gy, (2 * nx, 2 * ny))[:nx, :ny]
+        self.mesh = (x0, y0, h, ex, ey)
+        ex = ex.ravel()
+        ey = ey.ravel()
+        ax = numpy.zeros(len(idx))
+        ay = numpy.zeros(len(idx))
+        for k in xrange(len(points)):
+            ax += weights[k][idx] * ex[points[k][idx]]
+            ay += weights[k][idx] * ey[points[k][idx]]
+        ax *= q[idx]
+        ay *= q[idx]
+        if self.p3m:
+            self.add_pairs(x, y, q, idx, ParticleMeshEngine.SPLIT * h, ax, ay)
+        return ax, ay
+
+    def weights(self, fx, fy, ny):
+        """ Return lists of mesh point indexes and weights of charges at mesh
+            coordinates 'fx', 'fy'. """
+        if self.assignment == "tsc":
+            ix = numpy.floor(fx + 0.5)
+            iy = numpy.floor(fy + 0.5)
+            dx = fx - ix
+            dy = fy - iy
+            wx = (0.5 * (0.5 - dx) ** 2, 0.75 - dx * dx, 0.5 * (0.5 + dx) ** 2)
+            wy = (0.5 * (0.5 - dy) ** 2, 0.75 - dy * dy, 0.5 * (0.5 + dy) ** 2)
+            offsets = (-1, 0, 1)
+        else:
+            ix = numpy.floor(fx)
+            iy = numpy.floor(fy)
+            dx = fx - ix
+            dy = fy - iy
+            wx = (1.0 - dx, dx)
+            wy = (1.0 - dy, dy)
+            offsets = (0, 1)
+        ix = ix.astype(int)
+        iy = iy.astype(int)
+        points = []
+        weights = []
+        for a in xrange(len(offsets)):
+            for b in xrange(len(offsets)):
+                points.append((ix + offsets[a]) * ny + iy + offsets[b])
+                weights.append(wx[a] * wy[b])
+        return points, weights
+
+    def kernel(self, nx, ny, h):
+        """ Return transforms of x and y fields of a unit charge at the first
+            point of a zero padded 'nx' by 'ny' mesh with spacing 'h'. With
+            P3M only the long range part of the field is kept. """
+        if self._kernel != None and self._kernel[0] == (nx, ny, h, self.p3m):
+            return self._kernel[1]
+        ox = numpy.arange(2 * nx, dtype=float)
+        oy = numpy.arange(2 * ny, dtype=float)
+        ox[nx:] -= 2 * nx
+        oy[ny:] -= 2 * ny
+        rx = ox[:, None] * h
+        ry = oy[None, :] * h
+        r2 = rx * rx + ry * ry
+        r2[0, 0] = numpy.inf
+        scale = Moveable.FIELD_CONSTANT / (r2 * numpy.sqrt(r2))
+        if self.p3m:
+            scale *= 1.0 - numpy.exp(-r2 / (ParticleMeshEngine.SPLIT * h) ** 2)
+        gx = numpy.fft.rfft2(scale * rx)
+        gy = numpy.fft.rfft2(scale * ry)
+        if self.p3m:
+            # undo smoothing of spreading and reading back charges (the long
+            # range field has no detail the correction could blow up)
+            order = 6 if self.assignment == "tsc" else 4
+            wx = numpy.sinc(numpy.fft.fftfreq(2 * nx)) ** order
+            wy = numpy.sinc(numpy.fft.rfftfreq(2 * ny)) ** order
+            gx /= wx[:, None] * wy[None, :]
+            gy /= wx[:, None] * wy[None, :]
+        result = (gx, gy)
+        self._kernel = ((nx, ny, h, self.p3m), result)
+        return result
+
+    def add_pairs(self, x, y, q, idx, split, ax, ay):
+        """ Add short range part of forces of charges closer than CUTOFF
+            splits to 'ax', 'ay'. Charges are sorted into square cells as wide
+            as the cutoff so only neighboring cells are searched. """
+        cutoff = ParticleMeshEngine.CUTOFF * split
+        cx = numpy.floor(x / cutoff).astype(int)
+        cy = numpy.floor(y / cutoff).astype(int)
+        cx -= cx.min() - 1
+        cy -= cy.min() - 1
+        width = cy.max() + 2
+        cells = cx * width + cy
+        order = numpy.argsort(cells, kind="mergesort")
+        sorted_cells = cells[order]
+        for start in xrange(0, len(idx), ParticleMeshEngine.BLOCK):
+            rows = idx[start:start+ParticleMeshEngine.BLOCK]
+            for ox in (-1, 0, 1):
+                for oy in (-1, 0, 1):
+                    near = cells[rows] + ox * width + oy
+                    first = numpy.searchsorted(sorted_cells, near, "left")
+                    counts = numpy.searchsorted(sorted_cells, near, "right") - first
+                    total = counts.sum()
+                    if total == 0:
+                        continue
+                    # every (target, source) pair of target and cell
+                    targets = numpy.repeat(numpy.arange(len(rows)), counts)
+                    ends = numpy.cumsum(counts)
+                    sources = order[numpy.arange(total) -
+                                    numpy.repeat(ends - counts - first, counts)]
+                    i = rows[targets]
+                    rx = x[i] - x[sources]
+                    ry = y[i] - y[sources]
+                    r2 = rx * rx + ry * ry
+                    r2[(r2 == 0) | (r2 > cutoff * cutoff)] = numpy.inf
+                    scale = (Moveable.FIELD_CONSTANT * q[i] * q[sources] *
+                             numpy.exp(-r2 / (split * split)) /
+                             (r2 * numpy.sqrt(r2)))
+                    ax[start:start+len(rows)] += numpy.bincount(
+                        targets, scale * rx, len(rows))
+                    ay[start:start+len(rows)] += numpy.bincount(
+                        targets, scale * ry, len(rows))
+
+# available engines by settings name
+ENGINES = {
+    "python"    : PythonEngine,
+    "numpy"     : NumpyEngine,
+    "barneshut" : BarnesHutEngine,
+    "pm"        : ParticleMeshEngine}
+
+def make_engine(name, rounded=True, **options):
+    """ Return a new engine called 'name'. Falls back to the Python engine
+        if the engine cannot be used. """
+    if name not in ENGINES or (ENGINES[name].NUMPY and numpy == None):
+        name = "python"
+    return ENGINES[name](rounded, **options)
+
+def field_at(xs, ys, sources):
+    """ Return lists of x and y components of field at points 'xs', 'ys'
+        of charges 'sources' (list or float array of (x, y, charge)). Charges
+        on top of a point are ignored. """
+    if len(sources) == 0 or len(xs) == 0:
+        return [0.0] * len(xs), [0.0] * len(xs)
+    if numpy != None:
+        src = numpy.asarray(sources, float)
+        px = numpy.array(xs, float)[:, None]
+        py = numpy.array(ys, float)[:, None]
+        ex = numpy.zeros(len(xs))
+        ey = numpy.zeros(len(xs))
+        # limit size of temporary arrays
+        block = max(1, NumpyEngine.BLOCK * 256 // len(xs))
+        for start in xrange(0, len(src), block):
+            part = src[start:start+block]
+            rx = px - part[:, 0]
+            ry = py - part[:, 1]
+            r2 = rx * rx + ry * ry
+            r2[r2 == 0] = numpy.inf
+            scale = Moveable.FIELD_CONSTANT * part[:, 2] / (r2 * numpy.sqrt(r2))
+            ex += (scale * rx).sum(1)
+            ey += (scale * ry).sum(1)
+        return ex.tolist(), ey.tolist()
+    ex = []
+    ey = []
+    for i in xrange(len(xs)):
+        fx = fy = 0.0
+        for sx, sy, sq in sources:
+            rx = xs[i] - sx
+            ry = ys[i] - sy
+            r2 = rx * rx + ry * ry
+            if r2 == 0:
+                continue
+            scale = Moveable.FIELD_CONSTANT * sq / (r2 * math.sqrt(r2))
+            fx += scale * rx
+            fy += scale * ry
+        ex.append(fx)
+        ey.append(fy)
+    return ex, ey
+
+class FieldCache(object):
+    """ Field of fixed charges sampled on a grid. The region is split into
+        square tiles. Each tile stores the field of the charges that are not
+        in it or its neighbors at SAMPLES x SAMPLES points and interpolates
+        between them. The charges in the tile and its neighbors (the near
+        field) are added exactly. Points outside the region use the exact
+        field of all fixed charges. """
+    TILE = 40       # side of a tile in pixels
+    SAMPLES = 8     # grid intervals per side of a tile
+    MARGIN = 2      # tiles added around region
+    MAX_TILES = 100 # most tiles along a side (tiles are made bigger if needed)
+
+    def __init__(self, fixed, bounds):
+        """ Sample field of charges 'fixed' over region 'bounds' (x1, y1, x2,
+            y2). The region is grown to hold all of 'fixed'. """
+        self.sources = [(chg.x, chg.y, chg.charge) for chg in fixed
+                        if chg.charge != 0]
+        x1, y1, x2, y2 = bounds
+        for sx, sy, sq in self.sources:
+            x1 = min(x1, sx)
+            y1 = min(y1, sy)
+            x2 = max(x2, sx)
+            y2 = max(y2, sy)
+        extent = max(x2 - x1, y2 - y1)
+        self.tile = max(FieldCache.TILE, int(math.ceil(extent / FieldCache.MAX_TILES)))
+        self.x1 = (int(math.floor(x1 / self.tile)) - FieldCache.MARGIN) * self.tile
+        self.y1 = (int(math.floor(y1 / self.tile)) - FieldCache.MARGIN) * self.tile
+        self.cols = int(math.ceil((x2 - self.x1) / float(self.tile))) + FieldCache.MARGIN
+        self.rows = int(math.ceil((y2 - self.y1) / float(self.tile))) + FieldCache.MARGIN
+        # charges in each tile
+        tiles = {}
+        for src in self.sources:
+            key = (int((src[0] - self.x1) // self.tile),
+                   int((src[1] - self.y1) // self.tile))
+            tiles.setdefault(key, []).append(src)
+        # charges in each tile and its neighbors
+        self.near = {}
+        for tj in xrange(self.rows):
+            for ti in xrange(self.cols):
+                near = []
+                for j in xrange(tj - 1, tj + 2):
+                    for i in xrange(ti - 1, ti + 2):
+                        near.extend(tiles.get((i, j), []))
+                self.near[(ti, tj)] = near
+        self.sample()
+
+    def sample(self):
+        """ Sample far field of every tile. """
+        n = FieldCache.SAMPLES
+        h = self.tile / float(n)
+        # field of all charges at every grid point
+        gx = [self.x1 + i * h for i in xrange(self.cols * n + 1)]
+        ex_all = []
+        ey_all = []
+        for j in xrange(self.rows * n + 1):
+            ex, ey = field_at(gx, [self.y1 + j * h] * len(gx),
+                              self.sources)
+            ex_all.append(ex)
+            ey_all.append(ey)
+        # far field of each tile is field of all charges minus near field
+        self.far = {}
+        for tj in xrange(self.rows):
+            for ti in xrange(self.cols):
+                px = []
+                py = []
+                fx = []
+                fy = []
+                for b in xrange(n + 1):
+                    for a in xrange(n + 1):
+                        col = ti * n + a
+                        row = tj * n + b
+                        px.append(gx[col])
+                        py.append(self.y1 + row * h)
+                        fx.append(ex_all[row][col])
+                        fy.append(ey_all[row][col])
+                nx, ny = field_at(px, py, self.near[(ti, tj)])
+                self.far[(ti, tj)] = ([fx[k] - nx[k] for k in xrange(len(fx))],
+                                      [fy[k] - ny[k] for k in xrange(len(fy))])
+
+    def fields(self, xs, ys):
+        """ Return lists of x and y components of field at points 'xs', 'ys'. """
+        n = FieldCache.SAMPLES
+        ex = [0.0] * len(xs)
+        ey = [0.0] * len(xs)
+        groups = {} # indexes of points in each tile
+        outside = []
+        for i in xrange(len(xs)):
+            u = (xs[i] - self.x1) / self.tile
+            v = (ys[i] - self.y1) / self.tile
+            ti = int(math.floor(u))
+            tj = int(math.floor(v))
+            if ti < 0 or tj < 0 or ti >= self.cols or tj >= self.rows:
+                outside.append(i)
+                continue
+            groups.setdefault((ti, tj), []).append(i)
+            # bilinear interpolation of far field
+            u = (u - ti) * n
+            v = (v - tj) * n
+            a = min(int(u), n - 1)
+            b = min(int(v), n - 1)
+            u -= a
+            v -= b
+            fx, fy = self.far[(ti, tj)]
+            k = b * (n + 1) + a
+            w00 = (1 - u) * (1 - v)
+            w10 = u * (1 - v)
+            w01 = (1 - u) * v
+            w11 = u * v
+            ex[i] = w00 * fx[k] + w10 * fx[k+1] + w01 * fx[k+n+1] + w11 * fx[k+n+2]
+            ey[i] = w00 * fy[k] + w10 * fy[k+1] + w01 * fy[k+n+1] + w11 * fy[k+n+2]
+        # exact near field
+        for key in groups:
+            group = groups[key]
+            nx, ny = field_at([xs[i] for i in group],
+                              [ys[i] for i in group], self.near[key])
+            for k in xrange(len(group)):
+                ex[group[k]] += nx[k]
+                ey[group[k]] += ny[k]
+        # exact field of all charges outside region
+        if len(outside) > 0:
+            nx, ny = field_at([xs[i] for i in outside],
+                              [ys[i] for i in outside], self.sources)
+            for k in xrange(len(outside)):
+                ex[outside[k]] = nx[k]
+                ey[outside[k]] = ny[k]
+        return ex, ey
+
+class SpatialHash(object):
+    """ Uniform grid of square cells as wide as the radius close pairs are
+        looked for in. Each point only meets the points of its own and
+        neighboring cells, so finding the pairs takes about linear time. The
+        grid is cheap enough to be rebuilt every step. """
+    # cells searched from each cell (the other half find their pairs from
+    # the neighbor)
+    NEIGHBORS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+    def __init__(self, radius):
+        """ Initialize hash and set variables. """
+        self.radius = radius  # distance pairs must be closer than
+        self.cells = {}       # indexes of points in each cell
+        self.x = []           # x-coordinates of points
+        self.y = []           # y-coordinates of points
+        self.idx = []         # indexes of points in hash
+
+    def build(self, x, y, idx):
+        """ Sort points at indexes 'idx' of 'x', 'y' into cells. """
+        self.x = x
+        self.y = y
+        self.idx = idx
+        self.cells = {}
+        if numpy != None:
+            return
+        for i in idx:
+            key = (int(math.floor(x[i] / self.radius)),
+                   int(math.floor(y[i] / self.radius)))
+            if key in self.cells:
+                self.cells[key].append(i)
+            else:
+                self.cells[key] = [i]
+
+    def pairs(self):
+        """ Return sorted list of pairs (i, j), i < j, of points closer than
+            radius. """
+        if numpy != None:
+            return self.pairs_numpy()
+        limit = self.radius * self.radius
+        x = self.x
+        y = self.y
+        found = []
+        for (cx, cy), members in self.cells.iteritems():
+            for ox, oy in SpatialHash.NEIGHBORS:
+                others = self.cells.get((cx + ox, cy + oy))
+                if others == None:
+                    continue
+                for i in members:
+                    for j in others:
+                        if others is members and j <= i:
+                            continue
+                        rx = x[i] - x[j]
+                        ry = y[i] - y[j]
+                        if rx * rx + ry * ry < limit:
+                            found.append((min(i, j), max(i, j)))
+        found.sort()
+        return found
+
+    def pairs_numpy(self):
+        """ Return pairs like pairs, with the cells sorted by numpy. """
+        if len(self.idx) < 2:
+            return []
+        idx = numpy.array(self.idx, int)
+        x = to_numpy(self.x)[idx]
+        y = to_numpy(self.y)[idx]
+        cx = numpy.floor(x / self.radius).astype(int)
+        cy = numpy.floor(y / self.radius).astype(int)
+        cx -= cx.min()
+        cy -= cy.min() - 1
+        width = cy.max() + 2
+        cells = cx * width + cy
+        order = numpy.argsort(cells, kind="mergesort")
+        sorted_cells = cells[order]
+        limit = self.radius * self.radius
+        found_i = []
+        found_j = []
+        for ox, oy in SpatialHash.NEIGHBORS:
+            near = cells + ox * width + oy
+            first = numpy.searchsorted(sorted_cells, near, "left")
+            counts = numpy.searchsorted(sorted_cells, near, "right") - first
+            total = counts.sum()
+            if total == 0:
+                continue
+            # every (point, neighbor) pair of point and cell
+            a = numpy.repeat(numpy.arange(len(idx)), counts)
+            ends = numpy.cumsum(counts)
+            b = order[numpy.arange(total) -
+                      numpy.repeat(ends - counts - first, counts)]
+            rx = x[a] - x[b]
+            ry = y[a] - y[b]
+            close = rx * rx + ry * ry < limit
+            if (ox, oy) == (0, 0):
+                close &= b > a
+            found_i.append(idx[a[close]])
+            found_j.append(idx[b[close]])
+        if len(found_i) == 0:
+            return []
+        i = numpy.concatenate(found_i)
+        j = numpy.concatenate(found_j)
+        i, j = numpy.minimum(i, j), numpy.maximum(i, j)
+        order = numpy.lexsort((j, i))
+        return zip(i[order].tolist(), j[order].tolist())
+
+class Integrator(object):
+    """ Base class for integrators. An integrator advances the moveable
+        charges by a time step using accelerations from a force engine and
+        keeps statistics about the steps it takes. """
+    NAME = "" # name shown in the Settings menu
+
+    def __init__(self, **options):
+        """ Initialize integrator and set variables. 'options' holds
+            integrator specific settings and is ignored by integrators that
+            have none. """
+        self.reset()
+
+    def reset(self):
+        """ Clear statistics and anything remembered from earlier steps. """
+        self.evals = 0        # force evaluations
+        self.substeps = 0     # accepted steps (may be more than one per step)
+        self.rejected = 0     # steps rejected by error control
+        self.error = 0.0      # estimated error of last step
+        self.max_error = 0.0  # largest estimated error of any step
+        self.h = None         # length of last step (in nominal steps)
+        self.h_min = None     # shortest step
+        self.h_max = None     # longest step
+
+    def step(self, engine, store, h):
+        """ Move all moveable charges in 'store' by a step of length 'h'
+            (in nominal steps) using forces from 'engine'. """
+        raise NotImplementedError
+
+    def record(self, h, error=0.0):
+        """ Add an accepted step of length 'h' to the statistics. """
+        self.substeps += 1
+        self.h = h
+        self.error = error
+        self.max_error = max(self.max_error, error)
+        if self.h_min == None or h < self.h_min:
+            self.h_min = h
+        if self.h_max == None or h > self.h_max:
+            self.h_max = h
+
+    def stats(self):
+        """ Return dictionary of statistics. """
+        return {
+            "evals"     : self.evals,
+            "substeps"  : self.substeps,
+            "rejected"  : self.rejected,
+            "error"     : self.error,
+            "max_error" : self.max_error,
+            "h"         : self.h,
+            "h_min"     : self.h_min,
+            "h_max"     : self.h_max}
+
+    def accel(self, engine, store, idx, x, y):
+        """ Move charges at 'idx' to 'x', 'y' and return their accelerations. """
+        for k in xrange(len(idx)):
+            store.x[idx[k]] = x[k]
+            store.y[idx[k]] = y[k]
+        self.evals += 1
+        return engine.accel(store, idx)
+
+    def finish(self, store, idx, x, y, dx, dy):
+        """ Set positions and velocities of charges at 'idx' at the end of a
+            step. """
+        for k in xrange(len(idx)):
+            i = idx[k]
+            store.x[i] = x[k]
+            store.y[i] = y[k]
+            store.dx[i] = dx[k]
+            store.dy[i] = dy[k]
+
+class EulerIntegrator(Integrator):
+    """ Semi-implicit Euler integrator (velocity then position). """
+    NAME = "Euler"
+
+    def step(self, engine, store, h):
+        """ Move all moveable charges in 'store' by a step of length 'h'
+            (in nominal steps) using forces from 'engine'. """
+        engine.step(store, h)
+        self.evals += 1
+        self.record(h)
+
+class LeapfrogIntegrator(Integrator):
+    """ Velocity Verlet (kick-drift-kick leapfrog) integrator. It is
+        symplectic, so energy does not drift, and takes one force evaluation
+        per step. """
+    NAME = "Leapfrog"
+
+    def reset(self):
+        """ Clear statistics and remembered accelerations. """
+        Integrator.reset(self)
+        self._ax = None # accelerations at end of last step
+        self._ay = None
+
+    def step(self, engine, store, h):
+        """ Move all moveable charges in 'store' by a step of length 'h'
+            (in nominal steps) using forces from 'engine'. """
+        idx = store.moveables()
+        if len(idx) == 0:
+            return
+        n = len(idx)
+        x = [store.x[i] for i in idx]
+        y = [store.y[i] for i in idx]
+        if self._ax == None or len(self._ax) != n:
+            self._ax, self._ay = self.accel(engine, store, idx, x, y)
+        half = h / 2.0
+        # kick and drift
+        vx = [store.dx[idx[k]] + self._ax[k] * half for k in xrange(n)]
+        vy = [store.dy[idx[k]] + self._ay[k] * half for k in xrange(n)]
+        x = [x[k] + vx[k] * h for k in xrange(n)]
+        y = [y[k] + vy[k] * h for k in xrange(n)]
+        # kick with accelerations at new positions
+        self._ax, self._ay = self.accel(engine, store, idx, x, y)
+        self.finish(store, idx, x, y,
+                    [vx[k] + self._ax[k] * half for k in xrange(n)],
+                    [vy[k] + self._ay[k] * half for k in xrange(n)])
+        self.record(h)
+
+class RK45Integrator(Integrator):
+    """ Dormand-Prince Runge-Kutta 5(4) integrator with adaptive step size.
+        Each step is split into as many substeps as are needed to keep the
+        estimated error below the tolerance, and substeps grow when forces are
+        weak. """
+    NAME = "RK45"
+    TOLERANCE = 1e-5 # allowed error per substep (relative, or in pixels
+                     # for small values)
+    # Butcher tableau
+    A = ((),
+         (1/5.0,),
+         (3/40.0, 9/40.0),
+         (44/45.0, -56/15.0, 32/9.0),
+         (19372/6561.0, -25360/2187.0, 64448/6561.0, -212/729.0),
+         (9017/3168.0, -355/33.0, 46732/5247.0, 49/176.0, -5103/18656.0),
+         (35/384.0, 0.0, 500/1113.0, 125/192.0, -2187/6784.0, 11/84.0))
+    # difference between 5th and 4th order weights
+    E = (71/57600.0, 0.0, -71/16695.0, 71/1920.0, -17253/339200.0,
+         22/525.0, -1/40.0)
+
+    def __init__(self, tolerance=TOLERANCE, **options):
+        """ Initialize integrator and set variables. """
+        self.tolerance = tolerance
+        Integrator.__init__(self)
+
+    def reset(self):
+        """ Clear statistics and remembered step size. """
+        Integrator.reset(self)
+        self._next = None # proposed length of next substep
+
+    def step(self, engine, store, h):
+        """ Move all moveable charges in 'store' by a step of length 'h'
+            (in nominal steps) using forces from 'engine'. """
+        idx = store.moveables()
+        if len(idx) == 0:
+            return
+        n = len(idx)
+        # state is x coordinates, y coordinates, x velocities, y velocities
+        s = ([store.x[i] for i in idx] + [store.y[i] for i in idx] +
+             [store.dx[i] for i in idx] + [store.dy[i] for i in idx])
+        k1 = self.deriv(engine, store, idx, s)
+        done = 0.0
+        planned = self._next if self._next != None else h
+        while done < h:
+            # let the last substep end exactly at the end of the step
+            final = planned >= (h - done) * 0.999999
+            sub = h - done if final else planned
+            k = [k1]
+            for a in RK45Integrator.A[1:]:
+                stage = [s[j] + sub * sum([a[m] * k[m][j] for m in xrange(len(a))])
+                         for j in xrange(4 * n)]
+                k.append(self.deriv(engine, store, idx, stage))
+            # last stage is the 5th order solution, error is its difference
+            # from the 4th order solution
+            error = 0.0
+            for j in xrange(4 * n):
+                e = sub * sum([RK45Integrator.E[m] * k[m][j] for m in xrange(7)])
+                scale = self.tolerance * (1.0 + max(abs(s[j]), abs(stage[j])))
+                error = max(error, abs(e) / scale)
+            if error == 0:
+                factor = 5.0
+            else:
+                factor = min(5.0, max(0.2, 0.9 * math.pow(error, -0.2)))
+            if error <= 1.0:
+                s = stage
+                k1 = k[6]
+                self.record(sub, error * self.tolerance)
+                if final:
+                    # substep may have been shortened to end with the step so
+                    # keep the planned length if it is longer
+                    done = h
+                    planned = max(planned, sub * factor)
+                else:
+                    done += sub
+                    planned = sub * factor
+            else:
+                self.rejected += 1
+                planned = sub * factor
+        self._next = planned
+        self.finish(store, idx, s[:n], s[n:2*n], s[2*n:3*n], s[3*n:])
+
+    def deriv(self, engine, store, idx, s):
+        """ Return derivative of state 's'. """
+        n = len(idx)
+        ax, ay = self.accel(engine, store, idx, s[:n], s[n:2*n])
+        return s[2*n:3*n] + s[3*n:] + ax + ay
+
+class BlockIntegrator(Integrator):
+    """ Leapfrog integrator with hierarchical block time steps. Each charge
+        steps by h / 2**level with its level picked from how fast its
+        acceleration changes, so a close pair can take many short substeps
+        while slow charges take one. Only charges whose substep ends at a
+        given time have their forces computed; the others drift. Every
+        charge is back in step at the end of each step. """
+    NAME = "Block"
+    ETA = 0.1       # allowed substep as a fraction of |a| / |da/dt|
+    MAX_LEVEL = 8   # substeps are at least h / 2**MAX_LEVEL long
+
+    def reset(self):
+        """ Clear statistics, remembered accelerations and levels. """
+        Integrator.reset(self)
+        self.forces = 0     # forces computed for single charges
+        self._ax = None     # accelerations at last force evaluation of
+        self._ay = None     # each charge
+        self._levels = None # level of each charge
+
+    def step(self, engine, store, h):
+        """ Move all moveable charges in 'store' by a step of length 'h'
+            (in nominal steps) using forces from 'engine'. """
+        idx = store.moveables()
+        if len(idx) == 0:
+            return
+        n = len(idx)
+        x = [store.x[i] for i in idx]
+        y = [store.y[i] for i in idx]
+        if self._ax == None or len(self._ax) != n:
+            self._ax, self._ay = self.accel(engine, store, idx, x, y)
+            self._levels = [0] * n
+            self.forces += n
+        ax = self._ax
+        ay = self._ay
+        levels = self._levels
+        # time is counted in ticks of the shortest possible substep so that
+        # substep ends can be compared exactly
+        ticks = 1 << BlockIntegrator.MAX_LEVEL
+        unit = h / ticks
+        size = [ticks >> levels[k] for k in xrange(n)]
+        due = size[:] # tick each charge's substep ends at
+        # opening kicks
+        vx = [store.dx[idx[k]] + ax[k] * size[k] * unit / 2.0 for k in xrange(n)]
+        vy = [store.dy[idx[k]] + ay[k] * size[k] * unit / 2.0 for k in xrange(n)]
+        t = 0
+        while t < ticks:
+            now = min(due)
+            sub = (now - t) * unit
+            # all charges drift so forces see current positions
+            for k in xrange(n):
+                x[k] += vx[k] * sub
+                y[k] += vy[k] * sub
+                store.x[idx[k]] = x[k]
+                store.y[idx[k]] = y[k]
+            t = now
+            active = [k for k in xrange(n) if due[k] == t]
+            nax, nay = engine.accel(store, [idx[k] for k in active])
+            self.evals += 1
+            self.forces += len(active)
+            for m in xrange(len(active)):
+                k = active[m]
+                length = size[k] * unit
+                # closing kick
+                vx[k] += nax[m] * length / 2.0
+                vy[k] += nay[m] * length / 2.0
+                level = self.level(levels[k], t, ticks, length,
+                                   math.hypot(nax[m], nay[m]),
+                                   math.hypot(nax[m] - ax[k], nay[m] - ay[k]))
+                ax[k] = nax[m]
+                ay[k] = nay[m]
+                levels[k] = level
+                size[k] = ticks >> level
+                if t < ticks:
+                    # opening kick of next substep
+                    due[k] = t + size[k]
+                    vx[k] += ax[k] * size[k] * unit / 2.0
+                    vy[k] += ay[k] * size[k] * unit / 2.0
+            self.record(sub)
+        self.finish(store, idx, x, y, vx, vy)
+
+    def level(self, level, t, ticks, length, a, da):
+        """ Return level of the next substep of a charge on 'level' whose
+            substep of 'length' ended at tick 't' with acceleration 'a' that
+            changed by 'da' during the substep. Levels get finer at once but
+            coarser only one at a time and only where the coarser substep
+            would start. """
+        if da == 0:
+            wanted = 0
+        elif a == 0:
+            wanted = BlockIntegrator.MAX_LEVEL
+        else:
+            allowed = BlockIntegrator.ETA * a * length / da
+            wanted = int(math.ceil(math.log(length * (1 << level) / allowed, 2)))
+            wanted = min(BlockIntegrator.MAX_LEVEL, max(0, wanted))
+        if wanted >= level:
+            return wanted
+        if t % (ticks >> (level - 1)) == 0:
+            return level - 1
+        return level
+
+    def stats(self):
+        """ Return dictionary of statistics. """
+        stats = Integrator.stats(self)
+        stats["forces"] = self.forces
+        return stats
+
+# available integrators by settings name
+INTEGRATORS = {
+    "euler"    : EulerIntegrator,
+    "leapfrog" : LeapfrogIntegrator,
+    "rk45"     : RK45Integrator,
+    "block"    : BlockIntegrator}
+
+def make_integrator(name, **options):
+    """ Return a new integrator called 'name'. Falls back to the Euler
+        integrator if there is no integrator with that name. """
+    if name not in INTEGRATORS:
+        name = "euler"
+    return INTEGRATORS[name](**options)
+
+class TrajectoryWriter(object):
+    """ Records positions of the moveable charges after every step to a
+        trajectory file. Frames are collected into chunks that start with a
+        keyframe holding the time, step and velocities. Full chunks are
+        handed to a thread that writes them through a queue holding at most
+        BUFFER bytes, so stepping never waits for the disk. If the queue is
+        full the recording stops and 'dropped' is set. """
+    MAGIC = "EFDT"       # first bytes of trajectory files
+    VERSION = 1          # version of trajectory format
+    HEADER = "<4sHHIId"  # magic, version, unused, number of moveable
+                         # charges, frames per chunk, time step (followed
+                         # by the store index of each recorded charge)
+    CHUNK = 64           # frames per chunk
+    BUFFER = 1 << 26     # most bytes of chunks waiting to be written
+
+    def __init__(self, filename, store, dt):
+        """ Open 'filename' and start writer thread for the moveable charges
+            of 'store'. """
+        self.filename = filename
+        self.idx = list(store.moveables()) # indexes of recorded charges
+        self.dt = dt
+        self.frames = 0        # frames recorded
+        self.dropped = False   # whether or not frames were lost
+        self._chunk = None     # chunk being filled
+        self._count = 0        # frames in _chunk
+        n = len(self.idx)
+        size = (2 + 2 * n + TrajectoryWriter.CHUNK * 2 * n) * 8
+        self._queue = Queue.Queue(max(2, TrajectoryWriter.BUFFER // size))
+        self._file = open(filename, "wb")
+        self._file.write(struct.pack(TrajectoryWriter.HEADER,
+                                     TrajectoryWriter.MAGIC,
+                                     TrajectoryWriter.VERSION, 0, n,
+                                     TrajectoryWriter.CHUNK, dt))
+        # charges may be deactivated during the run so the replay needs to
+        # know which charges were recorded
+        write_array(self._file, array.array("I", self.idx))
+        self._file.write("\0" * (-4 * n % 8)) # keep frames 8-byte aligned
+        self._thread = threading.Thread(target=self.write_chunks)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, store, time, steps):
+        """ Add positions of charges in 'store' at 'time' as the next frame. """
+        if self.dropped:
+            return
+        if self._chunk == None:
+            self._chunk = array.array("d", [time, steps])
+            gather(self._chunk, store.dx, self.idx)
+            gather(self._chunk, store.dy, self.idx)
+        gather(self._chunk, store.x, self.idx)
+        gather(self._chunk, store.y, self.idx)
+        self._count += 1
+        self.frames += 1
+        if self._count == TrajectoryWriter.CHUNK:
+            try:
+                self._queue.put_nowait(self.pack())
+            except(Queue.Full):
+                self.dropped = True
+                self.frames -= TrajectoryWriter.CHUNK
+
+    def pack(self):
+        """ Return chunk being filled as a string and start a new one. """
+        chunk = self._chunk
+        if sys.byteorder == "big":
+            chunk.byteswap()
+        self._chunk = None
+        self._count = 0
+        return chunk.tostring()
+
+    def write_chunks(self):
+        """ Write chunks from queue until None is received. Runs in writer
+            thread. """
+        while True:
+            data = self._queue.get()
+            if data == None:
+                break
+            self._file.write(data)
+        self._file.close()
+
+    def close(self):
+        """ Write remaining frames and wait for writer thread to finish. """
+        if self._chunk != None and not self.dropped:
+            self._queue.put(self.pack())
+        self._queue.put(None)
+        self._thread.join()
+
+class Trajectory(object):
+    """ Recorded run read from a trajectory file through a memory map. The
+        times of the keyframes index the file, so any time can be found
+        without reading the frames before it. """
+
+    def __init__(self, filename):
+        """ Map 'filename' and index its keyframes. """
+        self.filename = filename
+        self._file = open(filename, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._head = struct.calcsize(TrajectoryWriter.HEADER)
+        (magic, version, unused, self.n, self.chunk,
+         self.dt) = struct.unpack(TrajectoryWriter.HEADER, self._map[:self._head])
+        if magic != TrajectoryWriter.MAGIC:
+            raise IOError(filename+" is not a trajectory file")
+        self.idx = array.array("I") # store index of each recorded charge
+        self.idx.fromstring(self._map[self._head:self._head+4*self.n])
+        if sys.byteorder == "big":
+            self.idx.byteswap()
+        self._head += 4 * self.n + (-4 * self.n % 8)
+        self._key = (2 + 2 * self.n) * 8    # bytes in a keyframe
+        self._frame = 2 * self.n * 8        # bytes in a frame
+        self._size = self._key + self.chunk * self._frame # bytes in a chunk
+        self.times = [] # time of each keyframe
+        self.frames = 0 # frames in file
+        for offset in xrange(self._head, len(self._map), self._size):
+            self.times.append(self.read(offset, 1)[0])
+            self.frames += min(self.chunk, (len(self._map) - offset - self._key) // self._frame)
+
+    def read(self, offset, count):
+        """ Return array of 'count' floats at byte 'offset'. """
+        values = array.array("d")
+        values.fromstring(self._map[offset:offset+count*8])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def frame_at(self, time):
+        """ Return number of frame closest to 'time'. """
+        if self.frames == 0:
+            return None
+        c = max(0, bisect.bisect_right(self.times, time) - 1)
+        k = int(round((time - self.times[c]) / self.dt))
+        return max(0, min(c * self.chunk + k, self.frames - 1))
+
+    def time(self, frame):
+        """ Return time of 'frame'. """
+        c, k = divmod(frame, self.chunk)
+        return self.times[c] + k * self.dt
+
+    def positions(self, frame):
+        """ Return x and y coordinates of charges in 'frame'. """
+        c, k = divmod(frame, self.chunk)
+        values = self.read(self._head + c * self._size + self._key +
+                           k * self._frame, 2 * self.n)
+        return values[:self.n], values[self.n:]
+
+    def keyframe(self, c):
+        """ Return time, step and x and y velocities stored at start of chunk
+            'c'. """
+        values = self.read(self._head + c * self._size, 2 + 2 * self.n)
+        return (values[0], int(values[1]), values[2:2+self.n],
+                values[2+self.n:])
+
+    def close(self):
+        """ Unmap and close file. """
+        self._map.close()
+        self._file.close()
+
+    ### Properties ###
+    ## duration
+    def get_duration(self):
+        if self.frames == 0:
+            return 0.0
+        return self.time(self.frames - 1)
+    duration = property(get_duration)
+
+class TrajectoryCache(object):
+    """ Directory of finished runs named by the key of their scene. When the
+        files take more than 'max_bytes' the least recently used ones are
+        deleted. """
+    EXTENSION = ".eft"  # extension of cached runs
+    TEMPORARY = ".tmp"  # extension of runs being recorded
+    MAX_BYTES = 1 << 28 # default size limit
+
+    def __init__(self, directory=TRAJECTORY_DIR, max_bytes=MAX_BYTES):
+        """ Initialize cache and set variables. Creates 'directory' if it
+            does not exist. """
+        self.directory = directory # where runs are kept
+        self.max_bytes = max_bytes # most bytes of runs kept
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        """ Return name of file holding run of scene 'key'. """
+        return os.path.join(self.directory, key + TrajectoryCache.EXTENSION)
+
+    def temporary(self):
+        """ Return name of a new file to record a run to. """
+        handle, filename = tempfile.mkstemp(TrajectoryCache.TEMPORARY,
+                                            dir=self.directory)
+        os.close(handle)
+        return filename
+
+    def get(self, key):
+        """ Return name of file holding run of scene 'key' or None if it is
+            not cached. """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path, None) # mark as recently used
+        return path
+
+    def put(self, key, filename):
+        """ Move run in 'filename' into cache as run of scene 'key'. Returns
+            its new name or None if it is too big to keep. """
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(filename, path)
+        self.evict()
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def evict(self):
+        """ Delete least recently used runs until cache fits in max_bytes. """
+        runs = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if os.path.splitext(name)[1] != TrajectoryCache.EXTENSION:
+                continue
+            path = os.path.join(self.directory, name)
+            info = os.stat(path)
+            runs.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+        runs.sort()
+        for used, size, path in runs:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        """ Delete all cached runs. """
+        for name in os.listdir(self.directory):
+            if os.path.splitext(name)[1] == TrajectoryCache.EXTENSION:
+                os.remove(os.path.join(self.directory, name))
+
+# charge that left the bounds of a Simulation, when it left and its
+# position and velocity as it left
+Escape = collections.namedtuple("Escape", "charge time x y dx dy")
+
+class Simulation(object):
+    """ Charges and the state of a simulation run. Does not use Tkinter so it
+        can be run without a display. """
+    STEP = 0.025 # simulated seconds in a nominal step (velocities are in
+                 # pixels per nominal step)
+    BLOCK = 4096 # charges written to text files at a time
+    # binary file format
+    MAGIC = "EFDB"                     # first bytes of binary files
+    VERSION = 2                        # version of binary format
+    HEADER_1 = "<4sHHIddd16s16s4x"     # magic, version, flags, number of
+                                       # charges, stop time, time step,
+                                       # opening angle, engine, integrator
+    HEADER = HEADER_1+"dd8s8s8x"       # version 1 header followed by mesh
+                                       # spacing, encounter radius, charge
+                                       # assignment, encounter policy
+    HAS_STOP_TIME = 1                  # flag set if file has a stop time
+    P3M = 2                            # flag set if particle-mesh engine
+                                       # sums close pairs directly
+    # checkpoint file format
+    CHECKPOINT_MAGIC = "EFDC"          # first bytes of checkpoint files
+    CHECKPOINT_VERSION = 1             # version of checkpoint format
+    CHECKPOINT_HEADER = "<4sHHIdddQ16s16sI" # magic, version, flags, number
+                                       # of charges, stop time, time step,
+                                       # opening angle, steps taken, engine,
+                                       # integrator, size of integrator,
+                                       # particle-mesh, encounter and escape
+                                       # state
+    ROUNDED = 2                        # flag set if forces are rounded
+    CACHE_FIXED = 4                    # flag set if field of fixed charges
+                                       # is cached
+    POLICIES = ("off", "count", "soften", "elastic", "merge",
+                "stop")                # what can be done about charges
+                                       # closer than encounter_radius
+    SOFTENING = 0.25                   # Plummer softening length as a
+                                       # fraction of encounter_radius
+    REST_SPEED = 0.01                  # speed charges are at rest below
+    REST_ACCEL = 1e-4                  # change in speed per nominal step
+                                       # charges are at rest below
+    CHECKPOINT_ARRAYS = ("q", "x", "y", "dx", "dy", "x0", "y0", "dx0",
+                         "dy0")        # arrays of store saved in checkpoints
+    KINDS = {Charge : Charge.MOVEABLE,
+             Moveable : Moveable.MOVEABLE,
+             Tracer : Tracer.MOVEABLE}     # values of types array
+
+    def __init__(self, engine_name="numpy", rounded=True, theta=0.5, dt=STEP,
+                 integrator_name="euler", cache_fixed=False, record=False):
+        """ Initialize simulation and set variables. """
+        self.store = ChargeStore()      # data of charges
+        self.stop_time = None           # when to stop simulation (None if never)
+        self.dt = dt                    # simulated seconds per step
+        self.time = 0.0                 # simulated seconds since start
+        self.steps = 0                  # steps taken since start
+        self.engine_name = engine_name  # name of force engine
+        self.rounded = rounded          # whether or not to round forces
+        self.theta = theta              # Barnes-Hut opening angle
+        self.mesh_spacing = 40          # pixels between particle-mesh points
+        self.assignment = "cic"         # how charges are spread over mesh
+        self.p3m = True                 # whether or not to sum close pairs
+                                        # directly with particle-mesh engine
+        self.cache_fixed = cache_fixed  # whether or not to cache field of
+                                        # fixed charges
+        self._background = None         # cached field of fixed charges
+        self.record = record            # whether or not to record runs
+        self.recorder = None            # writer of run being recorded
+        self.trajectory = None          # last recorded run
+        self._recorded = None           # store and its edits when
+                                        # trajectory was recorded
+        self._key = None                # key of scene being recorded (None
+                                        # if not started from initial state)
+        self._kept = False              # whether or not trajectory is in
+                                        # trajectories
+        self.trajectories = None        # cache of finished runs (None if
+                                        # runs are not cached)
+        self.profiler = None            # profiler steps are timed with (None
+                                        # if not timed)
+        self.autosave_file = None       # file run is checkpointed to (None
+                                        # if never)
+        self.autosave_interval = 0      # real seconds between checkpoints
+                                        # (0 if never)
+        self._autosaved = 0.0           # time.time() of last checkpoint
+        self._autosaver = None          # thread writing last checkpoint
+        self.encounter_policy = "count" # what is done about close charges
+        self.encounter_radius = 2 * Charge.RADIUS # distance charges are
+                                        # close at
+        self.encounters = 0             # close pairs found by last step
+        self.halted = False             # whether or not run was stopped by
+                                        # an encounter or auto_stop
+        self.merged = {}                # charges changed by merges and their
+                                        # charges before the run
+        self.bounds = None              # region (x1, y1, x2, y2) moveable
+                                        # charges escape from (None if never)
+        self.auto_stop = False          # whether or not to stop when every
+                                        # moveable charge escaped or is at rest
+        self.escaped = []               # Escape of each charge that left
+                                        # bounds (only appended to in a run)
+        self.tolerance = RK45Integrator.TOLERANCE # allowed error per
+                                        # substep of adaptive integrators
+        self.set_engine()
+        self.set_integrator(integrator_name)
+
+    def set_engine(self, name=None, rounded=None, theta=None, spacing=None,
+                   assignment=None, p3m=None):
+        """ Change engine settings that are not None and create engine. """
+        if name != None:
+            self.engine_name = name
+        if rounded != None:
+            self.rounded = rounded
+        if theta != None:
+            self.theta = theta
+        if spacing != None:
+            self.mesh_spacing = spacing
+        if assignment != None:
+            self.assignment = assignment
+        if p3m != None:
+            self.p3m = p3m
+        self.engine = make_engine(self.engine_name, self.rounded,
+                                  theta=self.theta, spacing=self.mesh_spacing,
+                                  assignment=self.assignment, p3m=self.p3m)
+        self.engine.background = self._background
+
+    def set_integrator(self, name=None, tolerance=None):
+        """ Change integrator settings that are not None and create
+            integrator. """
+        if name != None:
+            self.integrator_name = name
+        if tolerance != None:
+            self.tolerance = tolerance
+        self.integrator = make_integrator(self.integrator_name,
+                                          tolerance=self.tolerance)
+
+    def set_encounters(self, policy=None, radius=None):
+        """ Change encounter settings that are not None. """
+        if policy != None:
+            self.encounter_policy = policy
+        if radius != None:
+            self.encounter_radius = radius
+
+    def set_cache(self, cache_fixed):
+        """ Turn caching of field of fixed charges on or off. """
+        self.cache_fixed = cache_fixed
+        self.invalidate()
+
+    def invalidate(self):
+        """ Discard cached field of fixed charges. """
+        self._background = None
+        self.engine.background = None
+
+    def charge_changed(self, charge):
+        """ Called when user moves a charge or changes its charge. """
+        if type(charge) == Charge:
+            self.invalidate()
+
+    def build_cache(self):
+        """ Cache field of fixed charges over region holding all charges. """
+        fixed = [chg for chg in self.charges if type(chg) == Charge]
+        if len(fixed) == 0:
+            self.invalidate()
+            return
+        # cover starting positions (charges that leave use the exact field)
+        xs = [chg.x for chg in fixed] + [chg.x0 for chg in self.charges if type(chg) == Moveable]
+        ys = [chg.y for chg in fixed] + [chg.y0 for chg in self.charges if type(chg) == Moveable]
+        self._background = FieldCache(fixed, (min(xs), min(ys), max(xs), max(ys)))
+        self.engine.background = self._background
+
+    def add_fixed(self, charge=0.0, x=0, y=0):
+        """ Add a fixed charge and return it. """
+        chg = Charge(charge, x, y, self.store)
+        chg.on_change = self.charge_changed
+        self.invalidate()
+        return chg
+
+    def add_moveable(self, charge=0.0, x=0, y=0, dx0=0.0, dy0=0.0):
+        """ Add a moveable charge and return it. """
+        return Moveable(charge, x, y, dx0, dy0, self.store)
+
+    def add_tracer(self, charge=0.0, x=0, y=0, dx0=0.0, dy0=0.0):
+        """ Add a tracer and return it. """
+        return Tracer(charge, x, y, dx0, dy0, self.store)
+
+    def remove(self, charge):
+        """ Remove a charge. The last charge takes its place in the list. """
+        self.store.remove(charge.slot)
+        self.charge_changed(charge)
+
+    def remove_many(self, charges):
+        """ Remove all charges in 'charges'. Order of remaining charges is
+            kept. """
+        self.store.remove_many(charges)
+        for chg in charges:
+            if type(chg) == Charge:
+                self.invalidate()
+                break
+
+    def clear(self):
+        """ Remove all charges. """
+        self.store = ChargeStore()
+        self.merged = {}
+        self.escaped = []
+        self.invalidate()
+
+    def step(self):
+        """ Move all moveable charges by one time step. Charges that came
+            closer than encounter_radius are handled by encounter_policy
+            first. """
+        if self.cache_fixed and self._background == None:
+            self.build_cache()
+        pairs = []
+        if self.encounter_policy != "off":
+            start = time.time()
+            pairs = self.find_encounters()
+            if self.encounter_policy == "elastic":
+                self.collide(pairs)
+            elif self.encounter_policy == "merge":
+                self.merge(pairs)
+            elif self.encounter_policy == "stop" and len(pairs) > 0:
+                # stop before the close pair is pulled through itself
+                self.halted = True
+                return
+            elif self.encounter_policy == "soften":
+                kicks = self.soften(pairs)
+            if self.profiler != None:
+                self.profiler.add("encounters", time.time() - start)
+                if len(pairs) > 0:
+                    self.profiler.count("encounters", len(pairs))
+        h = self.dt / Simulation.STEP
+        if self.auto_stop:
+            # velocities before the step tell how fast charges speed up
+            idx = self.store.moveables()
+            before = (array.array("d"), array.array("d"))
+            gather(before[0], self.store.dx, idx)
+            gather(before[1], self.store.dy, idx)
+        start = time.time()
+        self.integrator.step(self.engine, self.store, h)
+        if self.encounter_policy == "soften" and len(pairs) > 0:
+            self.kick(kicks, h)
+        if self.profiler != None:
+            self.profiler.add("step", time.time() - start)
+            self.profiler.count("steps")
+        self.steps += 1
+        self.time = self.steps * self.dt
+        if self.bounds != None:
+            self.cull()
+        if self.auto_stop and self.settled(idx, before[0], before[1], h):
+            self.halted = True
+        if self.recorder != None:
+            self.recorder.record(self.store, self.time, self.steps)
+            if self.finished:
+                self.end_recording()
+        if (self.autosave_file != None and self.autosave_interval > 0 and
+            time.time() - self._autosaved >= self.autosave_interval):
+            self.autosave()
+
+    def run(self, steps=None):
+        """ Take 'steps' steps or until stop time is reached if 'steps' is
+            None. Returns number of steps taken. """
+        if steps == None and self.stop_time == None:
+            raise ValueError("no stop time or number of steps to run")
+        taken = 0
+        while (steps == None or taken < steps) and not self.finished:
+            self.step()
+            taken += 1
+        return taken
+
+    def find_encounters(self):
+        """ Return sorted list of pairs (i, j) of indexes of charges closer
+            than encounter_radius and keep how many there are. Tracers,
+            neutral charges, escaped charges and pairs of fixed charges are
+            left out. """
+        store = self.store
+        if numpy != None:
+            idx = numpy.flatnonzero((store.array("moveable") != Tracer.MOVEABLE) &
+                                    (store.array("active") != 0) &
+                                    (store.array("q") != 0))
+        else:
+            idx = [i for i in store.sources() if store.q[i] != 0]
+        grid = SpatialHash(self.encounter_radius)
+        grid.build(store.x, store.y, idx)
+        pairs = [(i, j) for i, j in grid.pairs()
+                 if store.moveable[i] or store.moveable[j]]
+        self.encounters = len(pairs)
+        return pairs
+
+    def soften(self, pairs):
+        """ Return list of (i, j, ax, ay): the change in velocity of 'i'
+            (and the opposite for 'j') that turns the force between each
+            close pair into the Plummer softened force
+            k * q1 * q2 * r / (r^2 + e^2)^(3/2). """
+        store = self.store
+        e2 = (Simulation.SOFTENING * self.encounter_radius) ** 2
+        kicks = []
+        for i, j in pairs:
+            rx = store.x[i] - store.x[j]
+            ry = store.y[i] - store.y[j]
+            r2 = rx * rx + ry * ry
+            if r2 == 0:
+                continue
+            k = Moveable.FIELD_CONSTANT * store.q[i] * store.q[j]
+            scale = k / ((r2 + e2) * math.sqrt(r2 + e2)) - k / (r2 * math.sqrt(r2))
+            kicks.append((i, j, scale * rx, scale * ry))
+        return kicks
+
+    def kick(self, kicks, h):
+        """ Add softening changes in velocity from soften to moveable
+            charges after a step of length 'h' (in nominal steps). """
+        store = self.store
+        for i, j, ax, ay in kicks:
+            for k, sign in ((i, 1), (j, -1)):
+                if store.moveable[k]:
+                    store.dx[k] += sign * ax * h
+                    store.dy[k] += sign * ay * h
+                    store.x[k] += sign * ax * h * h
+                    store.y[k] += sign * ay * h * h
+
+    def collide(self, pairs):
+        """ Bounce close pairs off each other like hard discs as wide as
+            encounter_radius. The pair is pushed apart until the discs touch
+            and, if approaching, two moveable charges (of the same mass) swap
+            their velocities along the line between them and a moveable
+            charge bounces straight off a fixed one. """
+        store = self.store
+        for i, j in pairs:
+            nx = store.x[i] - store.x[j]
+            ny = store.y[i] - store.y[j]
+            r = math.hypot(nx, ny)
+            if r == 0:
+                continue
+            nx /= r
+            ny /= r
+            speed = ((store.dx[i] - store.dx[j]) * nx +
+                     (store.dy[i] - store.dy[j]) * ny)
+            overlap = self.encounter_radius - r
+            if store.moveable[i] and store.moveable[j]:
+                overlap /= 2.0
+            else:
+                speed *= 2 # fixed charges do not give way
+            for k, sign in ((i, 1), (j, -1)):
+                if not store.moveable[k]:
+                    continue
+                store.x[k] = store.next_x[k] = store.x[k] + sign * overlap * nx
+                store.y[k] = store.next_y[k] = store.y[k] + sign * overlap * ny
+                if speed < 0: # not already moving apart
+                    store.dx[k] -= sign * speed * nx
+                    store.dy[k] -= sign * speed * ny
+
+    def merge(self, pairs):
+        """ Merge close pairs. Two moveable charges become one at their
+            midpoint with their summed charge and average velocity; a fixed
+            charge takes in a moveable one. The charge that is taken in is
+            left neutral and at rest where it merged. reset undoes merges. """
+        store = self.store
+        gone = set()
+        for i, j in pairs:
+            if i in gone or j in gone:
+                continue
+            if not store.moveable[i]:
+                keep, lose = i, j
+            elif not store.moveable[j]:
+                keep, lose = j, i
+            else:
+                keep, lose = i, j
+                for name in ("x", "y"):
+                    values = getattr(store, name)
+                    values[i] = (values[i] + values[j]) / 2.0
+                    getattr(store, "next_"+name)[i] = values[i]
+                for name in ("dx", "dy"):
+                    values = getattr(store, name)
+                    values[i] = (values[i] + values[j]) / 2.0
+            for k in (keep, lose):
+                if store.views[k] not in self.merged:
+                    self.merged[store.views[k]] = store.q[k]
+            store.q[keep] += store.q[lose]
+            store.q[lose] = 0.0
+            store.dx[lose] = store.dy[lose] = 0.0
+            if not store.moveable[keep]:
+                self.invalidate()
+            gone.add(lose)
+
+    def unmerge(self):
+        """ Give charges changed by merges their charges back. """
+        for chg, charge in self.merged.iteritems():
+            if (chg.store is self.store and chg.slot < len(self.store) and
+                self.store.views[chg.slot] is chg):
+                self.store.q[chg.slot] = charge
+                if not self.store.moveable[chg.slot]:
+                    self.invalidate()
+        self.merged = {}
+
+    def cull(self):
+        """ Deactivate moveable charges outside bounds so they are left out
+            of force calculations and drawing, and keep an Escape for each. """
+        store = self.store
+        x1, y1, x2, y2 = self.bounds
+        idx = store.moveables()
+        if numpy != None:
+            idx = numpy.array(idx, int)
+            x = store.array("x")[idx]
+            y = store.array("y")[idx]
+            out = idx[(x < x1) | (x > x2) | (y < y1) | (y > y2)].tolist()
+        else:
+            out = [i for i in idx if not (x1 <= store.x[i] <= x2 and
+                                          y1 <= store.y[i] <= y2)]
+        for i in out:
+            store.deactivate(i)
+            self.escaped.append(Escape(store.views[i], self.time, store.x[i],
+                                       store.y[i], store.dx[i], store.dy[i]))
+
+    def settled(self, idx, dx, dy, h):
+        """ Return whether or not every moveable charge at 'idx' has escaped
+            or is at rest after a step of length 'h' that started with
+            velocities 'dx', 'dy'. A charge is at rest when it is slower than
+            REST_SPEED and its speed changes by less than REST_ACCEL per
+            nominal step, so charges that start at rest and are only
+            beginning to move keep the run going. Tracers count like other
+            moveable charges. """
+        store = self.store
+        for k in xrange(len(idx)):
+            i = idx[k]
+            if not store.active[i]:
+                continue
+            if math.hypot(store.dx[i], store.dy[i]) >= Simulation.REST_SPEED:
+                return False
+            if (math.hypot(store.dx[i] - dx[k], store.dy[i] - dy[k]) >=
+                Simulation.REST_ACCEL * h):
+                return False
+        return True
+
+    def start(self):
+        """ Start a run from the current positions. Charges that escaped in
+            an earlier run are brought back (and escape again at once if they
+            are still outside bounds). """
+        self.time = 0.0
+        self.steps = 0
+        self.encounters = 0
+        self.halted = False
+        self.store.activate()
+        self.escaped = []
+        self.integrator.reset()
+        self._autosaved = time.time()
+        if self.cache_fixed and self._background == None:
+            self.build_cache()
+        self.end_recording()
+        if self.record and len(self.store.moveables()) > 0:
+            if self.trajectories != None:
+                filename = self.trajectories.temporary()
+            else:
+                handle, filename = tempfile.mkstemp(".eft")
+                os.close(handle)
+            self._key = self.scene_key() if self.at_start else None
+            self.recorder = TrajectoryWriter(filename, self.store, self.dt)
+            self.recorder.record(self.store, self.time, self.steps)
+            self._recorded = (self.store, self.store.edits)
+
+    def stop(self):
+        """ Reset velocities of all moveable charges. """
+        self.end_recording()
+        self.store.reset_vel()
+
+    def reset(self):
+        """ Reset all charges to their initial positions and velocities and
+            bring back escaped charges. """
+        self.end_recording()
+        self.time = 0.0
+        self.steps = 0
+        self.encounters = 0
+        self.halted = False
+        self.escaped = []
+        self.integrator.reset()
+        self.store.reset()
+        self.unmerge()
+
+    def end_recording(self):
+        """ Finish recording run and keep it for replay. """
+        if self.recorder == None:
+            return
+        self.recorder.close()
+        self.discard_trajectory()
+        filename = self.recorder.filename
+        # keep complete runs of unchanged scenes
+        if (self.trajectories != None and self._key != None and
+            self.finished and not self.recorder.dropped):
+            filename = self.trajectories.put(self._key, filename)
+            self._kept = filename != None
+        if filename != None:
+            self.trajectory = Trajectory(filename)
+        self.recorder = None
+
+    def discard_trajectory(self):
+        """ Close recorded run and delete it if it is not cached. """
+        if self.trajectory == None:
+            return
+        self.trajectory.close()
+        if not self._kept:
+            os.remove(self.trajectory.filename)
+        self.trajectory = None
+        self._kept = False
+
+    def scene_key(self):
+        """ Return hash of charges, initial velocities, stop time and engine
+            and integrator settings. Runs of scenes with the same key have
+            the same result. """
+        key = hashlib.sha1(repr((TrajectoryWriter.VERSION, self.engine.NAME,
+                                 self.rounded, self.theta, self.dt,
+                                 self.integrator_name, self.tolerance,
+                                 self.cache_fixed,
+                                 self.stop_time, self.engine.key(),
+                                 self.encounter_policy, self.encounter_radius,
+                                 self.bounds, self.auto_stop)))
+        for name in ("moveable", "q", "x0", "y0", "dx0", "dy0"):
+            key.update(getattr(self.store, name).tostring())
+        return key.hexdigest()
+
+    def load_cached(self):
+        """ Make cached run of scene the recorded run. Returns whether or not
+            the scene has a cached run. Charges must be at their initial
+            positions and velocities. """
+        if self.trajectories == None or self.stop_time == None or not self.at_start:
+            return False
+        key = self.scene_key()
+        if self.replayable and self._kept and self._key == key:
+            return True
+        filename = self.trajectories.get(key)
+        if filename == None:
+            return False
+        self.end_recording()
+        self.discard_trajectory()
+        self.trajectory = Trajectory(filename)
+        self._kept = True
+        self._key = key
+        self._recorded = (self.store, self.store.edits)
+        return True
+
+    def seek(self, time):
+        """ Move recorded charges to where they were closest to 'time' in the
+            recorded run and return the time of that frame. Forces are not
+            computed. Charges that escaped are brought back so the replay
+            shows them. """
+        frame = self.trajectory.frame_at(time)
+        xs, ys = self.trajectory.positions(frame)
+        store = self.store
+        store.activate()
+        idx = self.trajectory.idx
+        for k in xrange(len(idx)):
+            i = idx[k]
+            store.x[i] = store.next_x[i] = xs[k]
+            store.y[i] = store.next_y[i] = ys[k]
+        return self.trajectory.time(frame)
+
+    def write_file(self, filename, binary=False):
+        """ Save charge data to file as text or, if 'binary' is True, in the
+            binary format. """
+        if binary:
+            self.write_binary(filename)
+            return
+        file = open(filename, "w")
+        # write stop time
+        if self.stop_time == None:
+            file.write("\n")
+        else:
+            file.write(repr(float(self.stop_time))+"\n")
+        # write engine settings
+        file.write("e "+self.engine_name+" "+str(self.theta)+" "+str(self.dt)+
+                   " "+self.integrator_name+" "+str(self.mesh_spacing)+" "+
+                   self.assignment+" "+str(int(self.p3m))+"\n")
+        # write encounter settings
+        file.write("c "+self.encounter_policy+" "+
+                   repr(float(self.encounter_radius))+"\n")
+        # write charge data
+        lines = []
+        for chg in self.charges:
+            # charges changed by merges are saved as they were before the run
+            charge = self.merged.get(chg, chg.charge)
+            # repr() keeps every digit so a reloaded scene runs the same
+            if type(chg) == Charge:
+                lines.append("f "+repr(charge)+" "+repr(chg.x)+" "+repr(chg.y)+"\n")
+            elif type(chg) == Moveable:
+                lines.append("m "+repr(charge)+" "+repr(chg.x0)+" "+repr(chg.y0)+" "+repr(chg.dx0)+" "+repr(chg.dy0)+"\n")
+            elif type(chg) == Tracer:
+                lines.append("t "+repr(charge)+" "+repr(chg.x0)+" "+repr(chg.y0)+" "+repr(chg.dx0)+" "+repr(chg.dy0)+"\n")
+            # write in blocks so large scenes are not held in memory twice
+            if len(lines) >= Simulation.BLOCK:
+                file.writelines(lines)
+                lines = []
+        file.writelines(lines)
+        file.close()
+
+    def write_binary(self, filename):
+        """ Save charge data to file in the binary format: a header with the
+            settings the text format keeps followed by arrays of types,
+            charges, x, y, dx0 and dy0. """
+        n = len(self.charges)
+        flags = 0
+        stop_time = 0.0
+        if self.stop_time != None:
+            flags |= Simulation.HAS_STOP_TIME
+            stop_time = self.stop_time
+        if self.p3m:
+            flags |= Simulation.P3M
+        file = open(filename, "wb")
+        file.write(struct.pack(Simulation.HEADER, Simulation.MAGIC,
+                               Simulation.VERSION, flags, n, stop_time,
+                               self.dt, self.theta, self.engine_name,
+                               self.integrator_name, self.mesh_spacing,
+                               self.encounter_radius, self.assignment,
+                               self.encounter_policy))
+        # arrays of store are written as they are (initial position of a
+        # fixed charge is its position)
+        write_array(file, self.store.moveable)
+        file.write("\0" * (-n % 8)) # keep float arrays 8-byte aligned
+        q = array.array(self.store.q.typecode, self.store.q)
+        for chg, charge in self.merged.iteritems():
+            q[chg.slot] = charge
+        write_array(file, q)
+        for name in ("x0", "y0", "dx0", "dy0"):
+            write_array(file, getattr(self.store, name))
+        file.close()
+
+    def read_file(self, filename):
+        """ Replace charges with charges from file. Text and binary files are
+            told apart by the first bytes of the file. """
+        file = open(filename, "rb")
+        magic = file.read(len(Simulation.MAGIC))
+        file.close()
+        if magic == Simulation.MAGIC:
+            self.read_binary(filename)
+            return
+        file = open(filename, "r")
+        time = file.readline().strip()
+        # stop time
+        if time != "":
+            self.stop_time = float(time)
+        else:
+            self.stop_time = None
+        # add charges
+        self.clear()
+        self.start()
+        kinds = []
+        data = ([], [], [], [], [])
+        for string in file:
+            info = string.strip().split(" ")
+            if info[0] == "e":
+                # engine settings (time step and integrator were added later)
+                self.set_engine(info[1], theta=float(info[2]))
+                if len(info) > 3:
+                    self.dt = float(info[3])
+                if len(info) > 4:
+                    self.set_integrator(info[4])
+                if len(info) > 7:
+                    self.set_engine(spacing=number(info[5]),
+                                    assignment=info[6], p3m=info[7] == "1")
+                continue
+            if info[0] == "c":
+                # encounter settings (added later)
+                self.set_encounters(info[1], number(info[2]))
+                continue
+            if info[0] == "f":
+                kinds.append(Simulation.KINDS[Charge])
+                info += ["0", "0"]
+            elif info[0] == "t":
+                kinds.append(Simulation.KINDS[Tracer])
+            else:
+                kinds.append(Simulation.KINDS[Moveable])
+            data[0].append(float(info[1]))
+            data[1].append(number(info[2]))
+            data[2].append(number(info[3]))
+            data[3].append(float(info[4]))
+            data[4].append(float(info[5]))
+        file.close()
+        self.add_charges(kinds, *data)
+
+    def read_binary(self, filename):
+        """ Replace charges with charges from a binary file. Arrays are read
+            in bulk. """
+        file = open(filename, "rb")
+        header = file.read(struct.calcsize(Simulation.HEADER_1))
+        (magic, version, flags, n, stop_time, dt, theta, engine_name,
+         integrator_name) = struct.unpack(Simulation.HEADER_1, header)
+        if version > Simulation.VERSION:
+            file.close()
+            raise IOError("file version "+str(version)+" is not supported")
+        if version >= 2:
+            # particle-mesh and encounter settings were added in version 2
+            spacing, radius, assignment, policy = struct.unpack(
+                "<"+Simulation.HEADER[len(Simulation.HEADER_1):],
+                file.read(struct.calcsize(Simulation.HEADER) - len(header)))
+            self.set_engine(spacing=number(config(spacing)),
+                            assignment=assignment.rstrip("\0"),
+                            p3m=flags & Simulation.P3M != 0)
+            self.set_encounters(policy.rstrip("\0"), number(config(radius)))
+        kinds = read_array(file, "B", n)
+        file.read(-n % 8)
+        arrays = [read_array(file, "d", n) for i in xrange(5)]
+        file.close()
+        if flags & Simulation.HAS_STOP_TIME:
+            self.stop_time = stop_time
+        else:
+            self.stop_time = None
+        self.dt = dt
+        self.set_engine(engine_name.rstrip("\0"), theta=theta)
+        self.set_integrator(integrator_name.rstrip("\0"))
+        self.clear()
+        self.start()
+        self.add_charges(kinds, *arrays)
+
+    def checkpoint(self):
+        """ Return copy of the full state of the run for write_checkpoint.
+            Only the arrays are copied, so it is quick to take between
+            steps. """
+        flags = 0
+        stop_time = 0.0
+        if self.stop_time != None:
+            flags |= Simulation.HAS_STOP_TIME
+            stop_time = self.stop_time
+        if self.rounded:
+            flags |= Simulation.ROUNDED
+        if self.cache_fixed:
+            flags |= Simulation.CACHE_FIXED
+        # integrators remember step sizes and forces between steps
+        state = cPickle.dumps((self.integrator.__dict__,
+                               (self.mesh_spacing, self.assignment, self.p3m),
+                               (self.encounter_policy, self.encounter_radius,
+                                self.halted,
+                                [(chg.slot, charge) for chg, charge in
+                                 self.merged.iteritems()]),
+                               (self.bounds, self.auto_stop,
+                                [(e.charge.slot,) + e[1:] for e in
+                                 self.escaped])), 2)
+        header = struct.pack(Simulation.CHECKPOINT_HEADER,
+                             Simulation.CHECKPOINT_MAGIC,
+                             Simulation.CHECKPOINT_VERSION, flags,
+                             len(self.store), stop_time, self.dt, self.theta,
+                             self.steps, self.engine_name,
+                             self.integrator_name, len(state))
+        arrays = [self.store.moveable[:]]
+        for name in Simulation.CHECKPOINT_ARRAYS:
+            arrays.append(getattr(self.store, name)[:])
+        return header, arrays, state
+
+    def write_checkpoint(self, filename, checkpoint=None):
+        """ Save 'checkpoint' (the current state if None) to file: a header
+            followed by arrays of types, charges, positions, velocities,
+            initial positions and initial velocities, the state of the
+            integrator, particle-mesh settings, encounter state and escaped
+            charges. The file is replaced only once it is complete. """
+        if checkpoint == None:
+            checkpoint = self.checkpoint()
+        header, arrays, state = checkpoint
+        file = open(filename+".tmp", "wb")
+        file.write(header)
+        write_array(file, arrays[0])
+        file.write("\0" * (-len(arrays[0]) % 8)) # keep float arrays 8-byte aligned
+        for values in arrays[1:]:
+            write_array(file, values)
+        file.write(state)
+        file.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename+".tmp", filename)
+
+    def read_checkpoint(self, filename):
+        """ Replace charges and state of run with a checkpoint. The run
+            carries on from where the checkpoint was taken when it is
+            stepped (start would restart it). """
+        file = open(filename, "rb")
+        header = file.read(struct.calcsize(Simulation.CHECKPOINT_HEADER))
+        if header[:len(Simulation.CHECKPOINT_MAGIC)] != Simulation.CHECKPOINT_MAGIC:
+            file.close()
+            raise IOError(filename+" is not a checkpoint")
+        (magic, version, flags, n, stop_time, dt, theta, steps, engine_name,
+         integrator_name, size) = struct.unpack(Simulation.CHECKPOINT_HEADER,
+                                                header)
+        if version > Simulation.CHECKPOINT_VERSION:
+            file.close()
+            raise IOError("checkpoint version "+str(version)+" is not supported")
+        kinds = read_array(file, "B", n)
+        file.read(-n % 8)
+        arrays = {}
+        for name in Simulation.CHECKPOINT_ARRAYS:
+            arrays[name] = read_array(file, "d", n)
+        state = cPickle.loads(file.read(size))
+        file.close()
+        self.end_recording()
+        if flags & Simulation.HAS_STOP_TIME:
+            self.stop_time = stop_time
+        else:
+            self.stop_time = None
+        self.dt = dt
+        self.cache_fixed = flags & Simulation.CACHE_FIXED != 0
+        self.set_engine(engine_name.rstrip("\0"),
+                        flags & Simulation.ROUNDED != 0, theta, *state[1])
+        self.set_integrator(integrator_name.rstrip("\0"))
+        self.integrator.__dict__.update(state[0])
+        self.tolerance = state[0].get("tolerance", self.tolerance)
+        self.clear()
+        self.add_charges(kinds, arrays["q"], arrays["x0"], arrays["y0"],
+                         arrays["dx0"], arrays["dy0"])
+        store = self.store
+        for name in ("x", "y", "dx", "dy"):
+            getattr(store, name)[:] = arrays[name]
+        store.next_x[:] = arrays["x"]
+        store.next_y[:] = arrays["y"]
+        policy, radius, self.halted, merged = state[2]
+        self.set_encounters(policy, radius)
+        for slot, charge in merged:
+            self.merged[store.views[slot]] = charge
+        self.bounds, self.auto_stop, escaped = state[3]
+        for escape in escaped:
+            store.deactivate(escape[0])
+            self.escaped.append(Escape(store.views[escape[0]], *escape[1:]))
+        self.steps = steps
+        self.time = steps * dt
+        self._autosaved = time.time()
+
+    def autosave(self):
+        """ Write checkpoint to autosave_file in another thread so stepping
+            goes on. Skipped if the last checkpoint is still being
+            written. """
+        self._autosaved = time.time()
+        if self._autosaver != None and self._autosaver.is_alive():
+            return
+        self._autosaver = threading.Thread(target=self.write_checkpoint,
+                                           args=(self.autosave_file,
+                                                 self.checkpoint()))
+        self._autosaver.daemon = True
+        self._autosaver.start()
+
+    def add_charges(self, kinds, charges, xs, ys, dx0s, dy0s):
+        """ Add many charges at once and return them. 'kinds' holds a value
+            of KINDS for each charge and the other sequences hold their data
+            (fixed charges must have no velocity). """
+        store = self.store
+        first = store.extend(kinds, charges, xs, ys, dx0s, dy0s)
+        fixed = Simulation.KINDS[Charge]
+        tracer = Simulation.KINDS[Tracer]
+        for i in xrange(first, len(store)):
+            if store.moveable[i] == fixed:
+                chg = Charge.view(store, i)
+                chg.on_change = self.charge_changed
+            elif store.moveable[i] == tracer:
+                Tracer.view(store, i)
+            else:
+                Moveable.view(store, i)
+        self.invalidate()
+        return store.views[first:]
+
+    ### Properties ###
+    ## charges
+    def get_charges(self):
+        return self.store.views
+    charges = property(get_charges)
+    ## finished
+    def get_finished(self):
+        return self.halted or (self.stop_time != None and
+                               round(self.time, 6) >= self.stop_time)
+    finished = property(get_finished)
+    ## replayable
+    def get_replayable(self):
+        return (self.trajectory != None and self.trajectory.frames > 0 and
+                self._recorded == (self.store, self.store.edits))
+    replayable = property(get_replayable)
+    ## at_start
+    def get_at_start(self):
+        store = self.store
+        return (store.x == store.x0 and store.y == store.y0 and
+                store.dx == store.dx0 and store.dy == store.dy0)
+    at_start = property(get_at_start)
+
+class Profiler(object):
+    """ Rolling timings of parts of the program. The last SAMPLES durations
+        of each section and the counts (of steps and frames) of the last
+        RATE_WINDOW seconds are kept. Functions passed to subscribe are
+        called with a dictionary of the timings of each frame. Sections may
+        be timed from any thread. """
+    SAMPLES = 200      # durations kept for each section
+    RATE_WINDOW = 1.0  # seconds counts are averaged over
+    COUNTS = 4096      # most counts kept for each name
+    FRAMES = 1000      # frames kept for export
+
+    def __init__(self):
+        """ Initialize profiler and set variables. """
+        self.frames = collections.deque(maxlen=Profiler.FRAMES) # timings
+                                                                # of frames
+        self._times = {}        # recent durations of each section
+        self._counts = {}       # times and sizes of recent counts
+        self._frame = {}        # durations added since last frame
+        self._hooks = []        # functions called after each frame
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        """ Add a duration of section 'name'. """
+        with self._lock:
+            if name not in self._times:
+                self._times[name] = collections.deque(maxlen=Profiler.SAMPLES)
+            self._times[name].append(seconds)
+            self._frame[name] = self._frame.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        """ Count 'n' events called 'name'. """
+        with self._lock:
+            if name not in self._counts:
+                self._counts[name] = collections.deque(maxlen=Profiler.COUNTS)
+            self._counts[name].append((time.time(), n))
+
+    def end_frame(self, **values):
+        """ Finish timings of a frame and pass them to subscribers. 'values'
+            are added to the timings. """
+        with self._lock:
+            frame = self._frame
+            self._frame = {}
+        frame.update(values)
+        frame["time"] = time.time()
+        self.frames.append(frame)
+        self.count("frames")
+        for hook in list(self._hooks):
+            hook(frame)
+
+    def subscribe(self, hook):
+        """ Call 'hook' with the timings of every frame. """
+        self._hooks.append(hook)
+
+    def unsubscribe(self, hook):
+        """ Stop calling 'hook'. """
+        self._hooks.remove(hook)
+
+    def stats(self, name):
+        """ Return median, 95th percentile and maximum of recent durations of
+            section 'name' and how many there are. """
+        with self._lock:
+            times = sorted(self._times.get(name, ()))
+        if len(times) == 0:
+            return {"p50" : 0.0, "p95" : 0.0, "max" : 0.0, "samples" : 0}
+        return {
+            "p50"     : times[int(0.5 * (len(times) - 1))],
+            "p95"     : times[int(0.95 * (len(times) - 1))],
+            "max"     : times[-1],
+            "samples" : len(times)}
+
+    def rate(self, name):
+        """ Return events called 'name' per second. """
+        now = time.time()
+        with self._lock:
+            counts = list(self._counts.get(name, ()))
+        recent = [(t, n) for t, n in counts if t >= now - Profiler.RATE_WINDOW]
+        if len(recent) == 0:
+            return 0.0
+        # if old counts were dropped only the time they cover is used
+        span = Profiler.RATE_WINDOW
+        if len(counts) == Profiler.COUNTS:
+            span = min(span, now - counts[0][0])
+        return sum([n for t, n in recent]) / max(span, 1e-6)
+
+    def sections(self):
+        """ Return sorted names of timed sections. """
+        with self._lock:
+            return sorted(self._times)
+
+    def summary(self):
+        """ Return dictionary of statistics of every section and rates. """
+        summary = {}
+        for name in self.sections():
+            summary[name] = self.stats(name)
+        summary["steps_per_sec"] = self.rate("steps")
+        summary["frames_per_sec"] = self.rate("frames")
+        summary["encounters_per_sec"] = self.rate("encounters")
+        return summary
+
+    def write_json(self, filename):
+        """ Save summary and timings of recent frames as JSON. """
+        file = open(filename, "w")
+        json.dump({"summary" : self.summary(), "frames" : list(self.frames)},
+                  file, indent=1, sort_keys=True)
+        file.close()
+
+    def write_csv(self, filename):
+        """ Save timings of recent frames as CSV with a column for each
+            section. """
+        frames = list(self.frames)
+        names = set()
+        for frame in frames:
+            names.update(frame)
+        names.discard("time")
+        columns = ["time"] + sorted(names)
+        file = open(filename, "wb")
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for frame in frames:
+            writer.writerow([frame.get(name, "") for name in columns])
+        file.close()
+
+# positions of moveable charges published by a PhysicsWorker ('error' is
+# the exception that stopped the run or None)
+Snapshot = collections.namedtuple("Snapshot",
+                                  "serial time steps idx x y q finished "
+                                  "encounters escaped error")
+
+class PhysicsWorker(object):
+    """ Thread that steps a simulation so the window only has to draw.
+        Other threads send commands (functions) that run between steps and
+        read the positions from the latest Snapshot. """
+    PUBLISH = 0.02   # most seconds between snapshots while stepping
+    MAX_STEPS = 200  # most steps taken at once to catch up with real time
+
+    def __init__(self, sim, turbo=False):
+        """ Start thread stepping 'sim'. """
+        self.sim = sim           # simulation being stepped
+        self.turbo = turbo       # whether or not to run as fast as possible
+        self.snapshot = None     # latest positions (None before first step)
+        self._serial = 0         # number of last snapshot
+        self._stepping = False   # whether or not simulation is running
+        self._quit = False       # whether or not thread should end
+        self._last = 0.0         # value of last call to time.time()
+        self._lag = 0.0          # real seconds simulation is behind
+        self._commands = Queue.Queue() # functions to run in thread
+        self._thread = threading.Thread(target=self.loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def call(self, function, *args):
+        """ Run 'function' with 'args' in worker thread between steps and
+            return its result once it has run. """
+        if threading.current_thread() is self._thread:
+            return function(*args)
+        done = threading.Event()
+        result = []
+        self._commands.put((function, args, done, result))
+        done.wait()
+        if result[1] != None:
+            raise result[1]
+        return result[0]
+
+    def post(self, function, *args):
+        """ Run 'function' with 'args' in worker thread without waiting. """
+        self._commands.put((function, args, None, []))
+
+    def resume(self):
+        """ Start stepping. """
+        self.call(self.set_stepping, True)
+
+    def pause(self):
+        """ Stop stepping. No steps are taken after this returns. """
+        self.call(self.set_stepping, False)
+
+    def quit(self):
+        """ Stop stepping and end thread. """
+        self.call(self.set_stepping, False)
+        self.post(setattr, self, "_quit", True)
+        self._thread.join()
+
+    def set_stepping(self, stepping):
+        """ Start or stop stepping. Runs in worker thread. """
+        self._stepping = stepping
+        self._last = time.time()
+        self._lag = 0.0
+
+    def loop(self):
+        """ Run commands and step simulation until quit. Runs in worker
+            thread. """
+        while not self._quit:
+            if self._stepping:
+                try:
+                    wait = self.advance()
+                except(Exception), error:
+                    # stop instead of dying so calls are still answered
+                    self._stepping = False
+                    self.publish(error)
+                    wait = None
+            else:
+                wait = None # nothing to do until a command comes
+            self.run_commands(wait)
+
+    def run_commands(self, wait):
+        """ Run queued commands. Waits up to 'wait' seconds (forever if None)
+            for the first one. """
+        try:
+            if wait == None:
+                command = self._commands.get()
+            elif wait > 0:
+                command = self._commands.get(True, wait)
+            else:
+                command = self._commands.get_nowait()
+            while True:
+                function, args, done, result = command
+                try:
+                    result.extend([function(*args), None])
+                except(Exception), error:
+                    result.extend([None, error])
+                if done != None:
+                    done.set()
+                command = self._commands.get_nowait()
+        except(Queue.Empty):
+            pass
+
+    def advance(self):
+        """ Take as many steps as are needed to keep up with real time (or
+            as many as fit in PUBLISH in turbo mode) and publish positions.
+            Returns seconds until next step is due. """
+        sim = self.sim
+        now = time.time()
+        start = sim.steps
+        if self.turbo:
+            end = now + PhysicsWorker.PUBLISH
+            while not sim.finished and time.time() < end:
+                sim.step()
+        else:
+            self._lag += now - self._last
+            steps = min(int(self._lag / sim.dt), PhysicsWorker.MAX_STEPS)
+            if steps == PhysicsWorker.MAX_STEPS:
+                # too far behind to catch up so let simulation slow down
+                self._lag = 0.0
+            else:
+                self._lag -= steps * sim.dt
+            sim.run(steps)
+        self._last = now
+        if sim.finished:
+            self._stepping = False
+        if sim.steps != start or sim.finished:
+            self.publish()
+        if self.turbo or not self._stepping:
+            return 0
+        return min(sim.dt - self._lag, PhysicsWorker.PUBLISH)
+
+    def publish(self, error=None):
+        """ Make copy of positions of moveable charges the latest snapshot.
+            'error' is the exception that stopped stepping (if any). """
+        sim = self.sim
+        idx = sim.store.moveables()
+        x = array.array("d")
+        y = array.array("d")
+        gather(x, sim.store.x, idx)
+        gather(y, sim.store.y, idx)
+        q = array.array("d")
+        gather(q, sim.store.q, idx) # merges change charges during a run
+        self._serial += 1
+        self.snapshot = Snapshot(self._serial, sim.time, sim.steps,
+                                 tuple(idx), x, y, q,
+                                 sim.finished or error != None,
+                                 sim.encounters, len(sim.escaped), error)
+
+class FieldLineTracer(object):
+    """ Traces field lines through the field of a set of charges. Lines are
+        integrated along the direction of the field with an adaptive
+        Dormand-Prince step until they reach another charge, leave the region
+        or get too long. """
+    LINES = 12          # lines started around each charge
+    TOLERANCE = 0.01    # allowed error per step in pixels
+    MIN_STEP = 0.25     # shortest step in pixels
+    MAX_STEP = 20.0     # longest step in pixels
+    MAX_POINTS = 5000   # most points in a line
+
+    def __init__(self, sources, bounds):
+        """ Initialize tracer. 'sources' is a list of (x, y, charge) and
+            'bounds' is the region (x1, y1, x2, y2) lines are traced in. """
+        self.sources = sources
+        self.bounds = bounds
+        # converted once instead of at every stage of every step
+        if numpy != None:
+            self.source_array = numpy.array(sources, float)
+        else:
+            self.source_array = sources
+
+    def seeds(self):
+        """ Return starting points (x, y, direction, index of charge) of
+            lines around every charge. Lines go with the field from positive
+            charges and against it from negative charges. """
+        seeds = []
+        for k in xrange(len(self.sources)):
+            sx, sy, sq = self.sources[k]
+            if sq == 0:
+                continue
+            for n in xrange(FieldLineTracer.LINES):
+                angle = 2 * math.pi * (n + 0.5) / FieldLineTracer.LINES
+                seeds.append((sx + Charge.RADIUS * math.cos(angle),
+                              sy + Charge.RADIUS * math.sin(angle),
+                              1 if sq > 0 else -1, k))
+        return seeds
+
+    def direction(self, x, y, sign):
+        """ Return unit vector along field at 'x', 'y' times 'sign' or None if
+            there is no field. """
+        ex, ey = field_at([x], [y], self.source_array)
+        mag = math.hypot(ex[0], ey[0])
+        if mag == 0:
+            return None
+        return sign * ex[0] / mag, sign * ey[0] / mag
+
+    def trace(self, x, y, sign, origin):
+        """ Return list of points on line starting at 'x', 'y' from charge
+            with index 'origin'. """
+        points = [(x, y)]
+        x1, y1, x2, y2 = self.bounds
+        h = 2.0
+        k1 = self.direction(x, y, sign)
+        while k1 != None and len(points) < FieldLineTracer.MAX_POINTS:
+            k = [k1]
+            for a in RK45Integrator.A[1:]:
+                sx = x + h * sum([a[m] * k[m][0] for m in xrange(len(a))])
+                sy = y + h * sum([a[m] * k[m][1] for m in xrange(len(a))])
+                d = self.direction(sx, sy, sign)
+                if d == None:
+                    return points
+                k.append(d)
+            ex = h * sum([RK45Integrator.E[m] * k[m][0] for m in xrange(7)])
+            ey = h * sum([RK45Integrator.E[m] * k[m][1] for m in xrange(7)])
+            error = math.hypot(ex, ey)
+            if error > FieldLineTracer.TOLERANCE and h > FieldLineTracer.MIN_STEP:
+                h = max(FieldLineTracer.MIN_STEP, h * max(0.2, 0.9 * math.pow(FieldLineTracer.TOLERANCE / error, 0.2)))
+                continue
+            # accept step
+            x = sx
+            y = sy
+            k1 = k[6]
+            points.append((x, y))
+            if x < x1 or x > x2 or y < y1 or y > y2 or self.hit(x, y, origin):
+                break
+            if error == 0:
+                h *= 5.0
+            else:
+                h *= min(5.0, 0.9 * math.pow(FieldLineTracer.TOLERANCE / error, 0.2))
+            h = min(FieldLineTracer.MAX_STEP, max(FieldLineTracer.MIN_STEP, h))
+        return points
+
+    def hit(self, x, y, origin):
+        """ Return whether 'x', 'y' is inside a charge. The line may leave its
+            own charge at 'origin' so the distance to it is only checked
+            against a smaller radius. """
+        for k in xrange(len(self.sources)):
+            sx, sy, sq = self.sources[k]
+            if sq == 0:
+                continue
+            radius = Charge.RADIUS * 0.9 if k == origin else Charge.RADIUS
+            if (x - sx) * (x - sx) + (y - sy) * (y - sy) < radius * radius:
+                return True
+        return False
+
+# tracer used by field line worker processes
+_tracer = [None]
+
+def init_tracer(sources, bounds):
+    """ Create tracer for field lines traced in this process. """
+    _tracer[0] = FieldLineTracer(sources, bounds)
+
+def trace_line(seed):
+    """ Return points of line starting at 'seed' (from seeds()). Runs in a
+        worker process after init_tracer. """
+    return _tracer[0].trace(*seed)
+
+class SweepScene(object):
+    """ Base scene of a sweep loaded in a worker process. Each variant
+        changes the initial velocity and charge of one moveable charge and
+        runs the scene until its stop time or until the charge escapes. """
+    ESCAPE = 4.0       # escape distance in half diagonals of the scene
+    MIN_ESCAPE = 500.0 # shortest escape distance
+
+    def __init__(self, filename, target, escape=None):
+        """ Read scene from 'filename'. 'target' is the index of the charge
+            that is changed and 'escape' is how far from the center of the
+            scene it must get to escape (None picks a distance from the size
+            of the scene). """
+        self.sim = Simulation()
+        self.sim.read_file(filename)
+        if self.sim.stop_time == None:
+            raise ValueError(filename+" has no stop time")
+        self.target = self.sim.charges[target]
+        if not isinstance(self.target, Moveable):
+            raise ValueError("charge "+str(target)+" is not moveable")
+        store = self.sim.store
+        x1 = min(store.x0)
+        y1 = min(store.y0)
+        x2 = max(store.x0)
+        y2 = max(store.y0)
+        self.cx = (x1 + x2) / 2.0 # center of scene
+        self.cy = (y1 + y2) / 2.0
+        if escape == None:
+            escape = max(SweepScene.ESCAPE * math.hypot(x2 - x1, y2 - y1) / 2.0,
+                         SweepScene.MIN_ESCAPE)
+        self.escape = escape
+
+    def run(self, number, magnitude, angle, charge):
+        """ Run variant 'number' and return its row of the results table.
+            'angle' is in degrees counterclockwise from the +x-axis, like the
+            initial velocity entries. """
+        sim = self.sim
+        chg = self.target
+        sim.reset()
+        chg.charge = charge
+        chg.dx0 = magnitude * math.cos(math.radians(angle))
+        chg.dy0 = -magnitude * math.sin(math.radians(angle))
+        sim.start()
+        closest = self.closest()
+        escaped = None
+        while not sim.finished:
+            sim.step()
+            closest = min(closest, self.closest())
+            if math.hypot(chg.x - self.cx, chg.y - self.cy) > self.escape:
+                escaped = sim.time
+                break
+        return (number, magnitude, angle, charge, chg.x, chg.y, closest,
+                escaped, sim.steps)
+
+    def closest(self):
+        """ Return distance from target to nearest other charge. """
+        store = self.sim.store
+        i = self.target.slot
+        if len(store) < 2:
+            return float("inf")
+        if numpy != None:
+            x = to_numpy(store.x)
+            y = to_numpy(store.y)
+            r2 = (x - x[i]) ** 2 + (y - y[i]) ** 2
+            r2[i] = numpy.inf
+            return math.sqrt(r2.min())
+        return math.sqrt(min([(store.x[j] - store.x[i]) ** 2 +
+                              (store.y[j] - store.y[i]) ** 2
+                              for j in xrange(len(store)) if j != i]))
+
+# scene used by sweep worker processes
+_sweep = [None]
+
+def init_sweep(filename, target, escape):
+    """ Load base scene for variants run in this process. """
+    _sweep[0] = SweepScene(filename, target, escape)
+
+def run_variant(variant):
+    """ Return row of results table for 'variant' (number, magnitude, angle,
+        charge). Runs in a worker process after init_sweep. """
+    return _sweep[0].run(*variant)
+
+def spaced(start, stop, count):
+    """ Return list of 'count' evenly spaced values from 'start' to 'stop'. """
+    if count <= 1:
+        return [start]
+    return [start + (stop - start) * i / float(count - 1) for i in xrange(count)]
+
+class Sweep(object):
+    """ Runs every combination of initial speeds, angles and charges of one
+        charge of a scene in worker processes on all cores. Rows are
+        appended to a CSV results table as variants finish, so a sweep that
+        is interrupted carries on where it stopped when it is run again with
+        the same results file. """
+    COLUMNS = ("variant", "magnitude", "angle", "charge", "x", "y",
+               "min_distance", "escape_time", "steps") # results table columns
+
+    def __init__(self, filename, results, magnitudes, angles, charges,
+                 target=None, escape=None):
+        """ Initialize sweep of scene in 'filename' writing to 'results'.
+            'target' is the index of the charge to change (None for the first
+            moveable charge). """
+        self.filename = filename
+        self.results = results
+        self.escape = escape
+        sim = Simulation()
+        sim.read_file(filename)
+        # checked here since errors in worker processes only respawn them
+        if sim.stop_time == None:
+            raise ValueError(filename+" has no stop time")
+        if target == None:
+            moveables = sim.store.moveables()
+            if len(moveables) == 0:
+                raise ValueError(filename+" has no moveable charges")
+            target = moveables[0]
+        if not 0 <= target < len(sim.charges):
+            raise ValueError("there is no charge "+str(target))
+        if not isinstance(sim.charges[target], Moveable):
+            raise ValueError("charge "+str(target)+" is not moveable")
+        self.target = target
+        self.variants = []
+        for magnitude in magnitudes:
+            for angle in angles:
+                for charge in charges:
+                    self.variants.append((len(self.variants), magnitude,
+                                          angle, charge))
+        # identifies the sweep a results file belongs to
+        self.key = hashlib.sha1(repr((sim.scene_key(), target, escape,
+                                      self.variants))).hexdigest()
+
+    def done(self):
+        """ Return set of numbers of variants already in results table. """
+        if not os.path.exists(self.results):
+            return set()
+        file = open(self.results, "rb")
+        first = file.readline().strip()
+        if first != "# sweep "+self.key:
+            file.close()
+            raise ValueError(self.results+" holds results of another sweep")
+        finished = set()
+        for row in csv.reader(file):
+            if len(row) == len(Sweep.COLUMNS) and row[0].isdigit():
+                finished.add(int(row[0]))
+        file.close()
+        return finished
+
+    def run(self, processes=None, progress=None):
+        """ Run variants not already in the results table. 'progress' is
+            called with the number of variants done and the total after
+            each variant. Returns number of variants run. """
+        finished = self.done()
+        pending = [v for v in self.variants if v[0] not in finished]
+        new = not os.path.exists(self.results)
+        file = open(self.results, "ab")
+        writer = csv.writer(file)
+        if new:
+            file.write("# sweep "+self.key+"\n")
+            writer.writerow(Sweep.COLUMNS)
+            file.flush()
+        if progress != None:
+            progress(len(finished), len(self.variants))
+        if len(pending) == 0:
+            file.close()
+            return 0
+        pool = multiprocessing.Pool(processes, init_sweep,
+                                    (self.filename, self.target, self.escape))
+        count = 0
+        try:
+            for row in pool.imap_unordered(run_variant, pending):
+                writer.writerow(["" if value == None else value for value in row])
+                file.flush()
+                count += 1
+                if progress != None:
+                    progress(len(finished) + count, len(self.variants))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            file.close()
+        return count
+
+def sweep_main(args):
+    """ Run a sweep from command line arguments 'args'. """
+    parser = argparse.ArgumentParser(prog="e_field_simulation.py sweep",
+                                     description="Run variants of a scene.")
+    parser.add_argument("scene", help=".efd file with a stop time")
+    parser.add_argument("results", help="CSV file results are added to")
+    parser.add_argument("--charge", type=int, default=None,
+                        help="index of charge to change (default: first moveable)")
+    parser.add_argument("--magnitude", type=float, nargs=3, default=None,
+                        metavar=("START", "STOP", "COUNT"),
+                        help="initial speeds")
+    parser.add_argument("--angle", type=float, nargs=3, default=None,
+                        metavar=("START", "STOP", "COUNT"),
+                        help="initial directions in degrees")
+    parser.add_argument("--q", type=float, nargs=3, default=None,
+                        metavar=("START", "STOP", "COUNT"), help="charges")
+    parser.add_argument("--escape", type=float, default=None,
+                        help="distance from center of scene counted as escaping")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    options = parser.parse_args(args)
+    # ranges not given keep the value of the scene
+    sim = Simulation()
+    sim.read_file(options.scene)
+    if sim.stop_time == None:
+        parser.error(options.scene+" has no stop time")
+    if options.charge == None and len(sim.store.moveables()) == 0:
+        parser.error(options.scene+" has no moveable charges")
+    target = options.charge
+    if target == None:
+        target = sim.store.moveables()[0]
+    if not 0 <= target < len(sim.charges):
+        parser.error("there is no charge "+str(target))
+    chg = sim.charges[target]
+    if not isinstance(chg, Moveable):
+        parser.error("charge "+str(target)+" is not moveable")
+    values = []
+    for given, current in ((options.magnitude, math.hypot(chg.dx0, chg.dy0)),
+                           (options.angle, math.degrees(math.atan2(-chg.dy0, chg.dx0))),
+                           (options.q, chg.charge)):
+        if given == None:
+            values.append([current])
+        else:
+            values.append(spaced(given[0], given[1], int(given[2])))
+    runner = Sweep(options.scene, options.results, values[0], values[1],
+                   values[2], options.charge, options.escape)
+    def progress(done, total):
+        sys.stderr.write("\r"+str(done)+"/"+str(total))
+        sys.stderr.flush()
+    runner.run(options.processes, progress)
+    sys.stderr.write("\n")
 
-# get settings
-try:
-    file = open("settings.dat", "r")
-except(IOError):
-    file = open("settings.dat", "w")
-    cPickle.dump(DEFAULT, file)
-    file.close()
-    settings = DEFAULT
-else:
-    settings = cPickle.load(file)
-    file.close()
+def charge_data(xs, ys, charge=1.0, pattern="same", kind=Charge,
+                rand=random, order=None):
+    """ Return data of charges of class 'kind' (Charge, Moveable or Tracer) at
+        'xs', 'ys' for add_charges. 'pattern' picks
+        the signs of the charges: "same" gives every charge 'charge',
+        "alternating" flips the sign from one charge to the next (in
+        'order' if it is given) and "random" picks signs at random. """
+    n = len(xs)
+    if order == None:
+        order = xrange(n)
+    if pattern == "alternating":
+        charges = [charge if k % 2 == 0 else -charge for k in order]
+    elif pattern == "random":
+        charges = [rand.choice((charge, -charge)) for i in xrange(n)]
+    else:
+        charges = [charge] * n
+    return [Simulation.KINDS[kind]] * n, charges, xs, ys, [0.0] * n, [0.0] * n
 
-def save_destroy():
-    """ Save settings and destroy root window. """
-    settings["grid"] = app.grid_on.get()
-    settings["spacing"] = app.grid_spacing.get()
-    settings["minutes"] = app.clock.display_min.get()
-    file = open("settings.dat", "w")
-    cPickle.dump(settings, file)
-    file.close()
-    root.destroy()
+def lattice_charges(x1, y1, x2, y2, spacing, charge=1.0, pattern="same",
+                    kind=Charge, rand=random):
+    """ Return data for add_charges of charges on every grid point (multiple
+        of 'spacing') inside a rectangle, so the lattice lines up with the
+        grid of the window. Alternating signs make a checkerboard. """
+    columns = range(int(math.ceil(x1 / float(spacing))),
+                    int(math.floor(x2 / float(spacing))) + 1)
+    rows = range(int(math.ceil(y1 / float(spacing))),
+                 int(math.floor(y2 / float(spacing))) + 1)
+    xs = [i * spacing for j in rows for i in columns]
+    ys = [j * spacing for j in rows for i in columns]
+    order = [i + j for j in rows for i in columns]
+    return charge_data(xs, ys, charge, pattern, kind, rand, order)
 
-def config(num):
-    """ Converts float to string with ".0" stripped off the end. """
-    string = str(num).rstrip("0").rstrip(".")
-    if string == "-0":
-        string = "0"
-    return string
+def cloud_charges(cx, cy, count, radius, charge=1.0, pattern="same",
+                  kind=Moveable, gaussian=False, rand=random):
+    """ Return data for add_charges of 'count' charges spread evenly over a
+        disk of 'radius' around 'cx', 'cy' or, if 'gaussian' is True, with a
+        normal distribution whose standard deviation is 'radius'. """
+    xs = []
+    ys = []
+    for i in xrange(count):
+        if gaussian:
+            xs.append(rand.gauss(cx, radius))
+            ys.append(rand.gauss(cy, radius))
+        else:
+            r = radius * math.sqrt(rand.random())
+            a = rand.uniform(0.0, 2.0 * math.pi)
+            xs.append(cx + r * math.cos(a))
+            ys.append(cy + r * math.sin(a))
+    return charge_data(xs, ys, charge, pattern, kind, rand)
 
-class Charge(object):
-    """ A basic charge. """
-    RADIUS = 10          # radius of charge
-    posColor = "#ff0000" # color of positive charge
-    negColor = "#0000ff" # color of negative charge
-    neuColor = "#00e000" # color of neutral charge
+def ring_charges(cx, cy, count, radius, charge=1.0, pattern="same",
+                 kind=Charge, rand=random):
+    """ Return data for add_charges of 'count' charges evenly spaced around a
+        circle of 'radius' around 'cx', 'cy'. """
+    angles = [2.0 * math.pi * i / count for i in xrange(count)]
+    return charge_data([cx + radius * math.cos(a) for a in angles],
+                       [cy + radius * math.sin(a) for a in angles],
+                       charge, pattern, kind, rand)
 
-    def __init__(self, app, charge=0.0, x=0, y=0):
-        """ Initialize charge and set variables. """
-        self._x = x            # x coordinate
-        self._y = y            # y coordinate
-        self._charge = charge  # charge
-        self.app = app         # used to access Application's atributes
-        self.draw()
-
-    def draw(self):
-        """ Draw image on screen. """
-        self.id = self.app.canvas.create_oval(self.x-Charge.RADIUS,
-                                              self.y-Charge.RADIUS,
-                                              self.x+Charge.RADIUS,
-                                              self.y+Charge.RADIUS,
-                                              outline=self.color,
-                                              fill=self.color, tag="charge")
+def line_charges(x1, y1, x2, y2, count, charge=1.0, pattern="same",
+                 kind=Charge, rand=random):
+    """ Return data for add_charges of 'count' charges evenly spaced from
+        'x1', 'y1' to 'x2', 'y2'. """
+    return charge_data(spaced(x1, x2, count), spaced(y1, y2, count), charge,
+                       pattern, kind, rand)
 
-    def erase(self):
-        """ Remove image from screen. """
-        self.app.canvas.delete(self.id)
+# charge generators by name shown in Generate window
+GENERATORS = ("Lattice", "Cloud", "Gaussian Cloud", "Ring", "Line")
 
-    def update(self):
-        """ Syncs up image with x and y values. """
-        self.erase()
-        self.draw()
+def dipole_scene(n, rand, side):
+    """ Return data of a fixed dipole with moveable test charges around it
+        for add_charges. """
+    c = side / 2.0
+    d = max(side / 20.0, 2.0 * Charge.RADIUS)
+    data = ([0, 0], [5.0, -5.0], [c - d, c + d], [c, c], [0.0, 0.0],
+            [0.0, 0.0])
+    for i in xrange(n - 2):
+        r = rand.uniform(2.0 * d, side / 2.0)
+        a = rand.uniform(0.0, 2.0 * math.pi)
+        add_bench_charge(data, 1, 1.0, c + r * math.cos(a),
+                         c + r * math.sin(a), 0.0, 0.0)
+    return data
 
-    def follow(self, event):
-        """ Follow cursor on screen. """
-        if self.app.grid_on.get():
-            self._x = int(event.x + self.app.grid_spacing.get() // 2) // self.app.grid_spacing.get() * self.app.grid_spacing.get()
-            self._y = int(event.y + self.app.grid_spacing.get() // 2) // self.app.grid_spacing.get() * self.app.grid_spacing.get()
-        else:
-            self._x = event.x
-            self._y = event.y
-        self.update()
+def gas_scene(n, rand, side):
+    """ Return data of moveable charges of both signs spread evenly with
+        random velocities for add_charges. """
+    data = ([], [], [], [], [], [])
+    for i in xrange(n):
+        add_bench_charge(data, 1, rand.choice((-1.0, 1.0)),
+                         rand.uniform(0, side), rand.uniform(0, side),
+                         rand.gauss(0.0, 1.0), rand.gauss(0.0, 1.0))
+    return data
 
-    ### Properties ###
-    ## x
-    def get_x(self):
-        return self._x
-    x = property(get_x)
-    ## y
-    def get_y(self):
-        return self._y
-    y = property(get_y)
-    ## calc_x
-    def get_calc_x(self):
-        return self._x
-    calc_x = property(get_calc_x)
-    ## calc_y
-    def get_calc_y(self):
-        return self._y
-    calc_y = property(get_calc_y)
-    ## color
-    def get_color(self):
-        if self.charge > 0:
-            return Charge.posColor
-        elif self.charge < 0:
-            return Charge.negColor
-        else:
-            return Charge.neuColor
-    color = property(get_color)
-    ## charge
-    def get_charge(self):
-        return self._charge
-    def set_charge(self, new_charge):
-        self._charge = new_charge
-    charge = property(get_charge, set_charge)
+def lattice_scene(n, rand, side):
+    """ Return data of a square lattice of fixed charges of alternating sign
+        holding half the charges, with moveable charges between them, for
+        add_charges. """
+    data = ([], [], [], [], [], [])
+    rows = max(int(math.sqrt(n / 2)), 1)
+    gap = side / float(rows)
+    for i in xrange(rows):
+        for j in xrange(rows):
+            add_bench_charge(data, 0, (-1.0) ** (i + j), (i + 0.5) * gap,
+                             (j + 0.5) * gap, 0.0, 0.0)
+    for i in xrange(n - rows * rows):
+        add_bench_charge(data, 1, rand.choice((-1.0, 1.0)),
+                         rand.uniform(0, side), rand.uniform(0, side),
+                         0.0, 0.0)
+    return data
 
-class Moveable(Charge):
-    """ A charge that will move in an E-field. """
-    FIELD_CONSTANT = 800 # used to adjust force between charges
-    PRECISION = 5        # number of decimal places to round acceleration to
-    def __init__(self, app, charge=0.0, x=0, y=0, dx0=0.0, dy0=0.0):
-        """ Initialize charge and set variables. """
-        Charge.__init__(self, app, charge, x, y)
-        self._calc_x = x # x before last movement
-        self._calc_y = y # y before last movement
-                         # (used to calculate distances between charges when
-                         #  calculating force, not updated until all charges
-                         #  are moved to simulate simaltaneous forces)
-        self._x0 = x     # initial x
-        self._y0 = y     # initial y
-        self._dx = dx0   # x-component of velocity
-        self._dy = dy0   # y-component of velocity
-        self._dx0 = dx0  # initial x-component of velocity
-        self._dy0 = dy0  # initial y-component of velocity
+def cluster_scene(n, rand, side):
+    """ Return data of clusters of moveable charges at rest that attract
+        each other and collapse, for add_charges. """
+    data = ([], [], [], [], [], [])
+    centers = [(side * 0.25, side * 0.25), (side * 0.75, side * 0.75),
+               (side * 0.75, side * 0.25), (side * 0.25, side * 0.75)]
+    for i in xrange(n):
+        k = i % len(centers)
+        add_bench_charge(data, 1, 1.0 if k < 2 else -1.0,
+                         rand.gauss(centers[k][0], side / 16.0),
+                         rand.gauss(centers[k][1], side / 16.0), 0.0, 0.0)
+    return data
 
-    def follow(self, event):
-        """ Update initial x and y when following cursor. """
-        Charge.follow(self, event)
-        self._x0 = self._x
-        self._y0 = self._y
-        self._calc_x = self._x
-        self._calc_y = self._y
-
-    def sync_calc(self):
-        """ Sync calc coords with actual coords. """
-        self._calc_x = self._x
-        self._calc_y = self._y
-
-    def update_pos(self):
-        """ Change position based on forces from E-field. """
-        for charge in self.app.charges:
-            if charge != self:
-                force = Moveable.FIELD_CONSTANT * self.charge * charge.charge / (math.pow(self.calc_x - charge.calc_x, 2) + math.pow(self.calc_y - charge.calc_y, 2))
-                angle = math.atan2(self.calc_y - charge.calc_y,
-                                   self.calc_x - charge.calc_x)
-                self._dx += round(force * math.cos(angle), Moveable.PRECISION)
-                self._dy += round(force * math.sin(angle), Moveable.PRECISION)
-        # update coordinates
-        self._x += self._dx
-        self._y += self._dy
-        self.update()
+def add_bench_charge(data, kind, charge, x, y, dx0, dy0):
+    """ Add a charge to scene 'data' (lists of add_charges). """
+    for values, value in zip(data, (kind, charge, x, y, dx0, dy0)):
+        values.append(value)
 
-    def reset(self):
-        """ Reset position and velocity and update. """
-        self.reset_pos()
-        self.reset_vel()
-        self.update()
+BENCH_SCENES = {
+    "dipole"  : dipole_scene,
+    "gas"     : gas_scene,
+    "lattice" : lattice_scene,
+    "cluster" : cluster_scene}
 
-    def reset_pos(self):
-        """ Set x and y to initial x and y. """
-        self._x = self._calc_x = self._x0
-        self._y = self._calc_y = self._y0
+class Benchmark(object):
+    """ Times steps per second, saving and loading of .efd files and drawing
+        of frames for generated scenes. Scenes are made from a seed so every
+        run times the same charges. Results are named
+        "scene/N/measurement" (steps per second also name the engine) and
+        can be compared with the results of an earlier run. """
+    SCENES = ("dipole", "gas", "lattice", "cluster") # scenes in order run
+    SIZES = (10, 100, 1000, 10000, 100000)           # numbers of charges
+    SPACING = 30.0     # average pixels between charges
+    BUDGET = 1.0       # seconds each measurement is repeated for
+    MAX_CHARGES = {
+        "python"    : 1000,
+        "numpy"     : 10000,
+        "barneshut" : 100000,
+        "pm"        : 100000} # largest scene stepped with each engine
+    VERSION = 1        # version of results file
 
-    def reset_vel(self):
-        """ Set velocity to initial velocity. """
-        self._dx = self._dx0
-        self._dy = self._dy0
+    def __init__(self, scenes=SCENES, sizes=SIZES, engines=("numpy",),
+                 integrator="euler", seed=0, budget=BUDGET, render=True):
+        """ Initialize benchmark and set variables. """
+        self.scenes = scenes
+        self.sizes = sizes
+        self.engines = engines
+        self.integrator = integrator
+        self.seed = seed
+        self.budget = budget
+        self.render = render
+        self.root = None     # window frames are drawn in (None if no display)
 
-    ### Properties ###
-    ## calc_x
-    def get_calc_x(self):
-        return self._calc_x
-    calc_x = property(get_calc_x)
-    ## calc_y
-    def get_calc_y(self):
-        return self._calc_y
-    calc_y = property(get_calc_y)
+    def scene(self, name, n):
+        """ Return a simulation holding scene 'name' with 'n' charges. """
+        side = Benchmark.SPACING * math.sqrt(n)
+        rand = random.Random(self.seed * 1000003 + n * 16 +
+                             Benchmark.SCENES.index(name))
+        sim = Simulation(integrator_name=self.integrator)
+        sim.add_charges(*BENCH_SCENES[name](n, rand, side))
+        return sim
 
-    ## x0
-    def get_x0(self):
-        return self._x0
-    x0 = property(get_x0)
-    ## y0
-    def get_y0(self):
-        return self._y0
-    y0 = property(get_y0)
+    def timed(self, function):
+        """ Return average seconds per call of 'function', which is called
+            until the budget is spent (at least once). """
+        calls = 0
+        start = time.time()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.time() - start
+            if elapsed >= self.budget:
+                return elapsed / calls
 
-    ## dx0
-    def get_dx0(self):
-        return self._dx0
-    def set_dx0(self, new_dx0):
-        self._dx0 = self._dx = new_dx0
-    dx0 = property(get_dx0, set_dx0)
-    ## dy0
-    def get_dy0(self):
-        return self._dy0
-    def set_dy0(self, new_dy0):
-        self._dy0 = self._dy = new_dy0
-    dy0 = property(get_dy0, set_dy0)
+    def run(self, progress=None):
+        """ Run every measurement and return dictionary of results.
+            'progress' is called with the name and value of each result. """
+        results = collections.OrderedDict()
+        def record(name, value):
+            results[name] = value
+            if progress != None:
+                progress(name, value)
+        if self.render:
+            try:
+                self.root = Tk()
+            except(TclError):
+                self.root = None
+        try:
+            for name in self.scenes:
+                for n in self.sizes:
+                    sim = self.scene(name, n)
+                    prefix = name+"/"+str(n)+"/"
+                    for engine in self.engines:
+                        if n > Benchmark.MAX_CHARGES.get(engine, 0):
+                            continue
+                        sim.set_engine(engine)
+                        sim.reset()
+                        sim.start()
+                        record(prefix+engine+"/steps_per_sec",
+                               1.0 / self.timed(sim.step))
+                    sim.reset()
+                    for binary in (False, True):
+                        kind = "binary" if binary else "text"
+                        save, load = self.time_file(sim, binary)
+                        record(prefix+"save_"+kind+"_per_sec", n / save)
+                        record(prefix+"load_"+kind+"_per_sec", n / load)
+                    if self.root != None:
+                        record(prefix+"frame_ms", self.time_frame(sim) * 1000.0)
+        finally:
+            if self.root != None:
+                self.root.destroy()
+                self.root = None
+        return results
+
+    def time_file(self, sim, binary):
+        """ Return seconds to save and to load the charges of 'sim'. """
+        handle, filename = tempfile.mkstemp(".efd")
+        os.close(handle)
+        try:
+            save = self.timed(lambda: sim.write_file(filename, binary))
+            loaded = Simulation()
+            load = self.timed(lambda: loaded.read_file(filename))
+        finally:
+            os.remove(filename)
+        return save, load
+
+    def time_frame(self, sim):
+        """ Return seconds to move and draw every moveable charge of 'sim'
+            on a canvas. """
+        side = int(Benchmark.SPACING * math.sqrt(len(sim.store)))
+        canvas = Canvas(self.root, width=side, height=side)
+        canvas.pack()
+        for chg in sim.charges:
+            chg.draw(canvas)
+        self.root.update()
+        views = sim.store.views
+        idx = sim.store.moveables()
+        shift = [1.0]
+        def frame():
+            # move charges a pixel back and forth so every image is moved
+            shift[0] = -shift[0]
+            for i in idx:
+                views[i].update(views[i].x + shift[0], views[i].y)
+            self.root.update_idletasks()
+        try:
+            return self.timed(frame)
+        finally:
+            canvas.destroy()
+
+    def write(self, results, filename):
+        """ Save 'results' with a description of the run as JSON. """
+        file = open(filename, "w")
+        json.dump({"version"    : Benchmark.VERSION,
+                   "seed"       : self.seed,
+                   "integrator" : self.integrator,
+                   "python"     : sys.version.split()[0],
+                   "numpy"      : numpy.__version__ if numpy != None else None,
+                   "platform"   : sys.platform,
+                   "results"    : results}, file, indent=1)
+        file.close()
+
+def read_benchmark(filename):
+    """ Return results saved by Benchmark.write. """
+    file = open(filename, "r")
+    data = json.load(file)
+    file.close()
+    return data["results"]
+
+def compare_benchmark(results, baseline, threshold):
+    """ Return list of (name, baseline value, value) of results more than
+        'threshold' (a fraction) worse than in 'baseline'. Frame times are
+        worse when higher and everything else when lower. """
+    worse = []
+    for name in results:
+        if name not in baseline or not baseline[name]:
+            continue
+        change = (results[name] - baseline[name]) / float(baseline[name])
+        if name.endswith("_ms"):
+            change = -change
+        if change < -threshold:
+            worse.append((name, baseline[name], results[name]))
+    return worse
+
+def bench_main(args):
+    """ Run benchmarks from command line arguments 'args'. Exits with status
+        1 if a result is worse than the baseline. """
+    parser = argparse.ArgumentParser(prog="e_field_simulation.py bench",
+                                     description="Time standard scenes.")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="JSON file results are saved to")
+    parser.add_argument("--baseline", default=None,
+                        help="results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown counted as a regression (fraction)")
+    parser.add_argument("--scenes", nargs="+", default=Benchmark.SCENES,
+                        choices=Benchmark.SCENES)
+    parser.add_argument("--sizes", type=int, nargs="+", default=Benchmark.SIZES)
+    parser.add_argument("--engines", nargs="+", default=None,
+                        choices=sorted(ENGINES),
+                        help="engines to step scenes with (default: numpy)")
+    parser.add_argument("--integrator", default="euler",
+                        choices=sorted(INTEGRATORS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--budget", type=float, default=Benchmark.BUDGET,
+                        help="seconds each measurement is repeated for")
+    parser.add_argument("--no-render", action="store_true",
+                        help="do not time drawing of frames")
+    options = parser.parse_args(args)
+    engines = options.engines
+    if engines == None:
+        engines = ["numpy" if numpy != None else "python"]
+    bench = Benchmark(options.scenes, options.sizes, engines,
+                      options.integrator, options.seed, options.budget,
+                      not options.no_render)
+    def progress(name, value):
+        print name.ljust(40), "%.6g" % value
+    results = bench.run(progress)
+    if not options.no_render and not [n for n in results if n.endswith("_ms")]:
+        sys.stderr.write("no display - frames were not timed\n")
+    bench.write(results, options.output)
+    if options.baseline != None:
+        worse = compare_benchmark(results, read_benchmark(options.baseline),
+                                  options.threshold)
+        for name, old, new in worse:
+            print "regression:", name, "%.6g" % old, "->", "%.6g" % new
+        if len(worse) > 0:
+            sys.exit(1)
+
+def heat_color(t):
+    """ Return heatmap color for 't' from 0 (weak) to 1 (strong). """
+    # white, yellow, orange, dark red
+    stops = ((255, 255, 255), (255, 230, 130), (255, 120, 0), (160, 0, 0))
+    t = min(1.0, max(0.0, t)) * (len(stops) - 1)
+    k = min(int(t), len(stops) - 2)
+    t -= k
+    rgb = [int(round(stops[k][n] + (stops[k+1][n] - stops[k][n]) * t))
+           for n in xrange(3)]
+    return "#%02x%02x%02x" % tuple(rgb)
+
+class FieldOverlay(object):
+    """ Picture of the field drawn behind the charges. The field is evaluated
+        at the center of each grid cell and drawn as arrows and/or a heatmap of
+        its magnitude into one PhotoImage. The field of fixed charges is kept
+        between updates and only the contributions of fixed charges that have
+        changed are recomputed, and only cells whose picture changed are
+        redrawn. """
+    LEVELS = 32               # colors in heatmap
+    DIRECTIONS = 24           # arrow directions
+    LENGTHS = 4               # arrow lengths
+    LOG_MIN = -3.0            # log10 of magnitude drawn with lowest color
+    LOG_MAX = 1.5             # log10 of magnitude drawn with highest color
+    ARROW_COLOR = "#404040"   # color of arrows
+    MODES = ("off", "arrows", "heatmap", "both")
+
+    def __init__(self, canvas):
+        """ Initialize overlay and set variables. """
+        self.canvas = canvas
+        self.mode = "off"      # what to draw
+        self.spacing = None    # pixels between field points
+        self.width = 0         # width of canvas
+        self.height = 0        # height of canvas
+        self.item = None       # id of image on canvas
+
+    def configure(self, mode, spacing, width, height):
+        """ Set what to draw and size of grid. Clears everything if size of
+            grid changed. """
+        if mode == "off":
+            self.hide()
+            self.mode = mode
+            return
+        if (spacing, width, height) != (self.spacing, self.width, self.height):
+            self.spacing = spacing
+            self.width = width
+            self.height = height
+            self.build()
+        elif mode != self.mode:
+            # redraw every cell
+            self._heat = [None] * len(self.px)
+            self._arrow = [None] * len(self.px)
+        self.mode = mode
+
+    def build(self):
+        """ Create grid, images and arrow sprites. """
+        self.hide()
+        self.cols = max(1, int(math.ceil(self.width / float(self.spacing))))
+        self.rows = max(1, int(math.ceil(self.height / float(self.spacing))))
+        self.px = []
+        self.py = []
+        for j in xrange(self.rows):
+            for i in xrange(self.cols):
+                self.px.append((i + 0.5) * self.spacing)
+                self.py.append((j + 0.5) * self.spacing)
+        # field of fixed charges
+        self._fx = [0.0] * len(self.px)
+        self._fy = [0.0] * len(self.px)
+        self._fixed = {} # (x, y, charge) of each fixed charge in _fx, _fy
+        # what is drawn in each cell
+        self._heat = [None] * len(self.px)
+        self._arrow = [None] * len(self.px)
+        # images
+        self.image = PhotoImage(width=self.cols * self.spacing,
+                                height=self.rows * self.spacing)
+        self.heat = PhotoImage(width=self.cols, height=self.rows)
+        self.arrows = PhotoImage(width=self.cols * self.spacing,
+                                 height=self.rows * self.spacing)
+        self.sprites = {}
+        self.blank = PhotoImage(width=self.spacing, height=self.spacing)
+        self.colors = [heat_color(float(k) / (FieldOverlay.LEVELS - 1))
+                       for k in xrange(FieldOverlay.LEVELS)]
+
+    def hide(self):
+        """ Remove image from canvas. """
+        if self.item != None:
+            self.canvas.delete(self.item)
+            self.item = None
+
+    def update(self, charges, moving=None):
+        """ Recompute field of 'charges' and redraw changed cells. 'moving'
+            is a list of (x, y, charge) of the moveable charges to use
+            instead of the ones in 'charges' (None to use those). """
+        if self.mode == "off":
+            return
+        ex, ey = self.field(charges, moving)
+        self.draw(ex, ey)
+
+    def field(self, charges, moving=None):
+        """ Return lists of x and y field components at every grid point. """
+        # find fixed charges that were added, moved, changed or removed
+        old = []
+        new = []
+        seen = {}
+        for chg in charges:
+            if type(chg) == Charge:
+                state = (chg.x, chg.y, chg.charge)
+                seen[id(chg)] = state
+                if self._fixed.get(id(chg)) != state:
+                    new.append(state)
+                    if id(chg) in self._fixed:
+                        old.append(self._fixed[id(chg)])
+        for key in self._fixed:
+            if key not in seen:
+                old.append(self._fixed[key])
+        if len(old) + len(new) > 0:
+            if len(old) + len(new) >= len(seen):
+                # cheaper to start over
+                self._fx, self._fy = field_at(self.px, self.py, seen.values())
+            else:
+                # subtract old contributions and add new ones
+                removed = [(x, y, -q) for x, y, q in old]
+                dx, dy = field_at(self.px, self.py, removed + new)
+                for k in xrange(len(self.px)):
+                    self._fx[k] += dx[k]
+                    self._fy[k] += dy[k]
+            self._fixed = seen
+        # moveable charges move every frame so their field is recomputed
+        if moving == None:
+            moving = [(chg.x, chg.y, chg.charge) for chg in charges
+                      if type(chg) == Moveable and chg.active]
+        if len(moving) == 0:
+            return self._fx, self._fy
+        mx, my = field_at(self.px, self.py, moving)
+        return ([self._fx[k] + mx[k] for k in xrange(len(mx))],
+                [self._fy[k] + my[k] for k in xrange(len(my))])
+
+    def draw(self, ex, ey):
+        """ Draw field 'ex', 'ey' into image, redrawing only changed cells. """
+        heat_on = self.mode in ("heatmap", "both")
+        arrows_on = self.mode in ("arrows", "both")
+        span = FieldOverlay.LOG_MAX - FieldOverlay.LOG_MIN
+        heat_changed = False
+        for k in xrange(len(self.px)):
+            mag = math.hypot(ex[k], ey[k])
+            if mag > 0:
+                t = (math.log10(mag) - FieldOverlay.LOG_MIN) / span
+                t = min(1.0, max(0.0, t))
+            else:
+                t = 0.0
+            if heat_on:
+                level = int(t * (FieldOverlay.LEVELS - 1))
+                if level != self._heat[k]:
+                    self._heat[k] = level
+                    heat_changed = True
+            if arrows_on:
+                if mag > 0:
+                    angle = math.atan2(ey[k], ex[k])
+                    d = int(round(angle / (2 * math.pi) * FieldOverlay.DIRECTIONS)) % FieldOverlay.DIRECTIONS
+                    sprite = (d, min(FieldOverlay.LENGTHS - 1, int(t * FieldOverlay.LENGTHS)))
+                else:
+                    sprite = None
+                if sprite != self._arrow[k]:
+                    self._arrow[k] = sprite
+                    self.put_sprite(k, sprite)
+        # compose image
+        if heat_on:
+            if heat_changed:
+                rows = []
+                for j in xrange(self.rows):
+                    row = self._heat[j*self.cols:(j+1)*self.cols]
+                    rows.append("{"+" ".join([self.colors[c] for c in row])+"}")
+                self.heat.put(" ".join(rows))
+            self.image.tk.call(self.image, "copy", self.heat, "-zoom",
+                               self.spacing, self.spacing,
+                               "-compositingrule", "set")
+        else:
+            self.image.blank()
+        if arrows_on:
+            self.image.tk.call(self.image, "copy", self.arrows,
+                               "-compositingrule", "overlay")
+        if self.item == None:
+            self.item = self.canvas.create_image(0, 0, image=self.image,
+                                                 anchor=NW, tag="overlay")
+            self.canvas.tag_lower(self.item)
+
+    def put_sprite(self, k, sprite):
+        """ Draw arrow 'sprite' ((direction, length) or None) in cell 'k'. """
+        if sprite == None:
+            image = self.blank
+        else:
+            if sprite not in self.sprites:
+                self.sprites[sprite] = self.make_sprite(sprite[0], sprite[1])
+            image = self.sprites[sprite]
+        x = int(self.px[k] - self.spacing / 2.0)
+        y = int(self.py[k] - self.spacing / 2.0)
+        self.arrows.tk.call(self.arrows, "copy", image, "-to", x, y,
+                            "-compositingrule", "set")
+
+    def make_sprite(self, direction, length):
+        """ Return image of an arrow pointing in 'direction' with 'length'. """
+        size = self.spacing
+        image = PhotoImage(width=size, height=size)
+        angle = 2 * math.pi * direction / FieldOverlay.DIRECTIONS
+        half = size * 0.45 * (length + 1) / FieldOverlay.LENGTHS
+        ux = math.cos(angle)
+        uy = math.sin(angle)
+        c = (size - 1) / 2.0
+        tip = (c + ux * half, c + uy * half)
+        lines = [((c - ux * half, c - uy * half), tip)]
+        # arrow head
+        head = max(2.0, half * 0.6)
+        for side in (0.5, -0.5):
+            hx = math.cos(angle + math.pi + side)
+            hy = math.sin(angle + math.pi + side)
+            lines.append((tip, (tip[0] + hx * head, tip[1] + hy * head)))
+        pixels = {}
+        for (x1, y1), (x2, y2) in lines:
+            steps = int(max(abs(x2 - x1), abs(y2 - y1)) * 2) + 1
+            for n in xrange(steps + 1):
+                x = int(round(x1 + (x2 - x1) * n / float(steps)))
+                y = int(round(y1 + (y2 - y1) * n / float(steps)))
+                if 0 <= x < size and 0 <= y < size:
+                    pixels[(x, y)] = True
+        for x, y in pixels:
+            image.put(FieldOverlay.ARROW_COLOR, to=(x, y))
+        return image
 
 class Clock(Label):
-    """ Clock for displaying how long simulation has been running. """
-    def __init__(self):
+    """ Clock for displaying how much simulated time has passed. """
+    def __init__(self, display_min=False):
         Label.__init__(self, font=tkFont.Font(family="Cambria Math", size=11))
 
         self._value = 0.0     # time on clock
-        self._last = 0        # value of last call to time.time()
-        self._running = False # whether or not clock is running
         self.display_min = BooleanVar(
-                value=settings["minutes"]) # whether or not to display minutes
+                value=display_min) # whether or not to display minutes
 
         self.update_val()
 
-    def tick(self):
-        """ Increase value of clock. """
-        if self._running:
-            temp = time.time()
-            self._value += temp - self._last
-            self._last = temp
-            self.update_val()
-
     def update_val(self):
         """ Syncs label with value. """
         r_value = round(self._value, 1) # value rounded to 1 decimal place
@@ -254,15 +4127,6 @@ class Clock(Label):
             text = str(r_value)
         self.config(text=text)
 
-    def start(self):
-        """ Start clock. """
-        self._running = True
-        self._last = time.time()
-
-    def stop(self):
-        """ Stop clock. """
-        self._running = False
-
     def reset(self):
         """ Reset clock to zero. """
         self._value = 0.0
@@ -272,7 +4136,10 @@ class Clock(Label):
     ## value
     def get_value(self):
         return round(self._value, 1)
-    value = property(get_value)
+    def set_value(self, new_value):
+        self._value = new_value
+        self.update_val()
+    value = property(get_value, set_value)
 
 class Grid_Window(Toplevel):
     """ Window to allow user to set grid spacing. """
@@ -331,17 +4198,101 @@ class Grid_Window(Toplevel):
         self.app.gWindow = None
         self.destroy()
 
+class Generate_Window(Toplevel):
+    """ Window to allow user to add many charges at once. """
+    def __init__(self, app):
+        """ Initialize window and set variables. """
+        Toplevel.__init__(self, app.master)
+        self.geometry("200x166")
+        self.title("Generate Charges")
+        self.resizable(False, False)
+        self.protocol("WM_DELETE_WINDOW", self.clear_destroy)
+
+        self.frame = Frame(self)
+        self.frame.place(x=0, y=0, relwidth=1.0, relheight=1.0)
+        self.app = app
+        self.shape = StringVar(value=GENERATORS[0]) # shape charges are put in
+        self.kind = StringVar(value="Fixed")        # kind of charges
+        self.pattern = StringVar(value="Same")      # signs of charges
+
+        self.create_widgets()
+
+    def create_widgets(self):
+        """ Put all widgets in the window. """
+        OptionMenu(self.frame, self.shape, *GENERATORS
+                   ).place(x=0, y=0, width=200, height=24)
+        OptionMenu(self.frame, self.kind, "Fixed", "Moveable", "Tracer"
+                   ).place(x=0, y=24, width=100, height=24)
+        OptionMenu(self.frame, self.pattern, "Same", "Alternating", "Random"
+                   ).place(x=100, y=24, width=100, height=24)
+        self.entries = {}
+        for row, (label, value) in enumerate((("Count", 100),
+                                              ("Size", 200),
+                                              ("Charge", 1))):
+            Label(self.frame, text=label+":").place(x=0, y=50+row*20)
+            entry = Entry(self.frame)
+            entry.insert(0, str(value))
+            entry.bind("<KeyPress>", self.app.num_only)
+            entry.bind("<Return>", self.generate)
+            entry.place(x=60, y=50+row*20, width=140)
+            self.entries[label] = entry
+        Button(self.frame, text="Add", command=self.generate
+               ).place(x=0, y=116, width=100)
+        Button(self.frame, text="Cancel", command=self.clear_destroy
+               ).place(x=100, y=116, width=100)
+
+    def focus_entry(self):
+        """ Set the focus to the count entry widget. """
+        self.entries["Count"].focus_set()
+
+    def generate(self, event=None):
+        """ Add charges described by widgets to app and destroy self. """
+        try:
+            count = int(float(self.entries["Count"].get()))
+            size = abs(float(self.entries["Size"].get()))
+            charge = float(self.entries["Charge"].get())
+        except(ValueError):
+            return
+        kinds = {"Fixed" : Charge, "Moveable" : Moveable, "Tracer" : Tracer}
+        self.app.generate(self.shape.get(), kinds[self.kind.get()],
+                          max(count, 1), size, charge,
+                          self.pattern.get().lower())
+        self.clear_destroy()
+
+    def clear_destroy(self):
+        """ Clear app's variable that references self and destroy self. """
+        self.app.genWindow = None
+        self.destroy()
+
 class Application(Frame):
-    DELAY = 25                   # milliseconds between simulation screen updates
+    DELAY = 25                   # milliseconds between simulation updates
+    FRAME_DELAY = 40             # minimum milliseconds between screen updates
+    DRAW_BATCH = 2000            # charges drawn per update after opening a file
+    SCRUB = 0.05                 # replay seconds per pixel clock is dragged
+    PROFILE_DELAY = 500          # milliseconds between profiler overlay updates
     MIN_SPACING = 21             # minimum grid spacing
     MAX_SPACING = 100            # maximum grid spacing
     TITLE = "E-field Simulation" # window title
-    def __init__(self, master):
+    def __init__(self, master, settings):
         """ Initialize Frame and set variables. """
         Frame.__init__(self, master)
         self.place(x=0, y=0, relwidth=1.0, relheight=1.0)
 
-        self.charges = []                      # list of charges on screen
+        self.settings = settings               # settings saved on exit
+        self.sim = Simulation(
+            settings["engine"], settings["rounding"],
+            settings["theta"], settings["dt"],
+            settings["integrator"],
+            settings["cache"],
+            settings["record"])                # charges and simulation state
+        self.profiler = Profiler()             # timings of parts of program
+        self.sim.profiler = self.profiler
+        self.sim.set_integrator(tolerance=settings["tolerance"])
+        self.sim.autosave_file = AUTOSAVE_FILE
+        self.sim.autosave_interval = settings["autosave"] * 60
+        self.sim.set_encounters(settings["encounters"], settings["radius"])
+        self.worker = PhysicsWorker(
+            self.sim, settings["turbo"])       # thread stepping sim
         self.selected = None                   # id of charge last clicked on
         self.grid_on = BooleanVar(
             value=settings["grid"])            # whether or not to center charges on grid points
@@ -351,12 +4302,92 @@ class Application(Frame):
             30, 40, 50, 60, 70, 80, 90, 100]
         self.running = False                   # whether or not simulation is running
         self.paused = True                     # whither or not simulation is paused
-        self._stop_time = None                 # when to stop simulation
         self.gWindow = None                    # widow to set custom spacing
+        self.genWindow = None                  # window to generate charges
+        self.engine_name = StringVar(
+            value=settings["engine"])          # name of force engine
+        self.round_forces = BooleanVar(
+            value=settings["rounding"])        # whether or not to round forces
+        self.theta = DoubleVar(
+            value=settings["theta"])           # Barnes-Hut opening angle
+        self.theta_options = [                 # opening angle options in menu
+            0.2, 0.3, 0.5, 0.7, 1.0]
+        self.dt = DoubleVar(
+            value=settings["dt"])              # simulated seconds per step
+        self.dt_options = [                    # time step options in menu
+            0.1, 0.05, 0.025, 0.0125, 0.005, 0.001]
+        self.integrator_name = StringVar(
+            value=settings["integrator"])      # name of integrator
+        self.tolerance = DoubleVar(
+            value=settings["tolerance"])       # allowed error of adaptive integrators
+        self.tolerance_options = [             # tolerance options in menu
+            1e-4, 1e-5, 1e-6, 1e-7]
+        self.cache_fixed = BooleanVar(
+            value=settings["cache"])           # whether or not to cache field of fixed charges
+        self.assignment = StringVar(
+            value=settings["mesh"])            # how particle-mesh engine spreads charges
+        self.p3m = BooleanVar(
+            value=settings["p3m"])             # whether or not particle-mesh engine sums close pairs
+        self.overlay_mode = StringVar(
+            value=settings["overlay"])         # what field overlay draws
+        self.turbo = BooleanVar(
+            value=settings["turbo"])           # whether or not to run as fast as possible
+        self.binary = BooleanVar(
+            value=settings["binary"])          # whether or not to save binary files
+        self.record_runs = BooleanVar(
+            value=settings["record"])          # whether or not to record runs for replay
+        self.replay_speed = DoubleVar(value=1.0) # replay seconds per real second
+        self.speed_options = [                 # replay speed options in menu
+            0.25, 0.5, 1.0, 2.0, 4.0, 8.0]
+        self.replaying = False                 # whether or not last run is being replayed
+        self._replay_time = 0.0                # time of last run being shown
+        self._scrub = None                     # x of mouse and replay time when
+                                               # clock was grabbed
+        try:
+            self.sim.trajectories = TrajectoryCache()
+        except(OSError):
+            pass                               # runs are recorded but not cached
+        self._last = 0.0                       # value of last call to time.time()
+        self._shown = None                     # snapshot drawn last
+        self._shown_steps = 0                  # steps taken when it was drawn
+        self._due = 0.0                        # when update_sim should run next
+        self.show_profiler = BooleanVar(
+            value=settings["profiler"])        # whether or not to show profiler overlay
+        self.autosave = IntVar(
+            value=settings["autosave"])        # minutes between checkpoints (0 if never)
+        self.autosave_options = [              # autosave options in menu
+            1, 5, 15, 30, 60]
+        self.encounter_policy = StringVar(
+            value=settings["encounters"])      # what is done about close charges
+        self.encounter_radius = IntVar(
+            value=settings["radius"])          # distance charges are close at
+        self.radius_options = [                # encounter radius options in menu
+            10, 20, 30, 40, 60]
+        self.escape_size = IntVar(
+            value=settings["escape"])          # size of region charges escape
+                                               # from in canvas sizes (0 if never)
+        self.escape_options = [                # escape region options in menu
+            1, 2, 3, 5, 10]
+        self.auto_stop = BooleanVar(
+            value=settings["autostop"])        # whether or not to stop when all
+                                               # charges escaped or are at rest
+        self._erased = 0                       # escaped charges already erased
+        self._last_frame = 0.0                 # time.time() of last screen update
         self.set_filename("")                  # name of file currently open
 
         self.create_widgets()
         self.create_menu()
+        self.overlay = FieldOverlay(self.canvas) # picture of field behind charges
+        self._index = {}                       # charges by canvas item id
+        self._lines = []                       # points of traced field lines
+        self._lines_key = None                 # charges and region lines were traced for
+        self._pool = None                      # processes tracing field lines
+        self._results = None                   # lines coming from _pool
+        self._undrawn = []                     # charges read from file not yet drawn
+        self.grid_spacing.trace("w", self.refresh_overlay)
+        self.grid_spacing.trace("w", self.set_engine)
+        self.set_engine()
+        self.show_profile()
         # schedule function call to update simulation every DELAY milliseconds
         master.after(Application.DELAY, self.update_sim)
 
@@ -375,6 +4406,9 @@ class Application(Frame):
                                   command=self.save)
         self.filemenu.add_command(label="Save As...", underline=5,
                                   command=self.save_as)
+        self.filemenu.add_separator()
+        self.filemenu.add_command(label="Export Profile...", underline=0,
+                                  command=self.export_profile)
 
         # Charges
         self.chargemenu = Menu(self.menubar, tearoff=False)
@@ -382,7 +4416,18 @@ class Application(Frame):
                                     command=self.add_fixed)
         self.chargemenu.add_command(label="Moveable Charge", underline=0,
                                     command=self.add_moveable)
+        self.chargemenu.add_command(label="Tracer", underline=0,
+                                    command=self.add_tracer)
+        self.chargemenu.add_command(label="Generate...", underline=0,
+                                    command=self.generate_window)
         self.chargemenu.add_separator()
+        self.chargemenu.add_command(label="Trace Field Lines", underline=0,
+                                    command=self.trace_lines)
+        self.chargemenu.add_command(label="Remove Field Lines", underline=7,
+                                    command=self.remove_lines)
+        self.chargemenu.add_separator()
+        self.chargemenu.add_command(label="Remove Tracers", underline=2,
+                                    command=self.remove_tracers)
         self.chargemenu.add_command(label="Clear Screen", underline=0,
                                     command=self.clear)
 
@@ -400,6 +4445,96 @@ class Application(Frame):
 
         self.setmenu.add_cascade(label="Grid Spacing", underline=5, menu=submenu)
         self.setmenu.add_separator()
+        submenu = Menu(self.setmenu, tearoff=False)
+        for name in sorted(ENGINES):
+            submenu.add_radiobutton(label=ENGINES[name].NAME,
+                                    var=self.engine_name, value=name,
+                                    command=self.set_engine)
+        for name in ENGINES:
+            if ENGINES[name].NUMPY and numpy == None:
+                submenu.entryconfig(ENGINES[name].NAME, state=DISABLED)
+        submenu.add_separator()
+        submenu.add_checkbutton(label="Round Forces", underline=0,
+                                variable=self.round_forces,
+                                command=self.set_engine)
+        submenu.add_checkbutton(label="Cache Fixed Charges", underline=0,
+                                variable=self.cache_fixed,
+                                command=self.set_cache)
+        thetamenu = Menu(submenu, tearoff=False)
+        for num in self.theta_options:
+            thetamenu.add_radiobutton(label=str(num), var=self.theta,
+                                      value=num, command=self.set_engine)
+        submenu.add_cascade(label="Opening Angle", underline=0, menu=thetamenu)
+        meshmenu = Menu(submenu, tearoff=False)
+        for name in ParticleMeshEngine.ASSIGNMENTS:
+            meshmenu.add_radiobutton(label=name.upper(), var=self.assignment,
+                                     value=name, command=self.set_engine)
+        submenu.add_cascade(label="Mesh Assignment", underline=0, menu=meshmenu)
+        submenu.add_checkbutton(label="P3M Correction", underline=0,
+                                variable=self.p3m, command=self.set_engine)
+        submenu.add_separator()
+        submenu.add_command(label="Measure Error", underline=0,
+                            command=self.show_error)
+        self.setmenu.add_cascade(label="Force Engine", underline=0, menu=submenu)
+        submenu = Menu(self.setmenu, tearoff=False)
+        for num in self.dt_options:
+            submenu.add_radiobutton(label=str(num), var=self.dt, value=num,
+                                    command=self.set_dt)
+        self.setmenu.add_cascade(label="Time Step", underline=0, menu=submenu)
+        submenu = Menu(self.setmenu, tearoff=False)
+        for name in sorted(INTEGRATORS):
+            submenu.add_radiobutton(label=INTEGRATORS[name].NAME,
+                                    var=self.integrator_name, value=name,
+                                    command=self.set_integrator)
+        submenu.add_separator()
+        tolerancemenu = Menu(submenu, tearoff=False)
+        for num in self.tolerance_options:
+            tolerancemenu.add_radiobutton(label=str(num), var=self.tolerance,
+                                          value=num,
+                                          command=self.set_integrator)
+        submenu.add_cascade(label="Tolerance", underline=1, menu=tolerancemenu)
+        submenu.add_command(label="Statistics", underline=0,
+                            command=self.show_integrator_stats)
+        self.setmenu.add_cascade(label="Integrator", underline=0, menu=submenu)
+        submenu = Menu(self.setmenu, tearoff=False)
+        for policy in Simulation.POLICIES:
+            submenu.add_radiobutton(label=policy.capitalize(),
+                                    var=self.encounter_policy, value=policy,
+                                    command=self.set_encounters)
+        submenu.add_separator()
+        radiusmenu = Menu(submenu, tearoff=False)
+        for num in self.radius_options:
+            radiusmenu.add_radiobutton(label=str(num), var=self.encounter_radius,
+                                       value=num, command=self.set_encounters)
+        submenu.add_cascade(label="Radius", underline=0, menu=radiusmenu)
+        self.setmenu.add_cascade(label="Encounters", underline=1, menu=submenu)
+        submenu = Menu(self.setmenu, tearoff=False)
+        submenu.add_radiobutton(label="Never", var=self.escape_size, value=0)
+        for num in self.escape_options:
+            submenu.add_radiobutton(label=str(num)+"x Canvas",
+                                    var=self.escape_size, value=num)
+        submenu.add_separator()
+        submenu.add_checkbutton(label="Auto Stop", underline=0,
+                                variable=self.auto_stop)
+        self.setmenu.add_cascade(label="Escape", underline=1, menu=submenu)
+        self.setmenu.add_checkbutton(label="Turbo", underline=0,
+                                     variable=self.turbo,
+                                     command=self.set_turbo)
+        submenu = Menu(self.setmenu, tearoff=False)
+        for mode in FieldOverlay.MODES:
+            submenu.add_radiobutton(label=mode.capitalize(),
+                                    var=self.overlay_mode, value=mode,
+                                    command=self.refresh_overlay)
+        self.setmenu.add_cascade(label="Field Overlay", underline=1, menu=submenu)
+        self.setmenu.add_checkbutton(label="Binary Files", underline=0,
+                                     variable=self.binary)
+        self.setmenu.add_checkbutton(label="Record Runs", underline=2,
+                                     variable=self.record_runs,
+                                     command=self.set_record)
+        self.setmenu.add_checkbutton(label="Profiler", underline=0,
+                                     variable=self.show_profiler,
+                                     command=self.show_profile)
+        self.setmenu.add_separator()
         self.setmenu.add_checkbutton(label="Display Minutes", underline=0,
                                      variable=self.clock.display_min,
                                      command=self.clock.update_val)
@@ -408,6 +4543,37 @@ class Application(Frame):
         self.menubar.add_cascade(label="Charges", underline=0, menu=self.chargemenu)
         self.menubar.add_cascade(label="Settings", underline=0, menu=self.setmenu)
 
+        # Replay
+        self.replaymenu = Menu(self.menubar, tearoff=False)
+        self.replaymenu.add_command(label="Play/Pause", underline=0,
+                                    command=self.toggle_replay)
+        self.replaymenu.add_command(label="Rewind", underline=0,
+                                    command=self.rewind)
+        submenu = Menu(self.replaymenu, tearoff=False)
+        for num in self.speed_options:
+            submenu.add_radiobutton(label=str(num)+"x", var=self.replay_speed,
+                                    value=num)
+        self.replaymenu.add_cascade(label="Speed", underline=0, menu=submenu)
+        self.replaymenu.add_separator()
+        self.replaymenu.add_command(label="Clear Cache", underline=0,
+                                    command=self.clear_cache)
+        self.menubar.add_cascade(label="Replay", underline=0, menu=self.replaymenu)
+
+        # Checkpoint
+        self.checkmenu = Menu(self.menubar, tearoff=False)
+        self.checkmenu.add_command(label="Save Checkpoint...", underline=0,
+                                   command=self.save_checkpoint)
+        self.checkmenu.add_command(label="Resume Checkpoint...", underline=0,
+                                   command=self.open_checkpoint)
+        submenu = Menu(self.checkmenu, tearoff=False)
+        submenu.add_radiobutton(label="Off", var=self.autosave, value=0,
+                                command=self.set_autosave)
+        for num in self.autosave_options:
+            submenu.add_radiobutton(label=str(num)+" min", var=self.autosave,
+                                    value=num, command=self.set_autosave)
+        self.checkmenu.add_cascade(label="Autosave", underline=0, menu=submenu)
+        self.menubar.add_cascade(label="Checkpoint", underline=0, menu=self.checkmenu)
+
     def create_widgets(self):
         """ Put all widgets on the screen. """
         # canvas - where charges will be displayed
@@ -419,6 +4585,7 @@ class Application(Frame):
         self._canvas.bind("<ButtonPress-1>", self.grab_charge, True)
         self._canvas.bind("<ButtonRelease-1>", self.release_charge)
         self._canvas.bind("<ButtonPress-3>", self.post_charge_menu, True)
+        self._canvas.bind("<Configure>", self.refresh_overlay)
         self._canvas.place(x=0, y=40, relwidth=1.0, relheight=1.0)
 
         # start/pause button - starts and pauses simulation
@@ -449,9 +4616,15 @@ class Application(Frame):
         self.resetBttn.place(x=106, y=20, height=20)
 
         # clock label - how long simulation has been running
-        self.clock = Clock()
+        self.clock = Clock(self.settings["minutes"])
+        self.clock.bind("<ButtonPress-1>", self.grab_clock)
+        self.clock.bind("<B1-Motion>", self.scrub)
         self.clock.place(x=10, y=0, height=20)
 
+        # steps label - how many steps were taken for the last frame
+        self.stepsLabel = Label(self, text="0 steps/frame")
+        self.stepsLabel.place(x=165, y=0, height=20)
+
         # stop time entry field - when to stop simulation
         Label(self, text="stop:").place(x=80, y=0, height=20)
         self.sTime = Entry(self, width=5)
@@ -530,43 +4703,93 @@ class Application(Frame):
             self.set_filename(path)
             self.save()
 
+    def save_checkpoint(self):
+        """ Open dialog box so user can save the state of the run. """
+        saveWindow = FileDialog.SaveFileDialog(self.master, "Save Checkpoint")
+        path = saveWindow.go(pattern="*.efc")
+        if path != None:
+            if os.path.splitext(path)[1] != ".efc":
+                path += ".efc"
+            if not self.running:
+                self.sim.stop_time = self.get_stop_time()
+            # taken between steps so the run can go on
+            self.worker.call(self.sim.write_checkpoint, path)
+
+    def open_checkpoint(self):
+        """ Open dialog box so user can pick a checkpoint to carry on
+            from. The run is paused at the time of the checkpoint. """
+        openWindow = FileDialog.LoadFileDialog(self.master, "Resume Checkpoint")
+        path = openWindow.go(pattern="*.efc")
+        if path == None:
+            return
+        if self.running:
+            self.stop()
+        self.clear()
+        try:
+            self.worker.call(self.sim.read_checkpoint, path)
+        except(IOError, struct.error), error:
+            tkMessageBox.showerror("Error", "Cannot resume checkpoint: "+str(error))
+            return
+        self.show_loaded()
+        self.set_filename("")
+        self.begin_run()
+        self.clock.value = self.sim.time
+
+    def set_autosave(self):
+        """ Change time between checkpoints of runs from setting. """
+        self.worker.call(setattr, self.sim, "autosave_interval",
+                         self.autosave.get() * 60)
+
     def write_file(self, filename):
         """ Save charge data to file. """
-        file = open(filename, "w")
-        # write stop time
-        file.write(self.sTime.get()+"\n")
-        # write charge data
-        for chg in self.charges:
-            if type(chg) == Charge:
-                data = "f "+str(chg.charge)+" "+str(chg.x)+" "+str(chg.y)+"\n"
-            elif type(chg) == Moveable:
-                data = "m "+str(chg.charge)+" "+str(chg.x0)+" "+str(chg.y0)+" "+str(chg.dx0)+" "+str(chg.dy0)+"\n"
-            file.write(data)
-        file.close()
+        start = time.time()
+        self.sim.stop_time = self.get_stop_time()
+        self.sim.write_file(filename, self.binary.get())
+        self.profiler.add("save", time.time() - start)
 
     def read_file(self, filename):
         """ Put charges on screen based on data from file. """
-        file = open(filename, "r")
-        time = file.readline().strip()
-        data = file.readlines()
-        file.close()
+        start = time.time()
+        self.clear()
+        self.sim.read_file(filename)
+        self.profiler.add("load", time.time() - start)
+        self.show_loaded()
+
+    def show_loaded(self):
+        """ Show stop time, settings and charges of simulation that was
+            read from a file. """
         # insert stop time
         self.sTime.delete(0, END)
-        if time != "":
-            self.sTime.insert(0, time)
-        # add charges
-        self.clear()
-        for string in data:
-            info = string.strip().split(" ")
-            charge = float(info[1])
-            x = int(info[2])
-            y = int(info[3])
-            if info[0] == "f":
-                self.add_fixed(charge, x, y)
-            else:
-                dx0 = float(info[4])
-                dy0 = float(info[5])
-                self.add_moveable(charge, x, y, dx0, dy0)
+        if self.sim.stop_time != None:
+            self.sTime.insert(0, config(self.sim.stop_time))
+        # engine settings
+        self.engine_name.set(self.sim.engine_name)
+        self.round_forces.set(self.sim.rounded)
+        self.assignment.set(self.sim.assignment)
+        self.p3m.set(self.sim.p3m)
+        self.cache_fixed.set(self.sim.cache_fixed)
+        self.theta.set(self.sim.theta)
+        self.dt.set(self.sim.dt)
+        self.integrator_name.set(self.sim.integrator_name)
+        self.tolerance.set(self.sim.tolerance)
+        # particle-mesh engine uses the grid
+        self.grid_spacing.set(self.sim.mesh_spacing)
+        self.encounter_policy.set(self.sim.encounter_policy)
+        # radius menu holds whole numbers of pixels
+        self.encounter_radius.set(int(round(self.sim.encounter_radius)))
+        # draw charges a batch at a time so large files do not freeze the
+        # window (charges that escaped before a checkpoint are not drawn)
+        self._undrawn = []
+        self.draw_charges([chg for chg in self.charges if chg.active])
+
+    def draw_pending(self):
+        """ Draw the next batch of charges waiting to be drawn. """
+        for i in xrange(min(Application.DRAW_BATCH, len(self._undrawn))):
+            self._undrawn.pop().draw(self.canvas, self._index)
+        if len(self._undrawn) > 0:
+            self.master.after(1, self.draw_pending)
+        else:
+            self.refresh_overlay()
 
     def evaluate(self, event):
         """ Stops other bindings from executing if simulation is running. """
@@ -576,27 +4799,44 @@ class Application(Frame):
     def start_pause(self):
         """ Starts and pauses simulation. """
         if not self.running:
-            self.menubar.entryconfig(1, state=DISABLED)
-            self.menubar.entryconfig(2, state=DISABLED)
-            self.menubar.entryconfig(3, state=DISABLED)
-            self.deselect()
-            self.running = True
-            self._stop_time = self.get_stop_time()
-            self.sTime.config(state=DISABLED)
+            # replay run of same scene instead of simulating it again
+            self.sim.stop_time = self.get_stop_time()
+            self.sim.bounds = self.escape_bounds()
+            self.sim.auto_stop = self.auto_stop.get()
+            if self.sim.load_cached():
+                self._replay_time = 0.0
+                self.replaying = False
+                self.toggle_replay()
+                return
+            self.worker.call(self.sim.start)
+            self.begin_run()
             self.clock.reset()
         self.paused = not self.paused
-        # configure button and start or stop clock
+        # configure button
         if self.paused:
-            self.clock.stop()
+            self.worker.pause()
             self.spBttn.config(text="Start",
                                background="#00c000",
                                activebackground="#00a000")
         else:
-            self.clock.start()
+            self.worker.resume()
             self.spBttn.config(text="Pause",
                                background="#eeee00",
                                activebackground="#cece00")
 
+    def begin_run(self):
+        """ Lock charges and settings for a run of the simulation. """
+        self.menubar.entryconfig(1, state=DISABLED)
+        self.menubar.entryconfig(2, state=DISABLED)
+        self.menubar.entryconfig(3, state=DISABLED)
+        self.deselect()
+        self.running = True
+        self.replaying = False
+        self.sTime.config(state=DISABLED)
+        self._shown = self.worker.snapshot
+        self._shown_steps = self.sim.steps
+        self._erased = len(self.sim.escaped)
+
     def stop(self):
         """ Stops simulation and resests charges' velocities. """
         self.running = False
@@ -605,10 +4845,8 @@ class Application(Frame):
         self.menubar.entryconfig(2, state=NORMAL)
         self.menubar.entryconfig(3, state=NORMAL)
         self.sTime.config(state=NORMAL)
-        self.clock.stop()
-        for charge in self.charges:
-            if type(charge) == Moveable:
-                charge.reset_vel()
+        self.worker.pause()
+        self.worker.call(self.sim.stop)
         # configure button
         self.spBttn.config(text="Start",
                            background="#00c000",
@@ -617,36 +4855,266 @@ class Application(Frame):
     def reset(self):
         """ Reset all charges to their initial positions. """
         self.clock.reset()
-        for charge in self.charges:
-            if type(charge) == Moveable:
-                charge.reset()
+        self.replaying = False
+        self._replay_time = 0.0
+        merged = list(self.sim.merged)
+        self.worker.call(self.sim.reset)
+        self._shown_steps = 0
+        self._erased = 0
+        # escaped charges are drawn again since they are moveable again
+        self.redraw()
+        # give merged charges their colors back
+        for chg in merged:
+            chg.update()
 
     def update_sim(self):
-        """ Update simulation when it is running. """
-        self.clock.tick()
-        if self.clock.value == self._stop_time:
-            self.stop()
-        if self.running and not self.paused:
-            # update positions of all moveable charges
-            for charge in self.charges:
-                if type(charge) == Moveable:
-                    charge.update_pos()
-            # sync calc coords with actual coords
-            for charge in self.charges:
-                if type(charge) == Moveable:
-                    charge.sync_calc()
+        """ Draw latest snapshot from physics worker when simulation is
+            running (at most every FRAME_DELAY) or next frame of replay. """
+        now = time.time()
+        # how late Tk ran this call (time spent handling other events)
+        late = max(0.0, now - self._due)
+        if self.running:
+            snap = self.worker.snapshot
+            if (snap is not self._shown and snap != None and (snap.finished or
+                now - self._last_frame >= Application.FRAME_DELAY / 1000.0)):
+                steps = snap.steps - self._shown_steps
+                text = str(steps)+" steps/frame"
+                if snap.encounters > 0:
+                    text += ", "+str(snap.encounters)+" close"
+                if snap.escaped > 0:
+                    text += ", "+str(snap.escaped)+" escaped"
+                self.stepsLabel.config(text=text)
+                self._shown = snap
+                self._shown_steps = snap.steps
+                self.clock.value = snap.time
+                self.erase_escaped(snap.escaped)
+                if snap.finished:
+                    self.stop()
+                    self.redraw()
+                    if snap.error != None:
+                        tkMessageBox.showerror("Error", "Simulation stopped: "+
+                                               str(snap.error))
+                else:
+                    self.draw_snapshot(snap)
+                self.end_frame(now, late, steps=steps)
+        elif self.replaying:
+            self.show_replay(self._replay_time +
+                             (now - self._last) * self.replay_speed.get())
+            self._last = now
+            if self._replay_time >= self.sim.trajectory.duration:
+                self.replaying = False
+            self.end_frame(now, late)
         # reschedule function call
+        self._due = time.time() + Application.DELAY / 1000.0
         self.master.after(Application.DELAY, self.update_sim)
 
+    def erase_escaped(self, escaped):
+        """ Remove images of charges that escaped since the last call, up
+            to the first 'escaped' of them. """
+        for escape in self.sim.escaped[self._erased:escaped]:
+            escape.charge.erase()
+        self._erased = max(self._erased, escaped)
+
+    def escape_bounds(self):
+        """ Return region charges escape from: escape_size times the size of
+            the canvas around its center (None if charges never escape). """
+        size = self.escape_size.get()
+        if size == 0:
+            return None
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        return ((1 - size) * width / 2.0, (1 - size) * height / 2.0,
+                (1 + size) * width / 2.0, (1 + size) * height / 2.0)
+
+    def end_frame(self, start, late, **values):
+        """ Give timings of frame drawn by update_sim call made at 'start'
+            to profiler. """
+        self.profiler.add("tk", late)
+        self.profiler.add("update", time.time() - start)
+        self.profiler.end_frame(**values)
+
+    def redraw(self):
+        """ Sync images of all moveable charges with their positions. """
+        self._last_frame = time.time()
+        views = self.sim.store.views
+        for i in self.sim.store.moveables():
+            views[i].update()
+        # fixed charges change color when they take in other charges
+        for chg in self.sim.merged:
+            chg.update()
+        self.profiler.add("draw", time.time() - self._last_frame)
+        self.refresh_overlay()
+
+    def draw_snapshot(self, snap):
+        """ Move images of moveable charges to positions in 'snap'. """
+        self._last_frame = time.time()
+        views = self.sim.store.views
+        for k in xrange(len(snap.idx)):
+            views[snap.idx[k]].update(snap.x[k], snap.y[k])
+        self.profiler.add("draw", time.time() - self._last_frame)
+        self.refresh_overlay()
+
+    def refresh_overlay(self, *args):
+        """ Update field overlay to match settings and charges. During a run
+            moveable charges are taken from the last snapshot drawn since the
+            physics worker is moving them. """
+        start = time.time()
+        self.overlay.configure(self.overlay_mode.get(), self.grid_spacing.get(),
+                               self.canvas.winfo_width(),
+                               self.canvas.winfo_height())
+        moving = None
+        snap = self._shown
+        if self.running and snap != None:
+            views = self.sim.store.views
+            moving = [(snap.x[k], snap.y[k], snap.q[k])
+                      for k in xrange(len(snap.idx))
+                      if type(views[snap.idx[k]]) == Moveable]
+        self.overlay.update(self.charges, moving)
+        self.profiler.add("overlay", time.time() - start)
+
+    def show_profile(self):
+        """ Show profiler overlay on canvas and update it every
+            PROFILE_DELAY while it is turned on. """
+        self.canvas.delete("profile")
+        if not self.show_profiler.get():
+            return
+        lines = []
+        for name in self.profiler.sections():
+            stats = self.profiler.stats(name)
+            lines.append(name.ljust(8)+
+                         " p50 "+("%.2f" % (stats["p50"] * 1000)).rjust(7)+
+                         " p95 "+("%.2f" % (stats["p95"] * 1000)).rjust(7)+
+                         " max "+("%.2f" % (stats["max"] * 1000)).rjust(7)+" ms")
+        lines.append("%.1f steps/s  %.1f frames/s  %.1f close/s" % (
+            self.profiler.rate("steps"), self.profiler.rate("frames"),
+            self.profiler.rate("encounters")))
+        self.canvas.create_text(5, 5, anchor=NW, text="\n".join(lines),
+                                font=("Courier", 9), tag="profile")
+        self.master.after(Application.PROFILE_DELAY, self.show_profile)
+
+    def export_profile(self):
+        """ Open dialog box so user can save profiler data as CSV or JSON
+            (picked by extension). """
+        saveWindow = FileDialog.SaveFileDialog(self.master, "Export Profile")
+        path = saveWindow.go(pattern="*.json")
+        if path != None:
+            if os.path.splitext(path)[1] == ".csv":
+                self.profiler.write_csv(path)
+            else:
+                if os.path.splitext(path)[1] != ".json":
+                    path += ".json"
+                self.profiler.write_json(path)
+
+    def set_dt(self):
+        """ Set simulation time step from settings. """
+        self.sim.dt = self.dt.get()
+
+    def set_cache(self):
+        """ Turn caching of field of fixed charges on or off from setting. """
+        self.sim.set_cache(self.cache_fixed.get())
+
+    def set_turbo(self):
+        """ Turn turbo mode of physics worker on or off from setting. """
+        self.worker.turbo = self.turbo.get()
+
+    def set_record(self):
+        """ Turn recording of runs on or off from setting. """
+        self.sim.record = self.record_runs.get()
+
+    def toggle_replay(self):
+        """ Start or pause replay of last recorded run. """
+        if self.running or not self.sim.replayable:
+            self.replaying = False
+            return
+        self.replaying = not self.replaying
+        if self.replaying:
+            if self._replay_time >= self.sim.trajectory.duration:
+                self._replay_time = 0.0
+            self._last = time.time()
+
+    def clear_cache(self):
+        """ Delete all cached runs. """
+        self.replaying = False
+        self.sim.discard_trajectory()
+        if self.sim.trajectories != None:
+            self.sim.trajectories.clear()
+
+    def rewind(self):
+        """ Show start of last recorded run. """
+        self.show_replay(0.0)
+
+    def show_replay(self, t):
+        """ Show charges as they were at time 't' of last recorded run. """
+        if self.running or not self.sim.replayable:
+            self.replaying = False
+            return
+        self._replay_time = max(0.0, min(t, self.sim.trajectory.duration))
+        self.clock.value = self.sim.seek(self._replay_time)
+        self.redraw()
+
+    def grab_clock(self, event):
+        """ Start scrubbing through last recorded run. """
+        self._scrub = (event.x, self._replay_time)
+
+    def scrub(self, event):
+        """ Show time of last recorded run picked by dragging the clock. """
+        if self._scrub == None:
+            return
+        x, start = self._scrub
+        self.replaying = False
+        self.show_replay(start + (event.x - x) * Application.SCRUB *
+                         self.replay_speed.get())
+
+    def set_integrator(self):
+        """ Create integrator from integrator setting. """
+        self.sim.set_integrator(self.integrator_name.get(),
+                                self.tolerance.get())
+
+    def show_integrator_stats(self):
+        """ Display statistics of steps taken by integrator in last run. """
+        stats = self.sim.integrator.stats()
+        text = self.sim.integrator.NAME+" integrator:\n"
+        text += "force evaluations: "+str(stats["evals"])+"\n"
+        if "forces" in stats:
+            text += "forces on single charges: "+str(stats["forces"])+"\n"
+        text += "steps: "+str(stats["substeps"])+"\n"
+        text += "rejected steps: "+str(stats["rejected"])+"\n"
+        text += "error (last/max): "+str(stats["error"])+" / "+str(stats["max_error"])+"\n"
+        if stats["h"] != None:
+            text += "step size (last/min/max): "+str(stats["h"])+" / "+str(stats["h_min"])+" / "+str(stats["h_max"])
+        tkMessageBox.showinfo("Integrator Statistics", text)
+
+    def set_engine(self, *args):
+        """ Create force engine from engine settings. The particle-mesh
+            engine uses the grid spacing. """
+        self.sim.set_engine(self.engine_name.get(), self.round_forces.get(),
+                            self.theta.get(), self.grid_spacing.get(),
+                            self.assignment.get(), self.p3m.get())
+
+    def set_encounters(self):
+        """ Change what is done about close charges. """
+        self.sim.set_encounters(self.encounter_policy.get(),
+                                self.encounter_radius.get())
+
+    def show_error(self):
+        """ Display error of current engine compared to exact engine. """
+        max_err, rms_err, exact = self.sim.engine.measure_error(self.sim.store)
+        tkMessageBox.showinfo("Engine Error",
+                              self.sim.engine.NAME+" engine error compared to "+
+                              "exact "+exact+" engine:\n"+
+                              "max: "+config(round(max_err * 100, 4))+"%\n"+
+                              "rms: "+config(round(rms_err * 100, 4))+"%")
+
     def select_charge(self, event):
         """ Remember charge last clicked on. """
         overlapping = self.canvas.find_overlapping(event.x, event.y,
                                                    event.x, event.y)
-        if len(overlapping) > 0:
-            self.select(self.find(overlapping[0]))
+        # ignore items that are not charges (e.g. field overlay)
+        found = [self.find(id) for id in overlapping if self.find(id) != None]
+        if len(found) > 0:
+            self.select(found[0])
         else:
             self.deselect()
-        print self.selected#temp
 
     def select(self, charge):
         """ Select charge with 'id'. Put charge's charge in entry widget and give
@@ -660,7 +5128,7 @@ class Application(Frame):
         self.chargeEntry.insert(0, config(self.selected.charge))
         self.chargeEntry.selection_range(0, END)
         self.chargeEntry.focus_set()
-        if type(self.selected) == Moveable:
+        if isinstance(self.selected, Moveable):
             self.dxEntry.config(state=NORMAL)
             self.dyEntry.config(state=NORMAL)
             self.magEntry.config(state=NORMAL)
@@ -765,12 +5233,8 @@ class Application(Frame):
                 self.dyEntry.insert(0, config(dy))
 
     def find(self, id):
-        """ Return charge in list that has id. """
-        for charge in self.charges:
-            if charge.id == id:
-                return charge
-        # if charge not found return None
-        return None
+        """ Return charge that has id (None if there is no such charge). """
+        return self._index.get(id)
 
     def add_fixed(self, charge=0.0, x=None, y=None):
         """ Put a fixed charge on the screen. """
@@ -778,8 +5242,8 @@ class Application(Frame):
             x = self.grid_spacing.get()
         if y == None:
             y = self.grid_spacing.get()
-        charge = Charge(self, charge, x, y)
-        self.charges.append(charge)
+        self.sim.add_fixed(charge, x, y).draw(self.canvas, self._index)
+        self.refresh_overlay()
 
     def add_moveable(self, charge=0.0, x=None, y=None, dx0=0.0, dy0=0.0):
         """ Put a moveable charge on the screen. """
@@ -787,27 +5251,153 @@ class Application(Frame):
             x = self.grid_spacing.get()
         if y == None:
             y = self.grid_spacing.get()
-        charge = Moveable(self, charge, x, y, dx0, dy0)
-        self.charges.append(charge)
+        self.sim.add_moveable(charge, x, y, dx0, dy0).draw(self.canvas, self._index)
+        self.refresh_overlay()
+
+    def add_tracer(self, charge=0.0, x=None, y=None, dx0=0.0, dy0=0.0):
+        """ Put a tracer on the screen. """
+        if x == None:
+            x = self.grid_spacing.get()
+        if y == None:
+            y = self.grid_spacing.get()
+        self.sim.add_tracer(charge, x, y, dx0, dy0).draw(self.canvas, self._index)
+
+    def generate(self, shape, kind, count, size, charge, pattern):
+        """ Put many charges of class 'kind' in a shape from GENERATORS
+            around the center of the screen. 'size' is the radius of clouds and rings and half the
+            width of lattices and lines. """
+        cx = self.canvas.winfo_width() / 2.0
+        cy = self.canvas.winfo_height() / 2.0
+        if shape == "Lattice":
+            spacing = self.grid_spacing.get()
+            data = lattice_charges(cx - size, cy - size, cx + size, cy + size,
+                                   spacing, charge, pattern, kind)
+        elif shape == "Ring":
+            data = ring_charges(cx, cy, count, size, charge, pattern, kind)
+        elif shape == "Line":
+            data = line_charges(cx - size, cy, cx + size, cy, count, charge,
+                                pattern, kind)
+        else:
+            data = cloud_charges(cx, cy, count, size, charge, pattern,
+                                 kind, shape == "Gaussian Cloud")
+        self.draw_charges(self.sim.add_charges(*data))
+
+    def draw_charges(self, charges):
+        """ Draw charges just added to simulation a batch at a time. """
+        drawing = len(self._undrawn) > 0
+        # draw_pending takes charges from the end of the list
+        self._undrawn[:0] = reversed(charges)
+        if not drawing:
+            self.draw_pending()
 
     def remove_charge(self):
         """ Remove a charge from the screen. """
         selected = self.selected
         self.deselect()
         selected.erase()
-        self.charges.remove(selected)
+        self.sim.remove(selected)
+        self.refresh_overlay()
+
+    def remove_charges(self, charges):
+        """ Remove all charges in 'charges' from the screen. """
+        if self.selected in charges:
+            self.deselect()
+        for charge in charges:
+            charge.erase()
+        self.sim.remove_many(charges)
+        self.refresh_overlay()
+
+    def remove_tracers(self):
+        """ Remove all tracers from the screen at once. """
+        self.remove_charges([chg for chg in self.charges if type(chg) == Tracer])
 
     def clear(self):
         """ Remove all charges from screen. """
         self.deselect()
-        for charge in self.charges:
-            charge.erase()
-        self.charges = []
+        self.canvas.delete("charge")
+        self._index.clear()
+        self._undrawn = []
+        self.sim.clear()
+        self.remove_lines()
+        self.refresh_overlay()
+
+    def trace_lines(self):
+        """ Trace field lines from every charge in worker processes. Lines
+            are drawn as they come in. Lines from the last trace are reused if
+            the charges have not changed. """
+        sources = [(chg.x, chg.y, chg.charge) for chg in self.charges
+                   if chg.charge != 0 and type(chg) != Tracer]
+        bounds = (0, 0, self.canvas.winfo_width(), self.canvas.winfo_height())
+        key = (tuple(sources), bounds)
+        if key == self._lines_key and self._pool == None:
+            self.canvas.delete("fieldline")
+            for points in self._lines:
+                self.draw_line(points)
+            return
+        self.remove_lines()
+        self._lines = []
+        self._lines_key = key
+        seeds = FieldLineTracer(sources, bounds).seeds()
+        if len(seeds) == 0:
+            return
+        self._pool = multiprocessing.Pool(initializer=init_tracer,
+                                          initargs=(sources, bounds))
+        self._results = self._pool.imap_unordered(trace_line, seeds)
+        self.master.after(Application.DELAY, self.poll_lines)
+
+    def poll_lines(self):
+        """ Draw lines that have been traced so far. """
+        if self._pool == None:
+            return
+        try:
+            while True:
+                points = self._results.next(timeout=0)
+                self._lines.append(points)
+                self.draw_line(points)
+        except(multiprocessing.TimeoutError):
+            self.master.after(Application.DELAY, self.poll_lines)
+        except(StopIteration):
+            self._pool.close()
+            self._pool = None
+            self._results = None
+        self.canvas.tag_raise("charge")
+
+    def draw_line(self, points):
+        """ Draw field line through 'points'. """
+        if len(points) < 2:
+            return
+        coords = []
+        for x, y in points:
+            coords.append(x)
+            coords.append(y)
+        self.canvas.create_line(*coords, fill="#808080", tag="fieldline")
+
+    def remove_lines(self):
+        """ Stop tracing and remove field lines from screen. """
+        if self._pool != None:
+            self._pool.terminate()
+            self._pool = None
+            self._results = None
+            # lines were not finished so they cannot be reused
+            self._lines_key = None
+        self.canvas.delete("fieldline")
 
     def grab_charge(self, event):
         """ Make charge follow cursor around screen. """
         if self.selected != None:
-            self.canvas.bind("<Motion>", self.selected.follow)
+            self.canvas.bind("<Motion>", self.follow)
+
+    def follow(self, event):
+        """ Make selected charge follow cursor on screen. """
+        if self.grid_on.get():
+            spacing = self.grid_spacing.get()
+            x = int(event.x + spacing // 2) // spacing * spacing
+            y = int(event.y + spacing // 2) // spacing * spacing
+        else:
+            x = event.x
+            y = event.y
+        self.selected.place(x, y)
+        self.refresh_overlay()
 
     def release_charge(self, event):
         """ Release charge from following cursor around screen. """
@@ -831,6 +5421,12 @@ class Application(Frame):
             self.gWindow = Grid_Window(self)
         self.gWindow.focus_entry()
 
+    def generate_window(self):
+        """ Display window that generates charges. """
+        if self.genWindow == None:
+            self.genWindow = Generate_Window(self)
+        self.genWindow.focus_entry()
+
     def num_only(self, event):
         """ Bound to Entry widget to allow only numbers to be entered. """
         # do not break if pressed key is one of the following
@@ -893,7 +5489,7 @@ class Application(Frame):
             # entry widget is empty so let variable retain previous value
             pass
         else:
-            self.selected.charge = num
+            self.worker.call(setattr, self.selected, "charge", num)
         # dx0
         try:
             num = float(self.dxEntry.get())
@@ -901,7 +5497,7 @@ class Application(Frame):
             # entry widget is empty so let variable retain previous value
             pass
         else:
-            self.selected.dx0 = num
+            self.worker.call(setattr, self.selected, "dx0", num)
         # dy0
         try:
             num = -float(self.dyEntry.get()) # negative so +y-axis is up to user
@@ -909,9 +5505,41 @@ class Application(Frame):
             # entry widget is empty so let variable retain previous value
             pass
         else:
-            self.selected.dy0 = num
+            self.worker.call(setattr, self.selected, "dy0", num)
         # redraw to update any color change
         self.selected.update()
+        self.refresh_overlay()
+
+    def save_destroy(self):
+        """ Save settings and destroy root window. """
+        self.settings["grid"] = self.grid_on.get()
+        self.settings["spacing"] = self.grid_spacing.get()
+        self.settings["minutes"] = self.clock.display_min.get()
+        self.settings["engine"] = self.engine_name.get()
+        self.settings["rounding"] = self.round_forces.get()
+        self.settings["theta"] = self.theta.get()
+        self.settings["dt"] = self.dt.get()
+        self.settings["turbo"] = self.turbo.get()
+        self.settings["integrator"] = self.integrator_name.get()
+        self.settings["tolerance"] = self.tolerance.get()
+        self.settings["cache"] = self.cache_fixed.get()
+        self.settings["mesh"] = self.assignment.get()
+        self.settings["p3m"] = self.p3m.get()
+        self.settings["overlay"] = self.overlay_mode.get()
+        self.settings["binary"] = self.binary.get()
+        self.settings["record"] = self.record_runs.get()
+        self.settings["profiler"] = self.show_profiler.get()
+        self.settings["autosave"] = self.autosave.get()
+        self.settings["encounters"] = self.encounter_policy.get()
+        self.settings["radius"] = self.encounter_radius.get()
+        self.settings["escape"] = self.escape_size.get()
+        self.settings["autostop"] = self.auto_stop.get()
+        save_settings(self.settings)
+        self.remove_lines()
+        self.worker.quit()
+        self.sim.end_recording()
+        self.sim.discard_trajectory()
+        self.master.destroy()
 
     ### Properties ###
     ## canvas
@@ -919,6 +5547,11 @@ class Application(Frame):
         return self._canvas
     canvas = property(get_canvas)
 
+    ## charges
+    def get_charges(self):
+        return self.sim.charges
+    charges = property(get_charges)
+
     ## filename
     def get_filename(self):
         return self._filename
@@ -930,13 +5563,23 @@ class Application(Frame):
             self.master.title(Application.TITLE+" - "+os.path.basename(new_filename))
     filename = property(get_filename, set_filename)
 
-root = Tk()
+def main():
+    """ Create window and run application. """
+    root = Tk()
+
+    app = Application(root, load_settings())
 
-app = Application(root)
+    root.protocol("WM_DELETE_WINDOW", app.save_destroy)
+    root.title(Application.TITLE)
+    root.geometry("600x500")
+    root.config(menu=app.menubar)
 
-root.protocol("WM_DELETE_WINDOW", save_destroy)
-root.title(Application.TITLE)
-root.geometry("600x500")
-root.config(menu=app.menubar)
+    root.mainloop()
 
-root.mainloop()
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        sweep_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench_main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,114 @@
+""" Tests of the headless parts of e_field_simulation. Run with
+    python -m unittest test_e_field_simulation """
+import os, tempfile, time, unittest
+import e_field_simulation as efs
+
+class FileTest(unittest.TestCase):
+    """ Tests of scene files. """
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(".txt")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_encounter_radius_round_trip(self):
+        sim = efs.Simulation()
+        sim.set_encounters("elastic", 20)
+        sim.add_fixed(1.0, 10, 20)
+        sim.write_file(self.filename)
+        loaded = efs.Simulation()
+        loaded.read_file(self.filename)
+        self.assertEqual(loaded.encounter_policy, "elastic")
+        self.assertEqual(loaded.encounter_radius, 20)
+
+    def test_stop_time_round_trip(self):
+        sim = efs.Simulation()
+        sim.stop_time = 10
+        sim.add_fixed(1.0, 10, 20)
+        sim.write_file(self.filename)
+        loaded = efs.Simulation()
+        loaded.read_file(self.filename)
+        self.assertEqual(loaded.stop_time, 10)
+
+    def test_charges_round_trip(self):
+        sim = efs.Simulation()
+        sim.add_fixed(1.0 / 3, 10.1234567890123, 20)
+        sim.add_moveable(-2.0 / 3, 50.000000000001, 60.3333333333333)
+        sim.charges[1].dx0 = 0.1 / 7
+        sim.charges[1].dy0 = -1e-13
+        sim.write_file(self.filename)
+        loaded = efs.Simulation()
+        loaded.read_file(self.filename)
+        for name in ("q", "x0", "y0", "dx0", "dy0"):
+            self.assertEqual(list(getattr(loaded.store, name)),
+                             list(getattr(sim.store, name)))
+
+class SweepTest(unittest.TestCase):
+    """ Tests of checks made before a sweep starts worker processes. """
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(".txt")
+        os.close(handle)
+        handle, self.results = tempfile.mkstemp(".csv")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        os.remove(self.results)
+
+    def write_scene(self, stop_time):
+        sim = efs.Simulation()
+        sim.stop_time = stop_time
+        sim.add_fixed(1.0, 0, 0)
+        sim.add_moveable(-1.0, 100, 0)
+        sim.write_file(self.filename)
+
+    def test_no_stop_time(self):
+        self.write_scene(None)
+        self.assertRaises(ValueError, efs.Sweep, self.filename, self.results,
+                          [1.0], [0.0], [1.0])
+        self.assertRaises(SystemExit, efs.sweep_main,
+                          [self.filename, self.results])
+
+    def test_fixed_target(self):
+        self.write_scene(1.0)
+        self.assertRaises(ValueError, efs.Sweep, self.filename, self.results,
+                          [1.0], [0.0], [1.0], 0)
+        self.assertRaises(SystemExit, efs.sweep_main,
+                          [self.filename, self.results, "--charge", "0"])
+
+class WorkerTest(unittest.TestCase):
+    """ Tests of the physics worker thread. """
+
+    def test_step_error(self):
+        sim = efs.Simulation()
+        sim.add_moveable(-1.0, 100, 0)
+        def fail():
+            raise ValueError("bad step")
+        sim.step = fail
+        worker = efs.PhysicsWorker(sim, turbo=True)
+        worker.call(sim.start)
+        worker.resume()
+        end = time.time() + 5.0
+        while worker.snapshot == None and time.time() < end:
+            time.sleep(0.01)
+        snap = worker.snapshot
+        self.assertTrue(snap.finished)
+        self.assertTrue(isinstance(snap.error, ValueError))
+        # worker still answers calls after the error
+        self.assertEqual(worker.call(len, [1, 2]), 2)
+        worker.quit()
+
+    def test_same_position(self):
+        sim = efs.Simulation()
+        sim.set_engine("python")
+        sim.add_fixed(1.0, 50, 50)
+        sim.add_moveable(-1.0, 50, 50)
+        sim.start()
+        sim.step()
+        self.assertEqual(sim.steps, 1)
+
+if __name__ == "__main__":
+    unittest.main()